@@ -1,9 +1,10 @@
 from django.contrib import admin
 
-from .models import AnatomicalArea, Dataset, MLTask, Modality, Tag
+from .models import AnatomicalArea, Dataset, DatasetFile, MLTask, Modality, Tag
 
 admin.site.register(AnatomicalArea)
 admin.site.register(Dataset)
 admin.site.register(MLTask)
 admin.site.register(Modality)
 admin.site.register(Tag)
+admin.site.register(DatasetFile)
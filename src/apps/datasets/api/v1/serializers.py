@@ -1,6 +1,8 @@
 from rest_framework import serializers
 
+from apps.datasets import minhash
 from apps.datasets.models import *
+from apps.datasets.services import DatasetChangeService
 
 
 class AnatomicalAreaSerializer(serializers.ModelSerializer):
@@ -27,7 +29,22 @@ class TagSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
-class DatasetDetailedSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+    """
+    Serializer mixin that keeps only the fields listed in `context["fields"]`.
+
+    Works for nested serializers too, since they share the root's context.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        requested = self.context.get("fields")
+        if requested is None:
+            return fields
+        return {name: field for name, field in fields.items() if name in requested}
+
+
+class DatasetDetailedSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     anatomical_area_name = serializers.CharField(
         source="anatomical_area.name", read_only=True
     )
@@ -53,3 +70,130 @@ class DatasetDetailedSerializer(serializers.ModelSerializer):
             "created_at",
             "updated_at",
         ]
+
+
+class DatasetDuplicatesQuerySerializer(serializers.Serializer):
+    # Minimum estimated similarity of datasets. Lower thresholds than
+    # the LSH one are verified against every signature, which is slower.
+    threshold = serializers.FloatField(
+        min_value=0, max_value=1, default=round(minhash.THRESHOLD, 2)
+    )
+
+
+class DatasetDuplicateSerializer(serializers.Serializer):
+    similarity = serializers.FloatField()
+    dataset = DatasetDetailedSerializer()
+
+
+class DatasetNeighborSerializer(serializers.Serializer):
+    score = serializers.FloatField()
+    dataset = DatasetDetailedSerializer()
+
+
+class DatasetBulkQuerySerializer(serializers.Serializer):
+    # Maximum number of datasets requested at once
+    max_ids = 100
+
+    # Primary keys of datasets (comma-separated)
+    ids = serializers.CharField()
+
+    def validate_ids(self, value):
+        try:
+            ids = [int(id) for id in value.split(",") if id.strip()]
+        except ValueError:
+            raise serializers.ValidationError("Expected comma-separated integers.")
+        if not ids:
+            raise serializers.ValidationError("Provide at least one primary key.")
+        # Remove duplicates, keeping the requested order
+        ids = list(dict.fromkeys(ids))
+        if len(ids) > self.max_ids:
+            raise serializers.ValidationError(
+                f"Ensure there are no more than {self.max_ids} primary keys."
+            )
+        return ids
+
+
+class DatasetBulkResponseSerializer(serializers.Serializer):
+    results = DatasetDetailedSerializer(many=True)
+    # Requested primary keys that were not found
+    missing = serializers.ListField(child=serializers.IntegerField())
+
+
+class DatasetDownloadQuerySerializer(serializers.Serializer):
+    # Path of a single file relative to the dataset's local directory
+    # (the whole directory is downloaded as a zip archive by default)
+    path = serializers.CharField(required=False)
+
+
+class DatasetChangesQuerySerializer(serializers.Serializer):
+    # Cursor returned by the previous page (changes from the start by default)
+    cursor = serializers.CharField(required=False)
+    # Maximum number of log entries read per page
+    limit = serializers.IntegerField(default=100, min_value=1, max_value=1000)
+
+    def validate_cursor(self, value):
+        try:
+            return DatasetChangeService().decode_cursor(value)
+        except ValueError:
+            raise serializers.ValidationError("Invalid cursor.")
+
+
+class DatasetChangeSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    action = serializers.ChoiceField(choices=DatasetChange.ACTIONS)
+    # Current state of the dataset, empty for deleted datasets
+    dataset = DatasetDetailedSerializer(allow_null=True)
+
+
+class DatasetChangesResponseSerializer(serializers.Serializer):
+    # Cursor of the next page
+    cursor = serializers.CharField()
+    # Whether more changes can be read right away
+    has_more = serializers.BooleanField()
+    results = DatasetChangeSerializer(many=True)
+
+
+class DatasetFieldsQuerySerializer(serializers.Serializer):
+    """
+    Sparse fieldset of detailed datasets.
+
+    Either `fields` or `exclude` can be given (comma-separated).
+    """
+
+    fields = serializers.CharField(required=False)
+    exclude = serializers.CharField(required=False)
+
+    def _parse(self, value):
+        names = [name.strip() for name in value.split(",") if name.strip()]
+        unknown = set(names) - set(DatasetDetailedSerializer.Meta.fields)
+        if unknown:
+            raise serializers.ValidationError(
+                f"Unknown fields: {', '.join(sorted(unknown))}."
+            )
+        return names
+
+    def validate_fields(self, value):
+        return self._parse(value)
+
+    def validate_exclude(self, value):
+        return self._parse(value)
+
+    def validate(self, attrs):
+        """
+        Resolve the params into list of fields to keep (`None` is for all).
+        """
+        if "fields" in attrs and "exclude" in attrs:
+            raise serializers.ValidationError(
+                "Use either 'fields' or 'exclude', not both."
+            )
+        if "fields" in attrs:
+            return {"fields": attrs["fields"]}
+        if "exclude" in attrs:
+            return {
+                "fields": [
+                    name
+                    for name in DatasetDetailedSerializer.Meta.fields
+                    if name not in attrs["exclude"]
+                ]
+            }
+        return {"fields": None}
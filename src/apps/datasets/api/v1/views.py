@@ -1,12 +1,51 @@
-from rest_framework import generics, viewsets
+from django.core.exceptions import SuspiciousFileOperation
+from rest_framework import generics, status, viewsets
+from rest_framework.decorators import action
 from rest_framework.response import Response
 
-from apps.datasets.services import DatasetService
+from apps.datasets import downloads
+from apps.datasets.models import Dataset, DatasetChange
+from apps.datasets.services import (DatasetChangeService,
+                                    DatasetDownloadService,
+                                    DatasetDuplicateService,
+                                    DatasetNeighborService, DatasetService)
+from common import replicas
 
-from .serializers import DatasetDetailedSerializer
+from .serializers import (DatasetBulkQuerySerializer,
+                          DatasetBulkResponseSerializer,
+                          DatasetChangesQuerySerializer,
+                          DatasetChangesResponseSerializer,
+                          DatasetDetailedSerializer,
+                          DatasetDownloadQuerySerializer,
+                          DatasetDuplicateSerializer,
+                          DatasetDuplicatesQuerySerializer,
+                          DatasetFieldsQuerySerializer,
+                          DatasetNeighborSerializer)
 
 
-class DatasetsViewSet(viewsets.ReadOnlyModelViewSet):
+class DatasetFieldsMixin:
+    """
+    A viewset mixin that reads the requested sparse fieldset of datasets
+    (`?fields=` or `?exclude=` query params) into `.dataset_fields`.
+
+    The fieldset is passed to serializers through the context.
+    """
+
+    dataset_fields = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        query_serializer = DatasetFieldsQuerySerializer(data=request.query_params)
+        query_serializer.is_valid(raise_exception=True)
+        self.dataset_fields = query_serializer.validated_data["fields"]
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context["fields"] = self.dataset_fields
+        return context
+
+
+class DatasetsViewSet(DatasetFieldsMixin, viewsets.ReadOnlyModelViewSet):
     """
     Datasets API endpoint that allows datasets to be viewed only.
     """
@@ -17,8 +56,24 @@ class DatasetsViewSet(viewsets.ReadOnlyModelViewSet):
     def _dataset_service(self):
         return DatasetService()
 
+    @property
+    def _duplicate_service(self):
+        return DatasetDuplicateService()
+
+    @property
+    def _neighbor_service(self):
+        return DatasetNeighborService()
+
+    @property
+    def _change_service(self):
+        return DatasetChangeService()
+
+    @property
+    def _download_service(self):
+        return DatasetDownloadService()
+
     def get_queryset(self):
-        return self._dataset_service.get_all_detailed()
+        return self._dataset_service.get_all_detailed(fields=self.dataset_fields)
 
     def list(self, request):
         """
@@ -34,6 +89,169 @@ class DatasetsViewSet(viewsets.ReadOnlyModelViewSet):
         """
         if not pk:
             return Response("Provide primary key")
-        dataset = self._dataset_service.get_one_detailed(id=pk)
+        try:
+            dataset = self._dataset_service.get_one_detailed(
+                id=pk, fields=self.dataset_fields
+            )
+        except (Dataset.DoesNotExist, ValueError):
+            return Response("Dataset not found", status=status.HTTP_404_NOT_FOUND)
         serializer = self.get_serializer(dataset)
         return Response(serializer.data)
+
+    @action(detail=False, methods=["get"])
+    def bulk(self, request):
+        """
+        Get detailed information about several datasets in the requested order
+        """
+        query_serializer = DatasetBulkQuerySerializer(data=request.query_params)
+        if not query_serializer.is_valid():
+            return Response(query_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        ids = query_serializer.validated_data["ids"]
+        datasets = self._dataset_service.get_many_detailed(
+            ids, fields=self.dataset_fields
+        )
+        serializer = DatasetBulkResponseSerializer(
+            {
+                "results": [datasets[id] for id in ids if id in datasets],
+                "missing": [id for id in ids if id not in datasets],
+            },
+            context=self.get_serializer_context(),
+        )
+        return Response(serializer.data)
+
+    @action(detail=False, methods=["get"])
+    def changes(self, request):
+        """
+        Get datasets created, updated or deleted since the given cursor
+        """
+        query_serializer = DatasetChangesQuerySerializer(data=request.query_params)
+        if not query_serializer.is_valid():
+            return Response(query_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        # Datasets are read from the primary too, a lagging replica could
+        # miss the changed ones and they'd be reported as deleted
+        with replicas.use_primary():
+            changes, last_seq, has_more = self._change_service.changes(
+                after=query_serializer.validated_data.get("cursor", 0),
+                limit=query_serializer.validated_data["limit"],
+            )
+            datasets = self._dataset_service.get_many_detailed(
+                (id for id, action in changes if action != DatasetChange.DELETED),
+                fields=self.dataset_fields,
+            )
+        serializer = DatasetChangesResponseSerializer(
+            {
+                "cursor": self._change_service.encode_cursor(last_seq),
+                "has_more": has_more,
+                "results": [
+                    {
+                        "id": id,
+                        # Datasets deleted after the change are reported as deleted
+                        "action": action if id in datasets else DatasetChange.DELETED,
+                        "dataset": datasets.get(id),
+                    }
+                    for id, action in changes
+                ],
+            },
+            context=self.get_serializer_context(),
+        )
+        return Response(serializer.data)
+
+    @action(detail=True, methods=["get"])
+    def download(self, request, pk=None):
+        """
+        Download local files of a specific dataset: a single file
+        (resumable with `Range`) or a zip archive of its directory
+        """
+        query_serializer = DatasetDownloadQuerySerializer(data=request.query_params)
+        if not query_serializer.is_valid():
+            return Response(query_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            filename, path = self._download_service.get_file(
+                id=pk, path=query_serializer.validated_data.get("path", "")
+            )
+        except (Dataset.DoesNotExist, ValueError):
+            return Response("Dataset not found", status=status.HTTP_404_NOT_FOUND)
+        except IsADirectoryError:
+            return self._archive_response([int(pk)], f"dataset-{pk}.zip")
+        except (FileNotFoundError, SuspiciousFileOperation):
+            return Response("File not found", status=status.HTTP_404_NOT_FOUND)
+        return downloads.file_response(request, path, filename)
+
+    @action(detail=False, methods=["get"], url_path="download")
+    def bulk_download(self, request):
+        """
+        Download local files of several datasets as a zip archive
+        """
+        query_serializer = DatasetBulkQuerySerializer(data=request.query_params)
+        if not query_serializer.is_valid():
+            return Response(query_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        return self._archive_response(
+            query_serializer.validated_data["ids"], "datasets.zip"
+        )
+
+    def _archive_response(self, ids, filename):
+        try:
+            entries = self._download_service.get_archive_entries(ids)
+        except FileNotFoundError:
+            return Response("Files not found", status=status.HTTP_404_NOT_FOUND)
+        return downloads.zip_response(entries, filename)
+
+    @action(detail=True, methods=["get"])
+    def duplicates(self, request, pk=None):
+        """
+        Get datasets that are likely duplicates of a specific dataset
+        """
+        query_serializer = DatasetDuplicatesQuerySerializer(data=request.query_params)
+        if not query_serializer.is_valid():
+            return Response(query_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            duplicates = self._duplicate_service.possible_duplicates(
+                id=pk, threshold=query_serializer.validated_data["threshold"]
+            )
+        except (Dataset.DoesNotExist, ValueError):
+            return Response("Dataset not found", status=status.HTTP_404_NOT_FOUND)
+
+        datasets = self._dataset_service.get_many_detailed(
+            (id for id, _ in duplicates), fields=self.dataset_fields
+        )
+        serializer = DatasetDuplicateSerializer(
+            [
+                {"similarity": similarity, "dataset": datasets[id]}
+                for id, similarity in duplicates
+                if id in datasets
+            ],
+            many=True,
+            context=self.get_serializer_context(),
+        )
+        return Response(serializer.data)
+
+    @action(detail=True, methods=["get"])
+    def similar(self, request, pk=None):
+        """
+        Get datasets similar to a specific dataset
+        """
+        try:
+            neighbors = self._neighbor_service.get_neighbors(id=pk)
+            if not neighbors and not Dataset.objects.filter(id=pk).exists():
+                raise Dataset.DoesNotExist
+        except (Dataset.DoesNotExist, ValueError):
+            return Response("Dataset not found", status=status.HTTP_404_NOT_FOUND)
+
+        datasets = self._dataset_service.get_many_detailed(
+            (id for id, _ in neighbors), fields=self.dataset_fields
+        )
+        serializer = DatasetNeighborSerializer(
+            [
+                {"score": score, "dataset": datasets[id]}
+                for id, score in neighbors
+                if id in datasets
+            ],
+            many=True,
+            context=self.get_serializer_context(),
+        )
+        return Response(serializer.data)
@@ -0,0 +1,319 @@
+"""
+Downloads of local dataset files.
+
+Single files are sent without copying them through Python: either the web
+server is asked to send the file (`settings.DOWNLOADS["OFFLOAD"]`:
+`X-Accel-Redirect` for nginx, `X-Sendfile` for Apache and lighttpd), or
+the file is handed to the WSGI server as is, which sends it with
+`sendfile()` (e.g. gunicorn). Single byte ranges (`Range`) are supported
+for resumable downloads.
+
+Several files are sent as a zip archive that is built while it's sent:
+files are stored without compression and read in chunks, so neither
+temporary files nor whole files in memory are needed.
+"""
+
+import io
+import mimetypes
+import os
+import re
+import time
+import zipfile
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core import checks
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import (content_disposition_header, http_date,
+                               parse_http_date)
+
+_RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+# Earliest date a zip archive can store
+_ZIP_EPOCH = time.mktime((1980, 1, 1, 0, 0, 0, 0, 0, -1))
+OFFLOADS = ("x-accel-redirect", "x-sendfile")
+
+
+@checks.register
+def check_settings(app_configs, **kwargs):
+    """Validate `settings.DOWNLOADS` (`manage.py check`)."""
+    errors = []
+    options = settings.DOWNLOADS
+    if options["OFFLOAD"] and options["OFFLOAD"] not in OFFLOADS:
+        errors.append(
+            checks.Error(
+                f"Unknown DOWNLOADS_OFFLOAD: {options['OFFLOAD']!r}.",
+                hint=f"Use one of {', '.join(OFFLOADS)} or leave it empty.",
+                id="datasets.E001",
+            )
+        )
+    if options["OFFLOAD"] == "x-accel-redirect" and not options["ROOT"]:
+        errors.append(
+            checks.Error(
+                "DOWNLOADS_OFFLOAD=x-accel-redirect requires DOWNLOADS_ROOT.",
+                hint="Set it to the directory nginx serves at DOWNLOADS_ACCEL_PREFIX.",
+                id="datasets.E002",
+            )
+        )
+    return errors
+
+
+def resolve(root, path=""):
+    """
+    Absolute path of a file under the root.
+
+    Raises `SuspiciousFileOperation` if the path leads outside of the root
+    (`..`, absolute paths, symlinks) or outside of `settings.DOWNLOADS["ROOT"]`,
+    and `FileNotFoundError` if there is no such regular file.
+    """
+    root = os.path.realpath(root)
+    if not allowed(root):
+        raise SuspiciousFileOperation("Path is outside of the downloads root")
+
+    full_path = os.path.realpath(os.path.join(root, path))
+    if not _contains(root, full_path):
+        raise SuspiciousFileOperation("Path is outside of the dataset")
+    if not os.path.isfile(full_path):
+        raise FileNotFoundError(full_path)
+    return full_path
+
+
+def allowed(path):
+    """Whether the path is under `settings.DOWNLOADS["ROOT"]` (if it's set)"""
+    root = settings.DOWNLOADS["ROOT"]
+    return not root or _contains(os.path.realpath(root), os.path.realpath(path))
+
+
+def _contains(root, path):
+    return path == root or path.startswith(root.rstrip(os.sep) + os.sep)
+
+
+def parse_range(header, size):
+    """
+    Byte range requested by the `Range` header.
+
+    Only single ranges are supported, `None` is returned for others
+    (the whole file is sent then).
+    ---
+    Parameters:
+    - header: Value of the `Range` header
+    - size: Size of the file
+
+    Returns tuple (first byte, last byte), or `None` for the whole file.
+    Raises `ValueError` if the range can't be satisfied.
+    """
+    match = _RANGE_PATTERN.match(header.replace(" ", ""))
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise ValueError("Unsatisfiable range")
+        return max(size - length, 0), size - 1
+
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first >= size or first > last:
+        raise ValueError("Unsatisfiable range")
+    return first, last
+
+
+class FileWindow:
+    """
+    Part of an open file that looks like a whole file.
+
+    The position of the underlying file descriptor is kept in sync, so
+    WSGI servers can send the window with `sendfile()` by `fileno()`,
+    `Content-Length` bounds the sent bytes.
+    """
+
+    def __init__(self, file, start, length):
+        self._file = file
+        self._start = start
+        self._length = length
+        self.name = file.name
+        file.seek(start)
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._file.tell() - self._start
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.tell()
+        elif whence == io.SEEK_END:
+            offset += self._length
+        offset = min(max(offset, 0), self._length)
+        self._file.seek(self._start + offset)
+        return offset
+
+    def read(self, size=-1):
+        remaining = self._length - self.tell()
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        return self._file.read(size) if size > 0 else b""
+
+    def close(self):
+        self._file.close()
+
+
+def file_response(request, path, filename):
+    """
+    Response with the file as an attachment.
+    ---
+    Parameters:
+    - request: Request of the file
+    - path: Absolute path of the file (see `resolve()`)
+    - filename: Name of the downloaded file
+    """
+    offload = settings.DOWNLOADS["OFFLOAD"]
+    if offload == "x-accel-redirect" and not settings.DOWNLOADS["ROOT"]:
+        # Paths can't be mapped to the nginx location (see `check_settings()`)
+        offload = ""
+    if offload in OFFLOADS:
+        response = HttpResponse(
+            content_type=mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        )
+        if offload == "x-accel-redirect":
+            root = os.path.realpath(settings.DOWNLOADS["ROOT"])
+            response["X-Accel-Redirect"] = quote(
+                settings.DOWNLOADS["ACCEL_PREFIX"].rstrip("/")
+                + "/"
+                + os.path.relpath(path, root).replace(os.sep, "/")
+            )
+        else:
+            # Headers are Latin-1, both servers decode percent-encoded paths
+            response["X-Sendfile"] = quote(path)
+        response["Content-Disposition"] = content_disposition_header(True, filename)
+        return response
+
+    file = open(path, "rb")
+    stat = os.fstat(file.fileno())
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    conditional = get_conditional_response(
+        request, etag=etag, last_modified=int(stat.st_mtime)
+    )
+    if conditional is not None:
+        file.close()
+        return conditional
+
+    requested = None
+    if "Range" in request.headers and _if_range(request, etag, stat.st_mtime):
+        try:
+            requested = parse_range(request.headers["Range"], stat.st_size)
+        except ValueError:
+            file.close()
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{stat.st_size}"
+            return response
+
+    if requested is None:
+        response = FileResponse(file, as_attachment=True, filename=filename)
+    else:
+        first, last = requested
+        response = FileResponse(
+            FileWindow(file, first, last - first + 1),
+            as_attachment=True,
+            filename=filename,
+            status=206,
+        )
+        response["Content-Range"] = f"bytes {first}-{last}/{stat.st_size}"
+    response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(stat.st_mtime)
+    return response
+
+
+def _if_range(request, etag, mtime):
+    """Whether the range can be sent: `If-Range` is missing or still valid"""
+    validator = request.headers.get("If-Range")
+    if validator is None:
+        return True
+    if validator.startswith(('"', "W/")):
+        return validator == etag
+    try:
+        return parse_http_date(validator) == int(mtime)
+    except ValueError:
+        return False
+
+
+class _ChunkWriter:
+    """Unseekable file that keeps written data until it's taken."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def zip_chunks(entries, chunk_size):
+    """
+    Zip archive of the files, built while it's being read.
+    ---
+    Parameters:
+    - entries: Iterable of (name in the archive, absolute path)
+    - chunk_size: Number of bytes of a file read at once
+
+    Yields chunks of the archive.
+    """
+    writer = _ChunkWriter()
+    with zipfile.ZipFile(writer, "w", zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for name, path in entries:
+            try:
+                file = open(path, "rb")
+            except OSError:
+                # Removed since it was listed
+                continue
+            with file:
+                stat = os.fstat(file.fileno())
+                info = zipfile.ZipInfo(
+                    name, time.localtime(max(stat.st_mtime, _ZIP_EPOCH))[:6]
+                )
+                info.external_attr = (stat.st_mode & 0xFFFF) << 16
+                info.file_size = stat.st_size
+                with archive.open(info, "w") as target:
+                    while chunk := file.read(chunk_size):
+                        target.write(chunk)
+                        yield writer.take()
+            yield writer.take()
+    yield writer.take()
+
+
+def zip_response(entries, filename):
+    """
+    Streaming response with the zip archive of the files as an attachment.
+    ---
+    Parameters:
+    - entries: Iterable of (name in the archive, absolute path)
+    - filename: Name of the downloaded archive
+    """
+    response = StreamingHttpResponse(
+        (
+            chunk
+            for chunk in zip_chunks(entries, settings.DOWNLOADS["CHUNK_SIZE"])
+            if chunk
+        ),
+        content_type="application/zip",
+    )
+    response["Content-Disposition"] = content_disposition_header(True, filename)
+    return response
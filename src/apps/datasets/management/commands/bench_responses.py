@@ -0,0 +1,73 @@
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from common import compression
+from common.renderers import FastJSONRenderer, MessagePackRenderer
+
+RENDERERS = {
+    "json (drf)": JSONRenderer,
+    "json (fast)": FastJSONRenderer,
+    "msgpack": MessagePackRenderer,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure CPU time per response and response size of the datasets list "
+        "and search for every renderer and compression."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=50,
+            help="Number of times every response is rendered",
+        )
+        parser.add_argument(
+            "--query",
+            default="",
+            help="Search term of the measured search",
+        )
+
+    def handle(self, *args, **options):
+        client = APIClient()
+        payloads = {
+            "datasets list": client.get(
+                "/api/v1/datasets/", HTTP_ACCEPT="application/json"
+            ).data,
+            "search": client.post(
+                "/api/v1/search/datasets/",
+                {"query": options["query"]},
+                format="json",
+                HTTP_ACCEPT="application/json",
+            ).data,
+        }
+
+        for name, data in payloads.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(f"{name}:"))
+            self.stdout.write(
+                f"  {'renderer':<12} {'encoding':<9} {'bytes':>10} {'cpu ms':>9}"
+            )
+            for renderer_name, renderer_class in RENDERERS.items():
+                renderer = renderer_class()
+                for encoding in ("identity", *compression.ENCODERS):
+                    size, cpu = self._measure(
+                        renderer, data, encoding, options["repeat"]
+                    )
+                    self.stdout.write(
+                        f"  {renderer_name:<12} {encoding:<9} {size:>10}"
+                        f" {cpu * 1000:>9.3f}"
+                    )
+
+    def _measure(self, renderer, data, encoding, repeat):
+        """Size of the response and CPU seconds spent to render and compress it"""
+        started = time.process_time()
+        for _ in range(repeat):
+            body = renderer.render(data, renderer.media_type, {})
+            if encoding != "identity":
+                body = compression.compress(body, encoding)
+        return len(body), (time.process_time() - started) / repeat
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.datasets.services import CatalogSnapshotService
+
+
+class Command(BaseCommand):
+    help = "Build a memory-mapped snapshot of the catalog for worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Build the snapshot even if the catalog hasn't changed",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=None,
+            help=(
+                "Keep checking the catalog for changes every N seconds, "
+                "workers search in the database while their snapshot is stale"
+            ),
+        )
+
+    def handle(self, *args, **options):
+        service = CatalogSnapshotService()
+        force = options["force"]
+        while True:
+            version = service.build(force=force)
+            if version is not None:
+                self.stdout.write(self.style.SUCCESS(f"Built snapshot {version}"))
+            elif options["interval"] is None:
+                self.stdout.write("Snapshot is up to date")
+
+            if options["interval"] is None:
+                break
+            force = False
+            time.sleep(options["interval"])
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from apps.datasets.services import DatasetNeighborService
+
+
+class Command(BaseCommand):
+    help = "Recalculate lists of similar datasets for the whole catalog."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--top-k",
+            type=int,
+            default=DatasetNeighborService.top_k,
+            help="Number of neighbors stored per dataset",
+        )
+
+    def handle(self, *args, **options):
+        service = DatasetNeighborService()
+        service.top_k = options["top_k"]
+        count = service.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt neighbors of {count} datasets"))
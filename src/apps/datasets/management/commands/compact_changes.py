@@ -0,0 +1,23 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.datasets.services import DatasetChangeService
+
+
+class Command(BaseCommand):
+    help = "Remove entries of the change log superseded by later changes."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than",
+            type=float,
+            default=24,
+            help="Only entries older than this number of hours are removed",
+        )
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(hours=options["older_than"])
+        removed = DatasetChangeService().compact(before=before)
+        self.stdout.write(self.style.SUCCESS(f"Removed {removed} change log entries"))
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.datasets import minhash
+from apps.datasets.models import Dataset
+from apps.datasets.services import DatasetDuplicateService
+from common import replicas
+
+
+class Command(BaseCommand):
+    help = "Report clusters of datasets that are likely duplicates."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=round(minhash.THRESHOLD, 2),
+            help=(
+                "Minimum estimated similarity of datasets in a cluster "
+                f"({minhash.THRESHOLD:.2f}..1, LSH buckets miss pairs below it)"
+            ),
+        )
+        parser.add_argument(
+            "--rebuild",
+            action="store_true",
+            help="Recalculate signatures of all datasets first",
+        )
+
+    def handle(self, *args, **options):
+        if not minhash.THRESHOLD <= options["threshold"] <= 1:
+            raise CommandError(
+                f"Threshold must be between {minhash.THRESHOLD:.2f} and 1, "
+                "clusters are only looked for in LSH buckets"
+            )
+
+        # Signatures are read right after they are rebuilt
+        with replicas.use_primary():
+            service = DatasetDuplicateService()
+            if options["rebuild"]:
+                count = service.rebuild()
+                self.stdout.write(f"Rebuilt signatures of {count} datasets")
+
+            clusters = service.clusters(threshold=options["threshold"])
+            titles = dict(
+                Dataset.objects.filter(
+                    id__in=[id for cluster in clusters for id in cluster]
+                ).values_list("id", "title")
+            )
+            for number, cluster in enumerate(clusters, start=1):
+                self.stdout.write(f"Cluster {number} ({len(cluster)} datasets):")
+                for id in cluster:
+                    self.stdout.write(f"  {id}: {titles.get(id, '')}")
+
+            self.stdout.write(self.style.SUCCESS(f"Found {len(clusters)} clusters"))
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+
+from apps.datasets.services import DatasetDuplicateService, DatasetScanService
+from common import replicas
+
+
+class Command(BaseCommand):
+    help = "Scan local dataset files and update size and record count of datasets."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "ids", nargs="*", type=int, help="Datasets to scan (all by default)"
+        )
+        parser.add_argument(
+            "--workers", type=int, default=None, help="Number of worker processes"
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Re-read every file, even if it hasn't changed",
+        )
+
+    def handle(self, *args, **options):
+        stats = DatasetScanService().scan(
+            ids=options["ids"], workers=options["workers"], force=options["force"]
+        )
+
+        for dataset_id in stats["missing"]:
+            self.stderr.write(f"Dataset {dataset_id}: local path does not exist")
+        for error in stats["errors"]:
+            self.stderr.write(error)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Scanned {scanned} of {files} files in {datasets} datasets "
+                "({deleted} removed), updated {updated} datasets".format(**stats)
+            )
+        )
+
+        # Datasets created in bulk or before signatures were introduced,
+        # read from the primary since the scan has just updated them
+        with replicas.use_primary():
+            backfilled = DatasetDuplicateService().backfill()
+        if backfilled:
+            self.stdout.write(f"Built duplicate signatures of {backfilled} datasets")
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.7 on 2026-10-19 04:05
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('datasets', '0002_datasetfile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DatasetSignature',
+            fields=[
+                ('dataset', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='signature', serialize=False, to='datasets.dataset')),
+                ('minhash', models.BinaryField()),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DatasetSignatureBand',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('band', models.PositiveSmallIntegerField()),
+                ('bucket', models.BigIntegerField()),
+                ('dataset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='signature_bands', to='datasets.dataset')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['band', 'bucket'], name='datasets_da_band_d5fa59_idx')],
+                'unique_together': {('dataset', 'band')},
+            },
+        ),
+    ]
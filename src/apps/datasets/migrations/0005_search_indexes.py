@@ -0,0 +1,57 @@
+# Generated by Django 5.2.7 on 2026-10-19 04:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("datasets", "0004_datasetneighbor"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="dataset",
+            index=models.Index(
+                fields=["record_count"], name="datasets_da_record__07e016_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="dataset",
+            index=models.Index(fields=["size"], name="datasets_da_size_9e28c3_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="dataset",
+            index=models.Index(
+                fields=["created_at"], name="datasets_da_created_545e5b_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="dataset",
+            index=models.Index(
+                fields=["updated_at"], name="datasets_da_updated_cdb830_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="dataset",
+            index=models.Index(fields=["title"], name="datasets_da_title_850589_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="datasetmltask",
+            index=models.Index(
+                fields=["ml_task", "dataset"], name="datasets_da_ml_task_788e79_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="datasetmodality",
+            index=models.Index(
+                fields=["modality", "dataset"], name="datasets_da_modalit_981a71_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="datasettag",
+            index=models.Index(
+                fields=["tag", "dataset"], name="datasets_da_tag_id_32aed6_idx"
+            ),
+        ),
+    ]
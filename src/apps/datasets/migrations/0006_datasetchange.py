@@ -0,0 +1,55 @@
+# Generated by Django 5.2.7 on 2026-10-19 04:25
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def log_existing_datasets(apps, schema_editor):
+    """Start the change feed with every existing dataset"""
+    Dataset = apps.get_model("datasets", "Dataset")
+    DatasetChange = apps.get_model("datasets", "DatasetChange")
+    DatasetChange.objects.bulk_create(
+        (
+            DatasetChange(dataset_id=id, action="created")
+            for id in Dataset.objects.order_by("id").values_list("id", flat=True)
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("datasets", "0005_search_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DatasetChange",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                ("dataset_id", models.BigIntegerField()),
+                (
+                    "action",
+                    models.CharField(
+                        choices=[
+                            ("created", "Created"),
+                            ("updated", "Updated"),
+                            ("deleted", "Deleted"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                ("created_at", models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["dataset_id", "id"],
+                        name="datasets_da_dataset_d70b5f_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(log_existing_datasets, migrations.RunPython.noop),
+    ]
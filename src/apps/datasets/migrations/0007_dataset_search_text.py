@@ -0,0 +1,103 @@
+# Generated by Django 5.2.7 on 2026-10-19 04:28
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+
+# Frozen copy of `common.analysis` as of this migration, so the migration
+# gives the same result after the analyzer changes (re-run
+# `python manage.py reindex_search` after such changes instead)
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+_CYRILLIC_PATTERN = re.compile(r"^[а-я]+$")
+_LATIN_PATTERN = re.compile(r"^[a-z]+$")
+
+STOP_WORDS = frozenset("""
+    a an and are as at be by for from has have in into is it its of on or
+    that the their this to was were with within without
+
+    а без более бы был была были было быть в во вот все всех где да для до
+    его ее если есть еще же за и из или им их к как ко когда ли либо между
+    мы на над не нет ни но о об однако от по под при про с со так также то
+    только у уже чем что чтобы эта эти это этот
+    """.split())
+
+_RUSSIAN_ENDINGS = sorted(
+    """
+    ость ости остью остей остям остями остях
+    иями ями ами иях ях ах иям ям ам ией ием ей ем ом ой ий ый ия ии ию ью
+    ого его ому ему ыми ими ых их ая яя ое ее ые ие ую юю
+    ться тся ешь ете ите ают яют ует ют ут ат ят ить ать ять еть ла ли ло ть
+    ов ев а я о е у ю ы и ь й
+    """.split(),
+    key=len,
+    reverse=True,
+)
+_ENGLISH_ENDINGS = sorted(
+    """
+    ifications ification ified ifies ify
+    izations ization izing ized izes ize
+    ations ation nesses ness
+    ings ing edly ed ies ly es s e y
+    """.split(),
+    key=len,
+    reverse=True,
+)
+_MIN_STEM = 3
+
+
+def _strip_ending(word, endings):
+    for ending in endings:
+        if word.endswith(ending) and len(word) - len(ending) >= _MIN_STEM:
+            return word[: -len(ending)]
+    return word
+
+
+def stem(word):
+    if _CYRILLIC_PATTERN.match(word):
+        word = _strip_ending(word, _RUSSIAN_ENDINGS)
+        if word.endswith(("и", "ь")) and len(word) > _MIN_STEM:
+            word = word[:-1]
+        return word
+    if _LATIN_PATTERN.match(word) and not word.endswith("ss"):
+        return _strip_ending(word, _ENGLISH_ENDINGS)
+    return word
+
+
+def analyze(text):
+    text = unicodedata.normalize("NFKC", text).casefold().replace("ё", "е")
+    return [
+        stem(token) for token in _TOKEN_PATTERN.findall(text) if token not in STOP_WORDS
+    ]
+
+
+def index_text(*texts):
+    terms = dict.fromkeys(term for text in texts if text for term in analyze(text))
+    return f" {' '.join(terms)} " if terms else ""
+
+
+def index_existing_datasets(apps, schema_editor):
+    """Analyze title and description of every existing dataset"""
+    Dataset = apps.get_model("datasets", "Dataset")
+    datasets = []
+    for dataset in Dataset.objects.only("id", "title", "description").iterator():
+        dataset.search_text = index_text(dataset.title, dataset.description)
+        datasets.append(dataset)
+    Dataset.objects.bulk_update(datasets, ["search_text"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("datasets", "0006_datasetchange"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="dataset",
+            name="search_text",
+            field=models.TextField(blank=True, default="", editable=False),
+        ),
+        migrations.RunPython(index_existing_datasets, migrations.RunPython.noop),
+    ]
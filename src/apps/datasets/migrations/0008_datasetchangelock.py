@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-19 04:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("datasets", "0007_dataset_search_text"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DatasetChangeLock",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+            ],
+        ),
+    ]
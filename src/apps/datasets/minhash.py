@@ -0,0 +1,94 @@
+"""
+MinHash signatures and LSH banding for near-duplicate detection.
+
+Signature of a dataset is built from its title, description and tags.
+Two datasets end up in the same LSH bucket of at least one band with high
+probability when the Jaccard similarity of their shingles is above
+`~(1 / BANDS) ** (1 / ROWS)` (about 0.7 for the defaults).
+"""
+
+import hashlib
+import random
+import re
+import struct
+
+# Number of hash functions (length of a signature)
+NUM_PERM = 128
+# LSH banding: BANDS * ROWS must be equal to NUM_PERM
+BANDS = 16
+ROWS = 8
+# Similarity above which duplicates are found through LSH buckets reliably
+THRESHOLD = (1 / BANDS) ** (1 / ROWS)
+
+# Mersenne prime used for universal hashing
+_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+# Fixed seed, so signatures are comparable between processes and runs
+_rng = random.Random(0x6D656461)
+_PERMUTATIONS = [
+    (_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)
+]
+
+_WORD_RE = re.compile(r"\w+")
+_SIGNATURE_FORMAT = f"<{NUM_PERM}I"
+
+
+def _hash64(value):
+    return int.from_bytes(
+        hashlib.blake2b(value.encode(), digest_size=8).digest(), "little"
+    )
+
+
+def shingles(title, description="", tags=()):
+    """
+    Set of hashed shingles: word bigrams of the text plus every tag.
+    """
+    words = _WORD_RE.findall(f"{title or ''} {description or ''}".lower())
+    if len(words) < 2:
+        items = set(words)
+    else:
+        items = {f"{a} {b}" for a, b in zip(words, words[1:])}
+    items.update(f"tag:{tag.lower()}" for tag in tags)
+    return {_hash64(item) for item in items}
+
+
+def signature(hashes):
+    """
+    MinHash signature (list of `NUM_PERM` ints) of the given shingle hashes.
+    """
+    if not hashes:
+        return [_MAX_HASH] * NUM_PERM
+    return [
+        min((a * h + b) % _PRIME for h in hashes) & _MAX_HASH
+        for a, b in _PERMUTATIONS
+    ]
+
+
+def pack(sig):
+    """Pack signature to bytes (4 bytes per value)."""
+    return struct.pack(_SIGNATURE_FORMAT, *sig)
+
+
+def unpack(data):
+    """Unpack signature from bytes."""
+    return struct.unpack(_SIGNATURE_FORMAT, bytes(data))
+
+
+def bands(sig):
+    """
+    Yield `(band, bucket)` pairs of the signature.
+
+    Bucket is a signed 64-bit hash of the band's rows.
+    """
+    for band in range(BANDS):
+        rows = struct.pack(f"<{ROWS}I", *sig[band * ROWS : (band + 1) * ROWS])
+        bucket = int.from_bytes(
+            hashlib.blake2b(rows, digest_size=8).digest(), "little", signed=True
+        )
+        yield band, bucket
+
+
+def similarity(sig_a, sig_b):
+    """Estimated Jaccard similarity of two signatures."""
+    return sum(a == b for a, b in zip(sig_a, sig_b)) / NUM_PERM
@@ -1,6 +1,8 @@
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 
+from common import analysis
+
 
 class AnatomicalArea(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -30,6 +32,31 @@ class Tag(models.Model):
         return self.name
 
 
+class DatasetQuerySet(models.QuerySet):
+    """
+    Bulk operations that keep the search text in sync, as `Dataset.save()`
+    does (`QuerySet.update()` and raw SQL don't, see `reindex_search`).
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for dataset in objs:
+            dataset.search_text = analysis.index_text(
+                dataset.title, dataset.description
+            )
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        if {"title", "description"} & set(fields):
+            objs = list(objs)
+            for dataset in objs:
+                dataset.search_text = analysis.index_text(
+                    dataset.title, dataset.description
+                )
+            fields = {*fields, "search_text"}
+        return super().bulk_update(objs, fields, *args, **kwargs)
+
+
 class Dataset(models.Model):
     title = models.CharField(max_length=500)
     description = models.TextField(blank=True, null=True)
@@ -45,13 +72,40 @@ class Dataset(models.Model):
     tags = models.ManyToManyField(Tag, through="DatasetTag")
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(default=timezone.now)
+    # Analyzed terms of the title and description (see `common.analysis`)
+    search_text = models.TextField(blank=True, default="", editable=False)
+
+    objects = DatasetQuerySet.as_manager()
+
+    class Meta:
+        # Columns searches are filtered and ordered by
+        indexes = [
+            models.Index(fields=["record_count"]),
+            models.Index(fields=["size"]),
+            models.Index(fields=["created_at"]),
+            models.Index(fields=["updated_at"]),
+            models.Index(fields=["title"]),
+        ]
 
     def __str__(self):
         return self.title
 
     def save(self, *args, **kwargs):
         self.updated_at = timezone.now()
-        super().save(*args, **kwargs)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or {"title", "description"} & set(update_fields):
+            self.search_text = analysis.index_text(self.title, self.description)
+            if update_fields is not None:
+                kwargs["update_fields"] = {*update_fields, "search_text"}
+        created = self._state.adding
+        # The change is logged in the same transaction
+        with transaction.atomic():
+            DatasetChangeLock.acquire()
+            super().save(*args, **kwargs)
+            DatasetChange.objects.create(
+                dataset_id=self.pk,
+                action=DatasetChange.CREATED if created else DatasetChange.UPDATED,
+            )
 
 
 class DatasetModality(models.Model):
@@ -60,6 +114,8 @@ class DatasetModality(models.Model):
 
     class Meta:
         unique_together = ("dataset", "modality")
+        # Datasets filtered by modality are read from the index only
+        indexes = [models.Index(fields=["modality", "dataset"])]
 
 
 class DatasetMLTask(models.Model):
@@ -68,6 +124,8 @@ class DatasetMLTask(models.Model):
 
     class Meta:
         unique_together = ("dataset", "ml_task")
+        # Datasets filtered by ml task are read from the index only
+        indexes = [models.Index(fields=["ml_task", "dataset"])]
 
 
 class DatasetTag(models.Model):
@@ -76,3 +134,112 @@ class DatasetTag(models.Model):
 
     class Meta:
         unique_together = ("dataset", "tag")
+        # Datasets filtered by tag are read from the index only
+        indexes = [models.Index(fields=["tag", "dataset"])]
+
+
+class DatasetFile(models.Model):
+    """
+    Last known state of a file under `Dataset.local_path`.
+
+    Used by the scanner to detect changes without re-reading file contents.
+    """
+
+    dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE, related_name="files")
+    # Path relative to the dataset's local path
+    path = models.CharField(max_length=1000)
+    size = models.BigIntegerField()
+    mtime_ns = models.BigIntegerField()
+    inode = models.BigIntegerField()
+    record_count = models.IntegerField()
+    checksum = models.CharField(max_length=64)
+    scanned_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ("dataset", "path")
+
+
+class DatasetSignature(models.Model):
+    """
+    MinHash signature of a dataset (see `apps.datasets.minhash`).
+    """
+
+    dataset = models.OneToOneField(
+        Dataset, on_delete=models.CASCADE, primary_key=True, related_name="signature"
+    )
+    # Packed unsigned 32-bit values
+    minhash = models.BinaryField()
+    updated_at = models.DateTimeField(default=timezone.now)
+
+
+class DatasetSignatureBand(models.Model):
+    """
+    LSH bucket of a single band of a dataset's signature.
+    """
+
+    dataset = models.ForeignKey(
+        Dataset, on_delete=models.CASCADE, related_name="signature_bands"
+    )
+    band = models.PositiveSmallIntegerField()
+    bucket = models.BigIntegerField()
+
+    class Meta:
+        unique_together = ("dataset", "band")
+        indexes = [models.Index(fields=["band", "bucket"])]
+
+
+class DatasetNeighbor(models.Model):
+    """
+    Precomputed most similar dataset of a dataset (see `apps.datasets.similarity`).
+    """
+
+    dataset = models.ForeignKey(
+        Dataset, on_delete=models.CASCADE, related_name="neighbors"
+    )
+    neighbor = models.ForeignKey(Dataset, on_delete=models.CASCADE, related_name="+")
+    score = models.FloatField()
+    # Position in the dataset's neighbor list, starting from 0
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        unique_together = ("dataset", "neighbor")
+
+
+class DatasetChangeLock(models.Model):
+    """
+    Single row locked by transactions that write the change log until
+    they commit, so they get their sequence numbers in the commit order.
+    """
+
+    @classmethod
+    def acquire(cls):
+        """Lock the change log until the end of the current transaction."""
+        # SQLite doesn't lock rows, but it runs a single writing transaction
+        # at a time anyway
+        cls.objects.select_for_update().get_or_create(id=1)
+
+
+class DatasetChange(models.Model):
+    """
+    Append-only log of dataset changes, read by the change feed.
+
+    Sequence numbers (`id`) grow in the order the changes are committed
+    (see `DatasetChangeLock`), so readers never see a change without
+    the earlier ones. Entries superseded by later changes of the same dataset
+    are removed by compaction, except creations of existing datasets and
+    deletions (see `DatasetChangeService.compact()`).
+    """
+
+    CREATED = "created"
+    UPDATED = "updated"
+    DELETED = "deleted"
+    ACTIONS = [(CREATED, "Created"), (UPDATED, "Updated"), (DELETED, "Deleted")]
+
+    id = models.BigAutoField(primary_key=True)
+    # Not a foreign key, deletions are logged as well
+    dataset_id = models.BigIntegerField()
+    action = models.CharField(max_length=10, choices=ACTIONS)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields=["dataset_id", "id"])]
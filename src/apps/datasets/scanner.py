@@ -0,0 +1,123 @@
+"""
+Low-level helpers for scanning local dataset files.
+
+Everything here works on plain paths and tuples, so the functions can be
+sent to worker processes as is.
+"""
+
+import hashlib
+import mmap
+import os
+
+# Size of the chunk that is hashed (and counted) at once
+CHUNK_SIZE = 8 * 2**20
+# Files bigger than this are read through `mmap`
+MMAP_THRESHOLD = 64 * 2**20
+
+# Line-oriented formats, where every line is a record.
+# Values are the number of header lines to skip.
+LINE_RECORD_SUFFIXES = {
+    ".csv": 1,
+    ".tsv": 1,
+    ".jsonl": 0,
+    ".ndjson": 0,
+    ".txt": 0,
+}
+
+
+def file_state(stat):
+    """
+    State of a file used for change detection: (size, mtime_ns, inode).
+    """
+    return (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+
+def walk_files(root):
+    """
+    Recursively yield `(relative_path, stat)` of every regular file under `root`.
+
+    If `root` is a file itself, yield only this file.
+    Symlinks are not followed.
+    """
+    if os.path.isfile(root):
+        yield os.path.basename(root), os.stat(root)
+        return
+
+    stack = [root]
+    while stack:
+        current = stack.pop()
+        try:
+            entries = os.scandir(current)
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield os.path.relpath(entry.path, root), entry.stat(
+                        follow_symlinks=False
+                    )
+
+
+def _iter_chunks(fp, size):
+    """Yield file contents by `CHUNK_SIZE` chunks."""
+    if size >= MMAP_THRESHOLD:
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for start in range(0, size, CHUNK_SIZE):
+                yield mm[start : start + CHUNK_SIZE]
+        return
+
+    for chunk in iter(lambda: fp.read(CHUNK_SIZE), b""):
+        yield chunk
+
+
+def scan_file(path):
+    """
+    Read the file once and compute its size, record count and checksum.
+    ---
+    Returns tuple: (size, record_count, checksum).
+
+    Checksum is a BLAKE2b digest over the digests of every chunk,
+    so chunks are hashed without holding the whole file in memory.
+
+    Files of line-oriented formats contain as many records as lines
+    (excluding header), every other file is counted as a single record.
+    """
+    suffix = os.path.splitext(path)[1].lower()
+    header_lines = LINE_RECORD_SUFFIXES.get(suffix)
+
+    size = os.path.getsize(path)
+    digest = hashlib.blake2b(digest_size=32)
+    lines = 0
+    last_byte = b"\n"
+    with open(path, "rb") as fp:
+        for chunk in _iter_chunks(fp, size):
+            digest.update(hashlib.blake2b(chunk, digest_size=32).digest())
+            if header_lines is not None:
+                lines += chunk.count(b"\n")
+                last_byte = chunk[-1:]
+
+    if header_lines is None:
+        record_count = 1
+    else:
+        # Count the last line without trailing newline
+        if last_byte != b"\n":
+            lines += 1
+        record_count = max(lines - header_lines, 0)
+
+    return size, record_count, digest.hexdigest()
+
+
+def scan_file_task(task):
+    """
+    Process pool entry point.
+    ---
+    Parameters:
+    - task: (key, path), where `key` is passed back untouched
+    """
+    key, path = task
+    try:
+        return key, scan_file(path), None
+    except OSError as exc:
+        return key, None, str(exc)
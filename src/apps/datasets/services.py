@@ -1,4 +1,23 @@
-from .models import AnatomicalArea, Dataset, MLTask, Modality, Tag
+import hashlib
+import math
+import os
+import uuid
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+from django.core.exceptions import SuspiciousFileOperation
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Count, Exists, Max, Min, OuterRef, Q, Sum
+from django.utils import timezone
+
+from . import downloads, minhash, scanner, similarity, snapshot
+from .models import (AnatomicalArea, Dataset, DatasetChange, DatasetChangeLock,
+                     DatasetFile, DatasetMLTask, DatasetModality,
+                     DatasetNeighbor, DatasetSignature, DatasetSignatureBand,
+                     DatasetTag, MLTask, Modality, Tag)
 
 
 class DatasetService:
@@ -6,22 +25,1038 @@ class DatasetService:
     Business logic class for Dataset model.
     """
 
-    def get_one_detailed(self, id):
+    # Fields of the detailed dataset that are loaded with a join:
+    # {field: (relation, column)}
+    _select_fields = {
+        "anatomical_area_name": ("anatomical_area", "anatomical_area__name")
+    }
+    # Fields of the detailed dataset that are prefetched
+    _prefetch_fields = ("modalities", "ml_tasks", "tags")
+
+    def detailed(self, queryset, fields=None):
+        """
+        Load everything needed to represent the given datasets in detail.
+
+        With `fields` only the required columns are loaded and relations
+        that aren't requested are neither joined nor prefetched.
+        ---
+        Parameters:
+        - queryset: Datasets to load
+        - fields: Field names of `DatasetDetailedSerializer` (all by default)
+        """
+        if fields is None:
+            return (
+                queryset.defer("search_text")
+                .select_related("anatomical_area")
+                .prefetch_related(*self._prefetch_fields)
+            )
+
+        columns = {"id"}
+        for name in fields:
+            if name in self._prefetch_fields:
+                queryset = queryset.prefetch_related(name)
+            elif name in self._select_fields:
+                relation, column = self._select_fields[name]
+                queryset = queryset.select_related(relation)
+                columns.update((relation, column))
+            else:
+                columns.add(name)
+        return queryset.only(*columns)
+
+    def get_one_detailed(self, id, fields=None):
         """
         Get specific dataset with all known information about it.
         """
-        return (
-            Dataset.objects.get(id=id)
-            .select_related("anatomical_area")
-            .prefetch_related("modalities", "ml_tasks", "tags")
-        )
+        return self.get_all_detailed(fields=fields).get(id=id)
 
-    def get_all_detailed(self):
+    def get_all_detailed(self, fields=None):
         """
         Get all datasets with all known information about each one of them.
         """
-        return (
-            Dataset.objects.all()
-            .select_related("anatomical_area")
-            .prefetch_related("modalities", "ml_tasks", "tags")
+        return self.detailed(Dataset.objects.all(), fields=fields)
+
+    def get_many_detailed(self, ids, fields=None):
+        """
+        Get datasets with the given primary keys and all known information about them.
+
+        Makes the same number of queries for any number of datasets.
+        Missing datasets are omitted.
+
+        Returns dict: {id: dataset}
+        """
+        return self.get_all_detailed(fields=fields).in_bulk(list(ids))
+
+
+class DatasetScanService:
+    """
+    Business logic for keeping datasets in sync with their local files.
+
+    Scanning is incremental: a file is re-read only when its size,
+    modification time or inode differ from the last scan.
+    """
+
+    # Number of rows per bulk query
+    batch_size = 1000
+
+    def scan(self, ids=None, workers=None, force=False):
+        """
+        Scan local files of the datasets and update their size and record count.
+        ---
+        Parameters:
+        - ids: Primary keys of datasets to scan (all datasets with local path by default)
+        - workers: Number of worker processes (CPU count by default)
+        - force: Re-read every file, even if it hasn't changed
+
+        Returns dict with the scan statistics.
+        """
+        datasets = Dataset.objects.exclude(local_path__isnull=True).exclude(
+            local_path=""
+        )
+        if ids:
+            datasets = datasets.filter(id__in=ids)
+
+        stats = {
+            "datasets": 0,
+            "missing": [],
+            "files": 0,
+            "scanned": 0,
+            "deleted": 0,
+            "errors": [],
+            "updated": 0,
+        }
+
+        # Files of every dataset: {dataset_id: {path: DatasetFile}}
+        states = {}
+        # Last known values of changed files: {(dataset_id, path): (size, record_count)}
+        previous = {}
+        to_create = []
+        to_update = []
+        to_delete = []
+        tasks = []
+        for dataset, known in self._known_files(
+            datasets.only("id", "local_path", "record_count", "size")
+        ):
+            stats["datasets"] += 1
+            root = dataset.local_path
+            if not os.path.exists(root):
+                stats["missing"].append(dataset.id)
+                continue
+
+            files = {}
+            for path, stat in scanner.walk_files(root):
+                stats["files"] += 1
+                state = scanner.file_state(stat)
+                record = known.pop(path, None)
+                if record is None:
+                    record = DatasetFile(dataset=dataset, path=path)
+                    to_create.append(record)
+                elif force or state != (record.size, record.mtime_ns, record.inode):
+                    previous[(dataset.id, path)] = (record.size, record.record_count)
+                    to_update.append(record)
+                else:
+                    files[path] = record
+                    continue
+
+                record.size, record.mtime_ns, record.inode = state
+                files[path] = record
+                full_path = root if os.path.isfile(root) else os.path.join(root, path)
+                tasks.append(((dataset.id, path), full_path))
+
+            # Whatever is left wasn't found on disk
+            to_delete.extend(f.id for f in known.values())
+            states[dataset] = files
+
+        # Read changed files in parallel
+        scanned_at = timezone.now()
+        failed = set()
+        if tasks:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                chunksize = max(1, len(tasks) // ((workers or os.cpu_count() or 1) * 4))
+                results = executor.map(
+                    scanner.scan_file_task, tasks, chunksize=chunksize
+                )
+                lookup = {ds.id: files for ds, files in states.items()}
+                for (dataset_id, path), result, error in results:
+                    if error is not None:
+                        failed.add((dataset_id, path))
+                        stats["errors"].append(f"{path}: {error}")
+                        continue
+                    record = lookup[dataset_id][path]
+                    record.size, record.record_count, record.checksum = result
+                    record.scanned_at = scanned_at
+                    stats["scanned"] += 1
+
+        # Files that couldn't be read are retried on the next scan
+        to_create = [f for f in to_create if (f.dataset_id, f.path) not in failed]
+        to_update = [f for f in to_update if (f.dataset_id, f.path) not in failed]
+
+        # Recalculate totals of the datasets, files that couldn't be read
+        # keep their last known values (new ones aren't counted yet)
+        changed = []
+        for dataset, files in states.items():
+            totals = []
+            for path, record in files.items():
+                key = (dataset.id, path)
+                if key not in failed:
+                    totals.append((record.size, record.record_count))
+                elif key in previous:
+                    totals.append(previous[key])
+            record_count = sum(count for _, count in totals)
+            size = math.ceil(sum(size for size, _ in totals) / 2**20)  # MB
+            if (dataset.record_count, dataset.size) != (record_count, size):
+                dataset.record_count, dataset.size = record_count, size
+                dataset.updated_at = scanned_at
+                changed.append(dataset)
+
+        with transaction.atomic():
+            for start in range(0, len(to_delete), self.batch_size):
+                DatasetFile.objects.filter(
+                    id__in=to_delete[start : start + self.batch_size]
+                ).delete()
+            DatasetFile.objects.bulk_create(to_create, batch_size=self.batch_size)
+            DatasetFile.objects.bulk_update(
+                to_update,
+                ["size", "mtime_ns", "inode", "record_count", "checksum", "scanned_at"],
+                batch_size=self.batch_size,
+            )
+            Dataset.objects.bulk_update(
+                changed,
+                ["record_count", "size", "updated_at"],
+                batch_size=self.batch_size,
+            )
+            DatasetChangeService().record(
+                (dataset.id for dataset in changed), DatasetChange.UPDATED
+            )
+            if changed:
+                # Bulk updates don't send signals
+                transaction.on_commit(CatalogSnapshotService().catalog_changed)
+
+        stats["deleted"] = len(to_delete)
+        stats["updated"] = len(changed)
+        return stats
+
+    def _known_files(self, datasets):
+        """
+        Yield (dataset, {path: DatasetFile}) with files of the last scan,
+        which are loaded for `batch_size` datasets at once.
+        """
+        batch = []
+        for dataset in datasets.iterator(chunk_size=self.batch_size):
+            batch.append(dataset)
+            if len(batch) == self.batch_size:
+                yield from self._known_files_batch(batch)
+                batch = []
+        if batch:
+            yield from self._known_files_batch(batch)
+
+    def _known_files_batch(self, datasets):
+        known = defaultdict(dict)
+        for record in DatasetFile.objects.filter(dataset__in=datasets):
+            known[record.dataset_id][record.path] = record
+        for dataset in datasets:
+            yield dataset, known[dataset.id]
+
+
+class DatasetDuplicateService:
+    """
+    Business logic for near-duplicate detection of datasets.
+
+    Each dataset has a MinHash signature, split into LSH bands.
+    Datasets sharing a bucket of at least one band are candidates,
+    which are then verified by the estimated similarity of signatures.
+    """
+
+    # Number of datasets processed at once
+    batch_size = 500
+    # Buckets bigger than this are ignored when looking for clusters,
+    # they usually consist of datasets with (almost) empty texts.
+    max_bucket_size = 100
+
+    def update_signatures(self, ids):
+        """
+        Recalculate signatures of the given datasets.
+        ---
+        Parameters:
+        - ids: Primary keys of datasets
+        """
+        ids = list(ids)
+        for start in range(0, len(ids), self.batch_size):
+            self._update_batch(ids[start : start + self.batch_size])
+
+    def rebuild(self):
+        """
+        Recalculate signatures of every dataset.
+
+        Returns number of processed datasets.
+        """
+        ids = list(Dataset.objects.order_by("id").values_list("id", flat=True))
+        self.update_signatures(ids)
+        return len(ids)
+
+    def backfill(self):
+        """
+        Build signatures of datasets that don't have one yet
+        (e.g. created before signatures were introduced or in bulk).
+
+        Returns number of processed datasets.
+        """
+        ids = list(
+            Dataset.objects.filter(signature__isnull=True)
+            .order_by("id")
+            .values_list("id", flat=True)
+        )
+        self.update_signatures(ids)
+        return len(ids)
+
+    def _update_batch(self, ids):
+        datasets = (
+            Dataset.objects.filter(id__in=ids)
+            .only("id", "title", "description")
+            .prefetch_related("tags")
+        )
+
+        now = timezone.now()
+        signatures = []
+        bands = []
+        for dataset in datasets:
+            sig = self._build_signature(dataset)
+            signatures.append(
+                DatasetSignature(
+                    dataset=dataset, minhash=minhash.pack(sig), updated_at=now
+                )
+            )
+            bands.extend(
+                DatasetSignatureBand(dataset=dataset, band=band, bucket=bucket)
+                for band, bucket in minhash.bands(sig)
+            )
+
+        with transaction.atomic():
+            DatasetSignatureBand.objects.filter(dataset_id__in=ids).delete()
+            DatasetSignature.objects.bulk_create(
+                signatures,
+                update_conflicts=True,
+                unique_fields=["dataset"],
+                update_fields=["minhash", "updated_at"],
+            )
+            DatasetSignatureBand.objects.bulk_create(bands)
+
+    def _build_signature(self, dataset):
+        return minhash.signature(
+            minhash.shingles(
+                dataset.title,
+                dataset.description,
+                [tag.name for tag in dataset.tags.all()],
+            )
         )
+
+    def _get_signature(self, id):
+        """
+        Get stored signature of the dataset, or build one in memory if it's
+        missing (it's stored by `backfill()`, reads don't write).
+        """
+        try:
+            return minhash.unpack(DatasetSignature.objects.get(dataset_id=id).minhash)
+        except DatasetSignature.DoesNotExist:
+            dataset = Dataset.objects.prefetch_related("tags").get(id=id)
+            return self._build_signature(dataset)
+
+    def possible_duplicates(self, id, threshold):
+        """
+        Find datasets that are likely duplicates of the given one.
+
+        Candidates share an LSH bucket with the dataset, below
+        `minhash.THRESHOLD` every stored signature is compared instead,
+        since buckets would miss part of the duplicates.
+        ---
+        Parameters:
+        - id: Primary key of the dataset
+        - threshold: Minimum estimated similarity (0..1)
+
+        Returns list of (dataset_id, similarity) sorted by similarity.
+        """
+        sig = self._get_signature(id)
+
+        signatures = DatasetSignature.objects.exclude(dataset_id=id)
+        if threshold >= minhash.THRESHOLD:
+            buckets = Q()
+            for band, bucket in minhash.bands(sig):
+                buckets |= Q(band=band, bucket=bucket)
+            signatures = signatures.filter(
+                dataset_id__in=DatasetSignatureBand.objects.filter(buckets)
+                .values_list("dataset_id", flat=True)
+                .distinct()
+            )
+
+        result = []
+        for dataset_id, data in signatures.values_list(
+            "dataset_id", "minhash"
+        ).iterator(chunk_size=self.batch_size):
+            score = minhash.similarity(sig, minhash.unpack(data))
+            if score >= threshold:
+                result.append((dataset_id, score))
+        result.sort(key=lambda item: (-item[1], item[0]))
+        return result
+
+    def clusters(self, threshold):
+        """
+        Group all datasets into clusters of likely duplicates.
+        ---
+        Parameters:
+        - threshold: Minimum estimated similarity (0..1) of two datasets in a cluster
+
+        Returns list of clusters (sorted lists of dataset ids), biggest first.
+        """
+        # Collect candidate pairs from every bucket in a single pass
+        pairs = set()
+        bucket_ids = []
+        current = None
+        rows = (
+            DatasetSignatureBand.objects.order_by("band", "bucket")
+            .values_list("band", "bucket", "dataset_id")
+            .iterator(chunk_size=10000)
+        )
+        for band, bucket, dataset_id in rows:
+            if (band, bucket) != current:
+                self._collect_pairs(bucket_ids, pairs)
+                current = (band, bucket)
+                bucket_ids = []
+            bucket_ids.append(dataset_id)
+        self._collect_pairs(bucket_ids, pairs)
+
+        if not pairs:
+            return []
+
+        # Verify candidates and join them with union-find
+        ids = {id for pair in pairs for id in pair}
+        signatures = {}
+        for chunk in self._chunks(sorted(ids)):
+            signatures.update(
+                (dataset_id, minhash.unpack(data))
+                for dataset_id, data in DatasetSignature.objects.filter(
+                    dataset_id__in=chunk
+                ).values_list("dataset_id", "minhash")
+            )
+
+        parents = {}
+
+        def find(x):
+            parents.setdefault(x, x)
+            while parents[x] != x:
+                parents[x] = parents[parents[x]]
+                x = parents[x]
+            return x
+
+        for a, b in pairs:
+            if minhash.similarity(signatures[a], signatures[b]) >= threshold:
+                parents[find(a)] = find(b)
+
+        groups = defaultdict(list)
+        for x in parents:
+            groups[find(x)].append(x)
+        return sorted(
+            (sorted(group) for group in groups.values() if len(group) > 1),
+            key=lambda group: (-len(group), group[0]),
+        )
+
+    def _collect_pairs(self, ids, pairs):
+        if len(ids) < 2 or len(ids) > self.max_bucket_size:
+            return
+        for i, a in enumerate(ids):
+            for b in ids[i + 1 :]:
+                pairs.add((a, b) if a < b else (b, a))
+
+    def _chunks(self, items):
+        for start in range(0, len(items), self.batch_size):
+            yield items[start : start + self.batch_size]
+
+
+class DatasetNeighborService:
+    """
+    Business logic for precomputed lists of similar datasets.
+
+    See `apps.datasets.similarity` for how the similarity is scored.
+    """
+
+    # Number of neighbors stored per dataset
+    top_k = 20
+    # Features shared by more datasets don't produce candidates
+    max_posting = 5000
+    # Number of rows per bulk query
+    batch_size = 1000
+
+    # Through models: (feature kind, model, column)
+    _relations = (
+        ("modality", DatasetModality, "modality_id"),
+        ("ml_task", DatasetMLTask, "ml_task_id"),
+        ("tag", DatasetTag, "tag_id"),
+    )
+
+    def get_neighbors(self, id):
+        """
+        Get stored neighbors of the dataset.
+
+        Returns list of (neighbor_id, score), best first.
+        """
+        return list(
+            DatasetNeighbor.objects.filter(dataset_id=id)
+            .order_by("rank")
+            .values_list("neighbor_id", "score")
+        )
+
+    def rebuild(self):
+        """
+        Recalculate neighbors of every dataset.
+
+        Returns number of processed datasets.
+        """
+        features = self._features()
+        matrix = similarity.FeatureMatrix(
+            features, similarity.rare_features(features, self.max_posting)
+        )
+        lists = {id: matrix.top_neighbors(id, self.top_k) for id in features}
+        with transaction.atomic():
+            DatasetNeighbor.objects.all().delete()
+            self._save(lists)
+        return len(lists)
+
+    def refresh(self, ids):
+        """
+        Update neighbors after the given datasets have changed.
+
+        Lists of the changed datasets are recalculated completely.
+        Every other dataset that shares a feature with them only gets
+        the changed scores merged into its list. A full recalculation
+        is done only if a changed dataset falls out of the other's list.
+        ---
+        Parameters:
+        - ids: Primary keys of changed datasets
+        """
+        ids = set(ids)
+        features, postings = self._load_around(ids)
+        matrix = similarity.FeatureMatrix(features, set(postings))
+        lists = {id: matrix.top_neighbors(id, self.top_k) for id in ids}
+
+        candidates = set()
+        for id in ids:
+            for feature in features.get(id, ()):
+                candidates.update(postings.get(feature, ()))
+        candidates -= ids
+
+        current = defaultdict(dict)
+        for dataset_id, neighbor_id, score in DatasetNeighbor.objects.filter(
+            Q(dataset_id__in=candidates) | Q(neighbor_id__in=ids)
+        ).values_list("dataset_id", "neighbor_id", "score"):
+            current[dataset_id][neighbor_id] = score
+
+        recalculate = set()
+        for other in (candidates | set(current)) - ids:
+            neighbors = current[other]
+            for id in ids:
+                if other in features and id in features:
+                    score = similarity.score(features[other], features[id])
+                else:
+                    score = 0.0
+                old = neighbors.get(id)
+                if old is not None and score < old:
+                    # Something else may deserve its place now
+                    recalculate.add(other)
+                    break
+                if score > 0:
+                    neighbors[id] = score
+            if other not in recalculate:
+                lists[other] = sorted(
+                    ((score, id) for id, score in neighbors.items()), reverse=True
+                )[: self.top_k]
+
+        if recalculate:
+            features, postings = self._load_around(recalculate)
+            matrix = similarity.FeatureMatrix(features, set(postings))
+            for other in recalculate:
+                lists[other] = matrix.top_neighbors(other, self.top_k)
+
+        with transaction.atomic():
+            ids = list(lists)
+            for start in range(0, len(ids), self.batch_size):
+                DatasetNeighbor.objects.filter(
+                    dataset_id__in=ids[start : start + self.batch_size]
+                ).delete()
+            self._save(lists)
+
+    def _features(self, ids=None):
+        """
+        Feature sets of the datasets: {dataset_id: set of (kind, value)}.
+        """
+        datasets = Dataset.objects.all()
+        if ids is not None:
+            datasets = datasets.filter(id__in=ids)
+
+        features = {}
+        for id, area_id in datasets.values_list("id", "anatomical_area_id"):
+            features[id] = {("anatomical_area", area_id)} if area_id else set()
+
+        for kind, model, column in self._relations:
+            rows = model.objects.all()
+            if ids is not None:
+                rows = rows.filter(dataset_id__in=ids)
+            for dataset_id, value in rows.values_list("dataset_id", column):
+                if dataset_id in features:
+                    features[dataset_id].add((kind, value))
+        return features
+
+    def _postings(self, features):
+        """
+        Inverted index of the given features, loaded from the database.
+        Features that are too common are skipped (see `max_posting`).
+        """
+        values = defaultdict(set)
+        for kind, value in features:
+            values[kind].add(value)
+
+        lookups = [("anatomical_area", Dataset, "anatomical_area_id", "id")] + [
+            (kind, model, column, "dataset_id")
+            for kind, model, column in self._relations
+        ]
+
+        postings = {}
+        for kind, model, column, dataset_column in lookups:
+            if not values[kind]:
+                continue
+            rows = model.objects.filter(**{f"{column}__in": values[kind]})
+            rare = [
+                item[column]
+                for item in rows.values(column)
+                .annotate(count=Count(dataset_column))
+                .filter(count__lte=self.max_posting)
+            ]
+            for value, dataset_id in rows.filter(**{f"{column}__in": rare}).values_list(
+                column, dataset_column
+            ):
+                postings.setdefault((kind, value), []).append(dataset_id)
+        return postings
+
+    def _load_around(self, ids):
+        """
+        Features of the datasets and of all of their candidates,
+        together with the inverted index of their features.
+        """
+        features = self._features(ids)
+        postings = self._postings(set().union(*features.values()))
+        candidates = {id for posting in postings.values() for id in posting}
+        features.update(self._features(candidates - set(features)))
+        return features, postings
+
+    def _save(self, lists):
+        DatasetNeighbor.objects.bulk_create(
+            (
+                DatasetNeighbor(
+                    dataset_id=id, neighbor_id=neighbor_id, score=score, rank=rank
+                )
+                for id, neighbors in lists.items()
+                for rank, (score, neighbor_id) in enumerate(neighbors)
+            ),
+            batch_size=self.batch_size,
+        )
+
+
+class CatalogSnapshotService:
+    """
+    Business logic for memory-mapped snapshots of the catalog.
+
+    Snapshots are built by a single process (`build_catalog_snapshot`
+    command) and every worker process maps the current one read-only,
+    see `apps.datasets.snapshot`.
+
+    Every committed change of the catalog starts a new generation of it
+    (see `apps.datasets.signals`), a snapshot of an older generation is
+    stale and isn't used until it's rebuilt. Cached search results are
+    kept per generation as well.
+    """
+
+    # Number of previous snapshots kept for workers that still map them
+    keep = 2
+    # Cache (shared by every process) and key of the current generation
+    cache_alias = "catalog"
+    generation_key = "catalog:generation"
+
+    # Snapshot mapped by this process: {"key": stat of the pointer, "snapshot": ...}
+    _mapped = {"key": None, "snapshot": None}
+
+    # Tables the snapshot is built from
+    _relations = {
+        "modalities": (DatasetModality, "modality_id", Modality),
+        "ml_tasks": (DatasetMLTask, "ml_task_id", MLTask),
+        "tags": (DatasetTag, "tag_id", Tag),
+    }
+
+    @property
+    def root(self):
+        return settings.CATALOG_SNAPSHOT_DIR
+
+    def catalog_version(self):
+        """
+        Version of the catalog in the database.
+
+        Cheap fingerprint of datasets, their relations and vocabularies.
+        """
+        # Sums catch updates that keep the number of rows and timestamps
+        state = [
+            Dataset.objects.aggregate(
+                count=Count("id"),
+                last_id=Max("id"),
+                updated_at=Max("updated_at"),
+                record_count=Sum("record_count"),
+                size=Sum("size"),
+                anatomical_area=Sum("anatomical_area_id"),
+            )
+        ]
+        for through, column, vocabulary in self._relations.values():
+            state.append(
+                through.objects.aggregate(
+                    count=Count("id"), last_id=Max("id"), related=Sum(column)
+                )
+            )
+            state.append(
+                list(vocabulary.objects.order_by("id").values_list("id", "name"))
+            )
+        state.append(
+            list(AnatomicalArea.objects.order_by("id").values_list("id", "name"))
+        )
+        return hashlib.blake2b(repr(state).encode(), digest_size=8).hexdigest()
+
+    def generation(self):
+        """
+        Current generation of the catalog, shared by worker processes
+        through the cache.
+
+        A new one is started if it has been evicted from the cache,
+        so older snapshots are never taken for fresh.
+        """
+        cache = caches[self.cache_alias]
+        generation = cache.get(self.generation_key)
+        if generation is None:
+            cache.add(self.generation_key, uuid.uuid4().hex, timeout=None)
+            generation = cache.get(self.generation_key)
+        return generation
+
+    def catalog_changed(self):
+        """Start a new generation of the catalog (call after the commit)."""
+        caches[self.cache_alias].set(
+            self.generation_key, uuid.uuid4().hex, timeout=None
+        )
+
+    def build(self, force=False):
+        """
+        Build a new snapshot if the catalog has changed and make it current.
+        ---
+        Parameters:
+        - force: Build the snapshot even if the catalog hasn't changed
+
+        Returns version of the new snapshot, or `None` if it's up to date.
+        """
+        # Taken first, changes made during the build leave it stale
+        generation = self.generation()
+        version = self.catalog_version()
+        current = self._map()
+        if (
+            not force
+            and current is not None
+            and current.version == version
+            and current.generation == generation
+        ):
+            return None
+
+        with transaction.atomic():
+            rows = list(
+                Dataset.objects.order_by("id").values_list(
+                    "id",
+                    "record_count",
+                    "size",
+                    "created_at",
+                    "updated_at",
+                    "anatomical_area_id",
+                    "title",
+                )
+            )
+            # Sort titles in the database, so the collation matches,
+            # equal titles share the rank to be ordered by id later
+            title_rank, rank, previous = {}, -1, None
+            for id, title in Dataset.objects.order_by("title").values_list(
+                "id", "title"
+            ):
+                if title != previous:
+                    rank, previous = rank + 1, title
+                title_rank[id] = rank
+            relations = {
+                relation: list(
+                    through.objects.order_by("dataset_id", column).values_list(
+                        "dataset_id", column
+                    )
+                )
+                for relation, (through, column, _) in self._relations.items()
+            }
+            vocabularies = {
+                relation: dict(vocabulary.objects.values_list("name", "id"))
+                for relation, (_, _, vocabulary) in self._relations.items()
+            }
+            vocabularies["anatomical_area"] = dict(
+                AnatomicalArea.objects.values_list("name", "id")
+            )
+
+        columns = {
+            "ids": [row[0] for row in rows],
+            "record_count": [row[1] for row in rows],
+            "size": [row[2] for row in rows],
+            "created_at": [self._timestamp(row[3]) for row in rows],
+            "updated_at": [self._timestamp(row[4]) for row in rows],
+            "anatomical_area_id": [row[5] for row in rows],
+            "title_rank": [title_rank.get(row[0], len(rows)) for row in rows],
+        }
+        snapshot.write(
+            self.root,
+            version,
+            columns,
+            relations,
+            titles=[row[6] for row in rows],
+            vocabularies=vocabularies,
+            generation=generation,
+        )
+        snapshot.cleanup(self.root, keep=self.keep)
+        return version
+
+    def _timestamp(self, value):
+        """Microseconds since the epoch"""
+        if value is None:
+            return None
+        return int(value.timestamp()) * 1_000_000 + value.microsecond
+
+    def current(self):
+        """
+        Current snapshot mapped into memory, or `None` if there is none
+        or it's stale (the catalog has changed since it was built).
+        """
+        catalog = self._map()
+        if catalog is None or catalog.generation != self.generation():
+            return None
+        return catalog
+
+    def _map(self):
+        """
+        Current snapshot mapped into memory, or `None` if there is none.
+
+        The snapshot is mapped again only after it has been swapped.
+        """
+        try:
+            stat = os.stat(os.path.join(self.root, snapshot.CURRENT))
+        except FileNotFoundError:
+            return None
+
+        key = (stat.st_ino, stat.st_mtime_ns)
+        if self._mapped["key"] != key:
+            version = snapshot.current_version(self.root)
+            try:
+                mapped = snapshot.CatalogSnapshot(os.path.join(self.root, version))
+            except (FileNotFoundError, TypeError):
+                # The snapshot has been swapped while it was being mapped
+                return self._mapped["snapshot"]
+            self._mapped.update(key=key, snapshot=mapped)
+        return self._mapped["snapshot"]
+
+
+class DatasetChangeService:
+    """
+    Business logic for the feed of dataset changes.
+
+    Readers keep an opaque cursor (signed sequence number of the last
+    change they've seen) and receive only the latest change of every
+    dataset changed after it.
+    """
+
+    # Number of rows per bulk query
+    batch_size = 1000
+    cursor_salt = "apps.datasets.changes"
+
+    def record(self, ids, action):
+        """
+        Log changes of the datasets in the current transaction.
+
+        Other transactions that log changes wait for it to commit.
+        ---
+        Parameters:
+        - ids: Primary keys of the changed datasets
+        - action: One of `DatasetChange.ACTIONS`
+        """
+        changes = [DatasetChange(dataset_id=id, action=action) for id in ids]
+        if not changes:
+            return
+        with transaction.atomic():
+            DatasetChangeLock.acquire()
+            DatasetChange.objects.bulk_create(changes, batch_size=self.batch_size)
+
+    def encode_cursor(self, seq):
+        return signing.dumps(seq, salt=self.cursor_salt)
+
+    def decode_cursor(self, cursor):
+        """
+        Sequence number of the cursor.
+
+        Raises `ValueError` if the cursor is malformed or tampered with.
+        """
+        try:
+            seq = signing.loads(cursor, salt=self.cursor_salt)
+        except signing.BadSignature:
+            raise ValueError("Invalid cursor")
+        if not isinstance(seq, int):
+            raise ValueError("Invalid cursor")
+        return seq
+
+    def changes(self, after, limit):
+        """
+        Changes written after the given sequence number, in the order
+        they were committed.
+
+        The log is read from the primary database, replicas may lag behind
+        the cursors given to readers.
+        ---
+        Parameters:
+        - after: Sequence number of the last seen change (0 for all)
+        - limit: Maximum number of log entries read
+
+        Returns tuple: (changes, last_seq, has_more), where `changes` is
+        a list of (dataset_id, action) with the latest change of every dataset.
+        """
+        entries = list(
+            DatasetChange.objects.using(DEFAULT_DB_ALIAS)
+            .filter(id__gt=after)
+            .order_by("id")
+            .values_list("id", "dataset_id", "action")[: limit + 1]
+        )
+        has_more = len(entries) > limit
+        entries = entries[:limit]
+
+        latest = {}
+        for _, dataset_id, action in entries:
+            # Keep datasets in the order of their latest changes
+            previous = latest.pop(dataset_id, None)
+            if previous == DatasetChange.CREATED and action == DatasetChange.UPDATED:
+                action = DatasetChange.CREATED
+            latest[dataset_id] = action
+
+        last_seq = entries[-1][0] if entries else after
+        return list(latest.items()), last_seq, has_more
+
+    def compact(self, before):
+        """
+        Remove changes superseded by later changes of the same datasets.
+
+        Readers get the same latest changes after compaction, no matter
+        how old their cursors are: creations are kept unless the dataset
+        was deleted afterwards, so readers that haven't seen the dataset
+        still get `created`. Deletions are never superseded and are kept
+        on purpose, a single row per deleted dataset lets any cursor learn
+        about the deletion.
+        ---
+        Parameters:
+        - before: Only changes written before this time are removed
+
+        Returns number of removed changes.
+        """
+        newer = DatasetChange.objects.filter(
+            dataset_id=OuterRef("dataset_id"), id__gt=OuterRef("id")
+        )
+        superseded = (
+            DatasetChange.objects.filter(created_at__lt=before)
+            .filter(Exists(newer))
+            .filter(
+                ~Q(action=DatasetChange.CREATED)
+                | Exists(newer.filter(action=DatasetChange.DELETED))
+            )
+        )
+        bounds = superseded.aggregate(first=Min("id"), last=Max("id"))
+        if bounds["first"] is None:
+            return 0
+
+        # Delete in ranges of ids to keep transactions short
+        removed = 0
+        step = self.batch_size * 10
+        for start in range(bounds["first"], bounds["last"] + 1, step):
+            count, _ = superseded.filter(id__gte=start, id__lt=start + step).delete()
+            removed += count
+        return removed
+
+
+class DatasetDownloadService:
+    """
+    Business logic for downloads of local dataset files.
+    """
+
+    def get_file(self, id, path=""):
+        """
+        Single local file of the dataset.
+        ---
+        Parameters:
+        - id: Primary key of the dataset
+        - path: Path of the file relative to the dataset's local directory
+
+        Returns tuple (filename, absolute path). Raises `IsADirectoryError`
+        if the local path of the dataset is a directory and no path is given,
+        `FileNotFoundError` and `SuspiciousFileOperation` if the file can't
+        be downloaded (see `downloads.resolve()`).
+        """
+        root = Dataset.objects.only("id", "local_path").get(id=id).local_path
+        if not root:
+            raise FileNotFoundError(path)
+        if os.path.isfile(root):
+            if path and path != os.path.basename(root):
+                raise FileNotFoundError(path)
+            root, path = os.path.split(root)
+        elif not os.path.isdir(root):
+            raise FileNotFoundError(root)
+        elif not path:
+            raise IsADirectoryError(root)
+
+        full_path = downloads.resolve(root, path)
+        return os.path.basename(full_path), full_path
+
+    def get_archive_entries(self, ids):
+        """
+        Local files of the datasets to put into a zip archive.
+
+        Files of a single dataset are put into the root of the archive,
+        files of several datasets into directories named by their ids.
+        Datasets without local files are skipped.
+        ---
+        Parameters:
+        - ids: Primary keys of the datasets
+
+        Returns iterator of (name in the archive, absolute path), the files
+        are listed while the archive is being built. Raises
+        `FileNotFoundError` if none of the datasets has local files.
+        """
+        ids = list(ids)
+        paths = dict(
+            Dataset.objects.filter(id__in=ids)
+            .exclude(local_path__isnull=True)
+            .exclude(local_path="")
+            .values_list("id", "local_path")
+        )
+        roots = [
+            (id, paths[id])
+            for id in ids
+            if id in paths
+            and os.path.exists(paths[id])
+            and downloads.allowed(paths[id])
+        ]
+        if not roots:
+            raise FileNotFoundError("No local files")
+        return self._archive_entries(roots, prefixed=len(ids) > 1)
+
+    def _archive_entries(self, roots, prefixed):
+        for id, root in roots:
+            directory = os.path.dirname(root) if os.path.isfile(root) else root
+            for path, _ in scanner.walk_files(root):
+                try:
+                    full_path = downloads.resolve(directory, path)
+                except (FileNotFoundError, SuspiciousFileOperation):
+                    continue
+                name = path.replace(os.sep, "/")
+                yield f"{id}/{name}" if prefixed else name, full_path
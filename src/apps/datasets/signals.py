@@ -0,0 +1,221 @@
+"""
+Keep derived dataset data (signatures, neighbors) up to date on changes,
+log the changes for the change feed and mark catalog snapshots stale.
+
+Changes are logged in the same transaction, while derived data of changed
+datasets is collected during a transaction and processed once after
+it's committed.
+"""
+
+import threading
+
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+
+from common import analysis
+
+from .models import (AnatomicalArea, Dataset, DatasetChange, DatasetMLTask,
+                     DatasetModality, DatasetNeighbor, DatasetTag, MLTask,
+                     Modality, Tag)
+from .services import (CatalogSnapshotService, DatasetChangeService,
+                       DatasetDuplicateService, DatasetNeighborService)
+
+# Datasets changed by the current thread and not processed yet
+_pending = threading.local()
+
+
+def _pending_ids():
+    if not hasattr(_pending, "ids"):
+        _pending.ids = {"signatures": set(), "neighbors": set()}
+    return _pending.ids
+
+
+def _refresh():
+    pending = _pending_ids()
+    signatures = list(pending["signatures"])
+    neighbors = list(pending["neighbors"])
+    pending["signatures"].clear()
+    pending["neighbors"].clear()
+
+    if signatures:
+        DatasetDuplicateService().update_signatures(signatures)
+    if neighbors:
+        DatasetNeighborService().refresh(neighbors)
+
+
+def schedule(ids, signatures=False, neighbors=False):
+    """
+    Recalculate derived data of the given datasets after the current transaction.
+    ---
+    Parameters:
+    - ids: Primary keys of changed datasets
+    - signatures: Recalculate MinHash signatures
+    - neighbors: Recalculate similar datasets
+    """
+    ids = list(ids)
+    if not ids:
+        return
+    pending = _pending_ids()
+    if signatures:
+        pending["signatures"].update(ids)
+    if neighbors:
+        pending["neighbors"].update(ids)
+    transaction.on_commit(_refresh)
+
+
+def _log_updates(ids):
+    DatasetChangeService().record(ids, DatasetChange.UPDATED)
+
+
+@receiver(post_save, sender=Dataset)
+def dataset_saved(sender, instance, raw=False, using=None, **kwargs):
+    # The change itself is logged by `Dataset.save()`
+    if not raw:
+        schedule([instance.pk], signatures=True, neighbors=True)
+        return
+
+    # Fixtures are saved without `Dataset.save()`
+    Dataset.objects.using(using).filter(pk=instance.pk).update(
+        search_text=analysis.index_text(instance.title, instance.description)
+    )
+
+
+@receiver(pre_delete, sender=Dataset)
+def dataset_deleting(sender, instance, **kwargs):
+    # Lists that contain the dataset lose it with `CASCADE`, find them first
+    instance._listed_by_ids = list(
+        DatasetNeighbor.objects.filter(neighbor=instance).values_list(
+            "dataset_id", flat=True
+        )
+    )
+
+
+@receiver(post_delete, sender=Dataset)
+def dataset_deleted(sender, instance, **kwargs):
+    DatasetChangeService().record([instance.pk], DatasetChange.DELETED)
+    # Another dataset may deserve the freed place
+    schedule(getattr(instance, "_listed_by_ids", []), neighbors=True)
+
+
+@receiver(post_save, sender=Tag)
+def tag_saved(sender, instance, created=False, raw=False, **kwargs):
+    if raw or created:
+        return
+    ids = list(
+        DatasetTag.objects.filter(tag=instance).values_list("dataset_id", flat=True)
+    )
+    _log_updates(ids)
+    # Neighbors don't depend on the name of the tag
+    schedule(ids, signatures=True)
+
+
+# Vocabularies whose names are part of datasets: {model: (through model, field)}
+_vocabularies = {
+    Modality: (DatasetModality, "modality"),
+    MLTask: (DatasetMLTask, "ml_task"),
+    AnatomicalArea: (Dataset, "anatomical_area"),
+}
+
+
+@receiver(post_save, sender=Modality)
+@receiver(post_save, sender=MLTask)
+@receiver(post_save, sender=AnatomicalArea)
+def vocabulary_saved(sender, instance, created=False, raw=False, **kwargs):
+    if raw or created:
+        return
+    model, field = _vocabularies[sender]
+    id_field = "id" if model is Dataset else "dataset_id"
+    _log_updates(
+        model.objects.filter(**{field: instance}).values_list(id_field, flat=True)
+    )
+
+
+@receiver(pre_delete, sender=AnatomicalArea)
+def anatomical_area_deleted(sender, instance, **kwargs):
+    # Datasets lose the area without signals (`SET_NULL`)
+    _log_updates(
+        Dataset.objects.filter(anatomical_area=instance).values_list("id", flat=True)
+    )
+
+
+# Through models: (name of the related field, does it affect signatures)
+_through_models = {
+    DatasetTag: ("tag", True),
+    DatasetModality: ("modality", False),
+    DatasetMLTask: ("ml_task", False),
+}
+
+
+def _relations_changed(sender, ids):
+    ids = list(ids)
+    _log_updates(ids)
+    schedule(ids, signatures=_through_models[sender][1], neighbors=True)
+
+
+@receiver(post_save, sender=DatasetTag)
+@receiver(post_save, sender=DatasetModality)
+@receiver(post_save, sender=DatasetMLTask)
+def through_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _relations_changed(sender, [instance.dataset_id])
+
+
+@receiver(post_delete, sender=DatasetTag)
+@receiver(post_delete, sender=DatasetModality)
+@receiver(post_delete, sender=DatasetMLTask)
+def through_deleted(sender, instance, **kwargs):
+    _relations_changed(sender, [instance.dataset_id])
+
+
+@receiver(m2m_changed, sender=DatasetTag)
+@receiver(m2m_changed, sender=DatasetModality)
+@receiver(m2m_changed, sender=DatasetMLTask)
+def relations_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            _relations_changed(sender, [instance.pk])
+        return
+
+    # Changed from the related object's side, `pk_set` contains datasets
+    related_field, _ = _through_models[sender]
+    if action == "pre_clear":
+        instance._cleared_dataset_ids = list(
+            sender.objects.filter(**{related_field: instance}).values_list(
+                "dataset_id", flat=True
+            )
+        )
+    elif action == "post_clear":
+        _relations_changed(sender, getattr(instance, "_cleared_dataset_ids", []))
+    elif action in ("post_add", "post_remove"):
+        _relations_changed(sender, pk_set)
+
+
+@receiver(post_save, sender=Dataset)
+@receiver(post_save, sender=DatasetTag)
+@receiver(post_save, sender=DatasetModality)
+@receiver(post_save, sender=DatasetMLTask)
+@receiver(post_save, sender=AnatomicalArea)
+@receiver(post_save, sender=Modality)
+@receiver(post_save, sender=MLTask)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Dataset)
+@receiver(post_delete, sender=DatasetTag)
+@receiver(post_delete, sender=DatasetModality)
+@receiver(post_delete, sender=DatasetMLTask)
+@receiver(post_delete, sender=AnatomicalArea)
+@receiver(post_delete, sender=Modality)
+@receiver(post_delete, sender=MLTask)
+@receiver(post_delete, sender=Tag)
+def catalog_changed(sender, **kwargs):
+    # Fixtures (`raw`) change the catalog as well
+    transaction.on_commit(CatalogSnapshotService().catalog_changed)
+
+
+@receiver(m2m_changed, sender=DatasetTag)
+@receiver(m2m_changed, sender=DatasetModality)
+@receiver(m2m_changed, sender=DatasetMLTask)
+def catalog_relations_changed(sender, action, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        transaction.on_commit(CatalogSnapshotService().catalog_changed)
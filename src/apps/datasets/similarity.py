@@ -0,0 +1,122 @@
+"""
+Set-overlap similarity of datasets.
+
+Every dataset is represented as a sparse set of features: its modalities,
+ML tasks, tags and anatomical area. Similarity of two datasets is
+the weighted Jaccard index of their feature sets.
+
+Scores of a dataset against all of its candidates are computed at once
+on a sparse dataset-feature incidence matrix (its row times the
+transposed matrix), so only datasets sharing at least one feature are
+ever scored.
+"""
+
+from collections import defaultdict
+
+import numpy as np
+
+# Weight of a single shared feature of each kind
+WEIGHTS = {
+    "modality": 3.0,
+    "ml_task": 3.0,
+    "anatomical_area": 2.0,
+    "tag": 1.0,
+}
+
+
+def weight(features):
+    """Total weight of the features."""
+    return sum(WEIGHTS[kind] for kind, _ in features)
+
+
+def score(features_a, features_b):
+    """Weighted Jaccard similarity of two feature sets."""
+    shared = weight(features_a & features_b)
+    if not shared:
+        return 0.0
+    return shared / (weight(features_a) + weight(features_b) - shared)
+
+
+def rare_features(features, max_posting):
+    """
+    Features that produce candidates.
+    ---
+    Parameters:
+    - features: {dataset_id: set of (kind, value)}
+    - max_posting: Features shared by more datasets are left out,
+      they still count in the score, but don't produce candidates
+
+    Returns set of (kind, value).
+    """
+    counts = defaultdict(int)
+    for own in features.values():
+        for feature in own:
+            counts[feature] += 1
+    return {feature for feature, count in counts.items() if count <= max_posting}
+
+
+class FeatureMatrix:
+    """
+    Sparse incidence matrix of datasets and their features, stored by
+    columns: positions of the datasets having every feature.
+    """
+
+    def __init__(self, features, rare):
+        """
+        Parameters:
+        - features: Features of the datasets (and of all of their candidates)
+        - rare: Features that produce candidates (see `rare_features()`)
+        """
+        self.features = features
+        self.rare = rare
+        self.ids = np.fromiter(features, dtype=np.int64, count=len(features))
+        self.positions = {id: position for position, id in enumerate(self.ids)}
+        self.totals = np.fromiter(
+            (weight(own) for own in features.values()),
+            dtype=np.float64,
+            count=len(features),
+        )
+        columns = defaultdict(list)
+        for position, own in enumerate(features.values()):
+            for feature in own:
+                columns[feature].append(position)
+        self.columns = {
+            feature: np.array(rows, dtype=np.int64) for feature, rows in columns.items()
+        }
+
+    def top_neighbors(self, id, k):
+        """
+        Top-k most similar datasets of the given one.
+
+        Returns list of (score, neighbor_id), best first.
+        """
+        own = self.features.get(id, set())
+        rare = [feature for feature in own if feature in self.rare]
+        if not rare:
+            return []
+
+        # Shared weight with every candidate: the row times the matrix
+        rows = np.concatenate([self.columns[feature] for feature in rare])
+        candidates, inverse = np.unique(rows, return_inverse=True)
+        shared = np.bincount(
+            inverse,
+            weights=np.concatenate(
+                [
+                    np.full(len(self.columns[feature]), WEIGHTS[feature[0]])
+                    for feature in rare
+                ]
+            ),
+        )
+        for feature in own.difference(rare):
+            shared += WEIGHTS[feature[0]] * np.isin(
+                candidates, self.columns[feature], assume_unique=True
+            )
+
+        keep = candidates != self.positions[id]
+        candidates, shared = candidates[keep], shared[keep]
+        scores = shared / (weight(own) + self.totals[candidates] - shared)
+        ids = self.ids[candidates]
+
+        # Best scores first, ties broken by the higher id
+        order = np.lexsort((ids, scores))[::-1][:k]
+        return [(float(scores[i]), int(ids[i])) for i in order if scores[i] > 0]
@@ -0,0 +1,300 @@
+"""
+Columnar snapshot of the catalog shared by worker processes.
+
+A snapshot is a directory of NumPy arrays built by a single process
+(see `CatalogSnapshotService`) and memory-mapped read-only by every worker,
+so the page cache holds a single copy no matter how many workers there are.
+
+Layout of a snapshot directory (rows are sorted by dataset id):
+- `ids.npy`, `record_count.npy`, `size.npy`, `created_at.npy`,
+  `updated_at.npy`, `anatomical_area_id.npy`: one value per dataset,
+  `NULL` stands for missing values, timestamps are in microseconds;
+- `title_rank.npy`: position of the dataset when sorted by title
+  (in the order of the database collation);
+- `<relation>_indptr.npy`, `<relation>_indices.npy`, `<relation>_rows.npy`:
+  CSR matrix of related ids (modalities, ml_tasks, tags), `rows` holds
+  the row of every entry;
+- `titles_offsets.npy`, `titles.bin`: UTF-8 titles;
+- `meta.json`: version and generation of the catalog and vocabularies
+  (names to ids).
+
+`CURRENT` file in the root directory holds the name of the active
+snapshot and is replaced atomically.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+# Missing value of integer columns
+NULL = np.iinfo(np.int64).min
+
+COLUMNS = (
+    "ids",
+    "record_count",
+    "size",
+    "created_at",
+    "updated_at",
+    "anatomical_area_id",
+    "title_rank",
+)
+RELATIONS = ("modalities", "ml_tasks", "tags")
+
+# Range lookups that can be evaluated on a snapshot: {lookup: (column, op)}
+_LOOKUPS = {
+    f"{column}__{op}": (column, op)
+    for column in ("record_count", "size")
+    for op in ("gte", "lte")
+}
+_ORDER_COLUMNS = {
+    "created_at": "created_at",
+    "updated_at": "updated_at",
+    "record_count": "record_count",
+    "size": "size",
+    "title": "title_rank",
+}
+
+CURRENT = "CURRENT"
+
+
+def write(root, version, columns, relations, titles, vocabularies, generation=None):
+    """
+    Write a new snapshot and make it current.
+    ---
+    Parameters:
+    - root: Directory with snapshots
+    - version: Version of the catalog
+    - columns: {column: list of values} (see `COLUMNS`)
+    - relations: {relation: list of (dataset_id, related_id)} sorted by dataset id
+    - titles: List of titles in the order of `columns["ids"]`
+    - vocabularies: {relation: {name: id}}
+    - generation: Generation of the catalog the snapshot was built from
+
+    Returns path of the new snapshot.
+    """
+    os.makedirs(root, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=".build-", dir=root)
+    try:
+        ids = np.asarray(columns["ids"], dtype=np.int64)
+        for name, values in columns.items():
+            array = np.array(
+                [NULL if value is None else value for value in values], dtype=np.int64
+            )
+            np.save(os.path.join(tmp, f"{name}.npy"), array)
+
+        for relation, pairs in relations.items():
+            pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+            rows = np.searchsorted(ids, pairs[:, 0])
+            # Skip entries of datasets created during the build
+            known = rows < len(ids)
+            known[known] = ids[rows[known]] == pairs[known, 0]
+            rows, indices = rows[known], pairs[known, 1]
+            indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(rows, minlength=len(ids)), out=indptr[1:])
+            np.save(os.path.join(tmp, f"{relation}_indptr.npy"), indptr)
+            np.save(os.path.join(tmp, f"{relation}_indices.npy"), indices)
+            np.save(os.path.join(tmp, f"{relation}_rows.npy"), rows)
+
+        encoded = [title.encode() for title in titles]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(title) for title in encoded], out=offsets[1:])
+        np.save(os.path.join(tmp, "titles_offsets.npy"), offsets)
+        with open(os.path.join(tmp, "titles.bin"), "wb") as fp:
+            fp.write(b"".join(encoded))
+
+        with open(os.path.join(tmp, "meta.json"), "w") as fp:
+            json.dump(
+                {
+                    "version": version,
+                    "generation": generation,
+                    "vocabularies": vocabularies,
+                },
+                fp,
+            )
+
+        path = os.path.join(root, version)
+        if os.path.exists(path):
+            # Forced rebuild of the same version, mapped files stay valid
+            # for the workers until they map the new ones
+            old = tempfile.mkdtemp(prefix=".old-", dir=root)
+            os.rename(path, os.path.join(old, version))
+            os.rename(tmp, path)
+            shutil.rmtree(old, ignore_errors=True)
+        else:
+            os.rename(tmp, path)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+    # Swap the current snapshot atomically
+    pointer = os.path.join(root, f".{CURRENT}.tmp")
+    with open(pointer, "w") as fp:
+        fp.write(version)
+    os.replace(pointer, os.path.join(root, CURRENT))
+    return path
+
+
+def current_version(root):
+    """Name of the current snapshot, or `None` if there is none."""
+    try:
+        with open(os.path.join(root, CURRENT)) as fp:
+            return fp.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def cleanup(root, keep):
+    """Remove old snapshots, except the current one and the `keep` newest."""
+    current = current_version(root)
+    snapshots = sorted(
+        (
+            entry
+            for entry in os.scandir(root)
+            if entry.is_dir() and not entry.name.startswith(".")
+        ),
+        key=lambda entry: entry.stat().st_mtime,
+        reverse=True,
+    )
+    for entry in snapshots[keep:]:
+        if entry.name != current:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+class CatalogSnapshot:
+    """
+    Read-only memory-mapped snapshot of the catalog.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as fp:
+            meta = json.load(fp)
+        self.version = meta["version"]
+        self.generation = meta.get("generation")
+        self.vocabularies = meta["vocabularies"]
+
+        self.columns = {name: self._load(name) for name in COLUMNS}
+        self.relations = {
+            relation: {
+                part: self._load(f"{relation}_{part}")
+                for part in ("indptr", "indices", "rows")
+            }
+            for relation in RELATIONS
+        }
+        self.titles_offsets = self._load("titles_offsets")
+        titles_path = os.path.join(path, "titles.bin")
+        self.titles = (
+            np.memmap(titles_path, dtype=np.uint8, mode="r")
+            if os.path.getsize(titles_path)
+            else np.zeros(0, dtype=np.uint8)
+        )
+
+    def _load(self, name):
+        return np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode="r")
+
+    def __len__(self):
+        return len(self.columns["ids"])
+
+    def title(self, row):
+        start, end = self.titles_offsets[row], self.titles_offsets[row + 1]
+        return self.titles[start:end].tobytes().decode()
+
+    def rows(self, ids):
+        """
+        Rows of the given datasets.
+
+        Returns `None` if some of them are missing from the snapshot.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        all_ids = self.columns["ids"]
+        rows = np.searchsorted(all_ids, ids)
+        if len(ids) and (
+            rows.max() >= len(all_ids) or not np.array_equal(all_ids[rows], ids)
+        ):
+            return None
+        return rows
+
+    def _related(self, relation, related_ids):
+        """Mask of datasets related to any of the given objects."""
+        mask = np.zeros(len(self), dtype=bool)
+        matrix = self.relations[relation]
+        hits = np.isin(matrix["indices"], np.asarray(related_ids, dtype=np.int64))
+        mask[matrix["rows"][hits]] = True
+        return mask
+
+    def supports(self, plan):
+        """Whether the search plan can be evaluated on the snapshot."""
+        return (
+            all(lookup in _LOOKUPS for lookup in plan["filters"])
+            and all(
+                relation == "anatomical_area" or relation in self.relations
+                for relation in (*plan["ids"], *plan["names"])
+            )
+            # Names unknown to the snapshot may have been added since
+            and all(
+                relation in self.vocabularies
+                and all(name in self.vocabularies[relation] for name in names)
+                for relation, names in plan["names"].items()
+            )
+            and (not plan["order"] or plan["order"].lstrip("-") in _ORDER_COLUMNS)
+        )
+
+    def select(self, plan, ids):
+        """
+        Filter and order the given datasets according to the search plan.
+        ---
+        Parameters:
+        - plan: Search plan (see `SearchService.compile_filters()`),
+          it must be supported (see `supports()`)
+        - ids: Primary keys of the datasets to choose from
+
+        Returns ordered array of primary keys, or `None` if some of
+        the datasets are missing from the snapshot (it's outdated).
+        """
+        rows = self.rows(ids)
+        if rows is None:
+            return None
+
+        mask = np.zeros(len(self), dtype=bool)
+        mask[rows] = True
+
+        for lookup, value in plan["filters"].items():
+            column, op = _LOOKUPS[lookup]
+            values = self.columns[column]
+            mask &= values != NULL
+            mask &= values >= value if op == "gte" else values <= value
+
+        related = {relation: list(ids) for relation, ids in plan["ids"].items()}
+        for relation, names in plan["names"].items():
+            vocabulary = self.vocabularies[relation]
+            related[relation] = [
+                vocabulary[name] for name in names if name in vocabulary
+            ]
+
+        for relation, related_ids in related.items():
+            if relation == "anatomical_area":
+                mask &= np.isin(
+                    self.columns["anatomical_area_id"],
+                    np.asarray(related_ids, dtype=np.int64),
+                )
+            else:
+                mask &= self._related(relation, related_ids)
+
+        selected = np.flatnonzero(mask)
+        result_ids = self.columns["ids"][selected]
+
+        order = plan["order"]
+        if not order:
+            return result_ids
+        descending = order.startswith("-")
+        column = _ORDER_COLUMNS[order.lstrip("-")]
+
+        # NULLs are the largest values, as in PostgreSQL
+        keys = np.asarray(self.columns[column][selected])
+        keys = np.where(keys == NULL, np.iinfo(np.int64).max, keys)
+        if descending:
+            keys = ~keys  # reverse the order without overflow
+        return result_ids[np.lexsort((result_ids, keys))]
@@ -0,0 +1,377 @@
+import io
+import os
+import tempfile
+import zipfile
+from datetime import timedelta
+
+from django.core import signing
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.management import CommandError, call_command
+from django.test import (RequestFactory, SimpleTestCase, TestCase,
+                         override_settings)
+from django.utils import timezone
+
+from apps.datasets import downloads, minhash
+from apps.datasets.models import Dataset, DatasetChange, Tag
+from apps.datasets.services import (DatasetChangeService,
+                                    DatasetDuplicateService)
+
+DOWNLOADS = {
+    "ROOT": "",
+    "OFFLOAD": "",
+    "ACCEL_PREFIX": "/protected/",
+    "CHUNK_SIZE": 4,
+}
+
+
+class ParseRangeTests(SimpleTestCase):
+    def test_range(self):
+        self.assertEqual(downloads.parse_range("bytes=2-5", 10), (2, 5))
+        # The last byte is capped by the size
+        self.assertEqual(downloads.parse_range("bytes=2-100", 10), (2, 9))
+
+    def test_open_ended_range(self):
+        self.assertEqual(downloads.parse_range("bytes=5-", 10), (5, 9))
+
+    def test_suffix_range(self):
+        self.assertEqual(downloads.parse_range("bytes=-3", 10), (7, 9))
+        self.assertEqual(downloads.parse_range("bytes=-20", 10), (0, 9))
+
+    def test_unsatisfiable_range(self):
+        for header, size in (
+            ("bytes=10-", 10),
+            ("bytes=5-2", 10),
+            ("bytes=-0", 10),
+            ("bytes=-5", 0),
+        ):
+            with self.subTest(header=header, size=size):
+                with self.assertRaises(ValueError):
+                    downloads.parse_range(header, size)
+
+    def test_unsupported_range(self):
+        self.assertIsNone(downloads.parse_range("bytes=0-1,4-5", 10))
+        self.assertIsNone(downloads.parse_range("items=0-1", 10))
+        self.assertIsNone(downloads.parse_range("bytes=-", 10))
+
+
+@override_settings(DOWNLOADS=DOWNLOADS)
+class ResolveTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.base = os.path.realpath(directory.name)
+        self.root = os.path.join(self.base, "dataset")
+        os.makedirs(os.path.join(self.root, "images"))
+        with open(os.path.join(self.root, "images", "1.png"), "wb") as fp:
+            fp.write(b"image")
+        with open(os.path.join(self.base, "secret.txt"), "wb") as fp:
+            fp.write(b"secret")
+
+    def test_file(self):
+        self.assertEqual(
+            downloads.resolve(self.root, "images/1.png"),
+            os.path.join(self.root, "images", "1.png"),
+        )
+
+    def test_parent_directory(self):
+        for path in ("../secret.txt", "images/../../secret.txt"):
+            with self.subTest(path=path):
+                with self.assertRaises(SuspiciousFileOperation):
+                    downloads.resolve(self.root, path)
+
+    def test_absolute_path(self):
+        with self.assertRaises(SuspiciousFileOperation):
+            downloads.resolve(self.root, os.path.join(self.base, "secret.txt"))
+
+    def test_symlink(self):
+        os.symlink(
+            os.path.join(self.base, "secret.txt"), os.path.join(self.root, "link")
+        )
+        with self.assertRaises(SuspiciousFileOperation):
+            downloads.resolve(self.root, "link")
+
+    def test_directory(self):
+        with self.assertRaises(FileNotFoundError):
+            downloads.resolve(self.root, "images")
+
+    def test_outside_of_downloads_root(self):
+        downloads_root = os.path.join(self.base, "downloads")
+        os.makedirs(downloads_root)
+        with override_settings(DOWNLOADS={**DOWNLOADS, "ROOT": downloads_root}):
+            with self.assertRaises(SuspiciousFileOperation):
+                downloads.resolve(self.root, "images/1.png")
+
+
+@override_settings(DOWNLOADS=DOWNLOADS)
+class FileResponseTests(SimpleTestCase):
+    content = b"0123456789"
+
+    def setUp(self):
+        file = tempfile.NamedTemporaryFile(delete=False)
+        self.addCleanup(os.unlink, file.name)
+        with file:
+            file.write(self.content)
+        self.path = file.name
+        self.factory = RequestFactory()
+
+    def _get(self, **headers):
+        request = self.factory.get("/", headers=headers)
+        response = downloads.file_response(request, self.path, "data.bin")
+        self.addCleanup(response.close)
+        return response
+
+    def test_whole_file(self):
+        response = self._get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), self.content)
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+
+    def test_range(self):
+        response = self._get(Range="bytes=-3")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], "bytes 7-9/10")
+        self.assertEqual(response["Content-Length"], "3")
+        self.assertEqual(b"".join(response.streaming_content), b"789")
+
+    def test_unsatisfiable_range(self):
+        response = self._get(Range="bytes=20-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */10")
+
+    def test_outdated_if_range(self):
+        response = self._get(Range="bytes=2-3", If_Range='"outdated"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), self.content)
+
+    def test_accel_redirect_without_root(self):
+        options = {**DOWNLOADS, "OFFLOAD": "x-accel-redirect"}
+        with override_settings(DOWNLOADS=options):
+            response = self._get()
+            self.assertNotIn("X-Accel-Redirect", response)
+            self.assertEqual(b"".join(response.streaming_content), self.content)
+            self.assertEqual(
+                [error.id for error in downloads.check_settings(None)],
+                ["datasets.E002"],
+            )
+
+    def test_accel_redirect(self):
+        options = {
+            **DOWNLOADS,
+            "OFFLOAD": "x-accel-redirect",
+            "ROOT": os.path.dirname(self.path),
+        }
+        with override_settings(DOWNLOADS=options):
+            response = self._get()
+        self.assertEqual(
+            response["X-Accel-Redirect"],
+            "/protected/" + os.path.basename(self.path),
+        )
+
+    def test_sendfile(self):
+        path = os.path.join(os.path.dirname(self.path), "снимки мрт.zip")
+        with override_settings(DOWNLOADS={**DOWNLOADS, "OFFLOAD": "x-sendfile"}):
+            response = downloads.file_response(
+                self.factory.get("/"), path, "снимки мрт.zip"
+            )
+        self.assertEqual(
+            response["X-Sendfile"],
+            os.path.dirname(self.path)
+            + "/%D1%81%D0%BD%D0%B8%D0%BC%D0%BA%D0%B8%20%D0%BC%D1%80%D1%82.zip",
+        )
+
+
+class ZipChunksTests(SimpleTestCase):
+    def test_archive_is_readable(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        files = {"a/1.txt": b"first file", "b/2.bin": os.urandom(1000), "c.txt": b""}
+        entries = []
+        for name, content in files.items():
+            path = os.path.join(directory.name, name.replace("/", "_"))
+            with open(path, "wb") as fp:
+                fp.write(content)
+            entries.append((name, path))
+        # Removed since it was listed
+        entries.append(("missing.txt", os.path.join(directory.name, "missing")))
+
+        data = b"".join(downloads.zip_chunks(entries, chunk_size=64))
+
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.namelist(), list(files))
+            for name, content in files.items():
+                self.assertEqual(archive.read(name), content)
+
+
+class MinHashTests(SimpleTestCase):
+    text = (
+        "Brain MRI scans of patients with glioma, collected in three hospitals "
+        "and annotated by radiologists for tumour segmentation and grading"
+    )
+
+    def _signature(self, text, tags=()):
+        return minhash.signature(minhash.shingles(text, None, list(tags)))
+
+    def test_signature_is_stable(self):
+        # Signatures are stored, so they must not change between processes
+        sig = self._signature("Brain MRI scans", ["mri"])
+        self.assertEqual(sig[:2], [2160467667, 604052368])
+        self.assertEqual(len(sig), minhash.NUM_PERM)
+        self.assertEqual(list(minhash.unpack(minhash.pack(sig))), sig)
+
+    def test_similarity(self):
+        sig = self._signature(self.text)
+        self.assertEqual(minhash.similarity(sig, self._signature(self.text)), 1)
+        self.assertGreater(
+            minhash.similarity(sig, self._signature(self.text + " v2")), 0.8
+        )
+        self.assertLess(
+            minhash.similarity(sig, self._signature("Chest X-ray images")), 0.1
+        )
+
+    def test_bands(self):
+        sig = self._signature(self.text)
+        bands = list(minhash.bands(sig))
+        self.assertEqual([band for band, _ in bands], list(range(minhash.BANDS)))
+
+        # Changing a row of a band only changes the bucket of that band
+        changed = list(sig)
+        changed[minhash.ROWS + 1] += 1
+        self.assertEqual(
+            [
+                band
+                for (band, bucket), (_, other) in zip(bands, minhash.bands(changed))
+                if bucket != other
+            ],
+            [1],
+        )
+
+
+class DatasetClustersTests(TestCase):
+    text = (
+        "Brain MRI scans of patients with glioma, collected in three hospitals "
+        "and annotated by radiologists for tumour segmentation and grading"
+    )
+
+    def setUp(self):
+        self.service = DatasetDuplicateService()
+
+    def _create(self, title, description=""):
+        return Dataset.objects.create(title=title, description=description).id
+
+    def test_clusters(self):
+        original = self._create("Glioma MRI", self.text)
+        copy = self._create("Glioma MRI", self.text + " Version 2")
+        # Only similar to the copy, joined to the cluster through it
+        copy_of_copy = self._create("Glioma MRI", self.text + " Version 2 and 3")
+        other = self._create("Chest X-ray", "Pneumonia classification")
+        other_copy = self._create("Chest X-ray", "Pneumonia classification")
+        self._create("Skin lesions", "Dermoscopy images of melanoma")
+        self.service.rebuild()
+
+        self.assertEqual(
+            self.service.clusters(minhash.THRESHOLD),
+            [sorted([original, copy, copy_of_copy]), sorted([other, other_copy])],
+        )
+        self.assertEqual(self.service.clusters(1), [sorted([other, other_copy])])
+
+    def test_command_refuses_threshold_below_lsh(self):
+        with self.assertRaises(CommandError):
+            call_command("find_duplicates", threshold=0.5, stdout=io.StringIO())
+
+
+class DatasetChangeServiceTests(TestCase):
+    def setUp(self):
+        self.service = DatasetChangeService()
+
+    def _changes(self, after=0, limit=100):
+        return self.service.changes(after, limit)[0]
+
+    def _last_seq(self):
+        return DatasetChange.objects.order_by("id").last().id
+
+    def test_cursor(self):
+        cursor = self.service.encode_cursor(42)
+        self.assertEqual(self.service.decode_cursor(cursor), 42)
+
+        for cursor in (
+            cursor[:-1] + ("A" if cursor[-1] != "A" else "B"),
+            signing.dumps(42, salt="other"),
+            self.service.encode_cursor("42"),
+            "42",
+        ):
+            with self.subTest(cursor=cursor):
+                with self.assertRaises(ValueError):
+                    self.service.decode_cursor(cursor)
+
+    def test_pages(self):
+        ids = [Dataset.objects.create(title=f"Dataset {i}").id for i in range(3)]
+
+        changes, last_seq, has_more = self.service.changes(0, 2)
+        self.assertEqual([id for id, _ in changes], ids[:2])
+        self.assertTrue(has_more)
+
+        changes, last_seq, has_more = self.service.changes(last_seq, 2)
+        self.assertEqual([id for id, _ in changes], ids[2:])
+        self.assertFalse(has_more)
+
+        # Nothing new, the cursor stays where it was
+        self.assertEqual(self.service.changes(last_seq, 2), ([], last_seq, False))
+
+    def test_latest_change(self):
+        dataset = Dataset.objects.create(title="MRI")
+        created = self._last_seq()
+        dataset.save()
+        dataset.save()
+
+        # Readers that haven't seen the dataset still get its creation
+        self.assertEqual(self._changes(), [(dataset.id, DatasetChange.CREATED)])
+        self.assertEqual(self._changes(created), [(dataset.id, DatasetChange.UPDATED)])
+
+        dataset_id = dataset.id
+        dataset.delete()
+        self.assertEqual(self._changes(), [(dataset_id, DatasetChange.DELETED)])
+
+    def test_compact(self):
+        kept = Dataset.objects.create(title="MRI")
+        deleted = Dataset.objects.create(title="CT")
+        kept.save()
+        deleted.save()
+        kept.save()
+        deleted.delete()
+        seqs = [0, *DatasetChange.objects.order_by("id").values_list("id", flat=True)]
+        expected = {seq: self._changes(seq) for seq in seqs}
+
+        removed = self.service.compact(before=timezone.now() + timedelta(seconds=1))
+
+        # Left: creation and the latest update of one dataset, deletion of the other
+        self.assertEqual(removed, 3)
+        self.assertEqual({seq: self._changes(seq) for seq in seqs}, expected)
+
+    def test_compact_keeps_recent_changes(self):
+        dataset = Dataset.objects.create(title="MRI")
+        dataset.save()
+        dataset.save()
+
+        self.assertEqual(
+            self.service.compact(before=timezone.now() - timedelta(hours=1)), 0
+        )
+
+    def test_relations_and_deletion_are_logged(self):
+        dataset = Dataset.objects.create(title="MRI")
+        tag = Tag.objects.create(name="brain")
+
+        for change in (
+            lambda: dataset.tags.add(tag),
+            lambda: tag.dataset_set.remove(dataset),
+            lambda: tag.dataset_set.add(dataset),
+            lambda: tag.dataset_set.clear(),
+        ):
+            seq = self._last_seq()
+            change()
+            self.assertEqual(self._changes(seq), [(dataset.id, DatasetChange.UPDATED)])
+
+        seq = self._last_seq()
+        dataset_id = dataset.id
+        dataset.delete()
+        self.assertEqual(self._changes(seq), [(dataset_id, DatasetChange.DELETED)])
@@ -0,0 +1,128 @@
+"""
+Asynchronous log of searches.
+
+Searches are appended to an in-memory buffer and written to the database
+in bulk by a background thread of every worker process, so logging
+doesn't add a database round trip to the request.
+
+The buffer is bounded (`settings.SEARCH_LOG["MAX_BUFFER"]`): when the
+database can't keep up, the oldest entries are dropped instead of growing
+the memory of the worker.
+"""
+
+import atexit
+import collections
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.utils import timezone
+
+from .models import SearchQueryLog
+
+logger = logging.getLogger(__name__)
+
+
+class SearchLogBuffer:
+    """
+    Buffer of search log entries flushed by a background thread.
+    """
+
+    def __init__(self, batch_size, flush_interval, max_buffer):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._reset()
+        # Threads don't survive a fork, so every worker starts its own
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._entries = collections.deque(maxlen=self.max_buffer)
+        self._wakeup = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._started = False
+
+    def add(self, entry):
+        """Add an unsaved `SearchQueryLog` to the buffer."""
+        if not self._started:
+            self._start()
+        self._entries.append(entry)
+        if len(self._entries) >= self.batch_size:
+            self._wakeup.set()
+
+    def _start(self):
+        with self._start_lock:
+            if not self._started:
+                threading.Thread(
+                    target=self._run, name="search-log-flush", daemon=True
+                ).start()
+                self._started = True
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+            # Connections are per thread, don't keep an idle one open
+            connections.close_all()
+
+    def flush(self):
+        """Write all buffered entries to the database."""
+        with self._flush_lock:
+            while self._entries:
+                batch = []
+                while self._entries and len(batch) < self.batch_size:
+                    batch.append(self._entries.popleft())
+                try:
+                    SearchQueryLog.objects.bulk_create(batch)
+                except DatabaseError:
+                    logger.warning(
+                        "Dropped %d search log entries", len(batch), exc_info=True
+                    )
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def _get_buffer():
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                options = settings.SEARCH_LOG
+                _buffer = SearchLogBuffer(
+                    batch_size=options["BATCH_SIZE"],
+                    flush_interval=options["FLUSH_INTERVAL"],
+                    max_buffer=options["MAX_BUFFER"],
+                )
+                atexit.register(_buffer.flush)
+    return _buffer
+
+
+def log_search(query, filters, result_count, latency, degraded=False):
+    """
+    Log a search without waiting for the database.
+    ---
+    Parameters:
+    - query: Search term
+    - filters: Normalized filter params
+    - result_count: Number of found datasets
+    - latency: Processing time in seconds
+    - degraded: Whether the search was served without the semantic engine
+    """
+    if not settings.SEARCH_LOG["ENABLED"]:
+        return
+    _get_buffer().add(
+        SearchQueryLog(
+            query=query,
+            filters=filters,
+            result_count=result_count,
+            latency_ms=latency * 1000,
+            degraded=degraded,
+            created_at=timezone.now(),
+        )
+    )
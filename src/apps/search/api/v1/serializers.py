@@ -48,6 +48,9 @@ class SearchDatasetsGetSerializer(serializers.Serializer):
         ],
     )
 
+    # Columns the datasets can be ordered by
+    ordering_columns = ["created_at", "updated_at", "title", "record_count", "size"]
+
     class Meta:
         fields = [
             "anatomical_area_name",
@@ -61,6 +64,17 @@ class SearchDatasetsGetSerializer(serializers.Serializer):
             "ordering",
         ]
 
+    def validate_ordering(self, value):
+        if len(value) != 2:
+            raise serializers.ValidationError("Expected [<column>, <asc|desc>].")
+        if value[0] not in self.ordering_columns:
+            raise serializers.ValidationError(
+                f"Unknown column, choose from: {', '.join(self.ordering_columns)}."
+            )
+        if value[1] not in ("asc", "desc"):
+            raise serializers.ValidationError("Order should be 'asc' or 'desc'.")
+        return value
+
 
 class SearchDatasetsPostSerializer(serializers.Serializer):
     # TODO: Extract length values to constants
@@ -84,3 +98,37 @@ class SearchDatasetsRequestSerializer(serializers.Serializer):
 class SearchResponseSerializer(serializers.Serializer):
     count = serializers.IntegerField()
     results = DatasetDetailedSerializer(many=True)
+
+
+class SearchBatchItemSerializer(SearchDatasetsPostSerializer):
+    # Same as GET query params of a single search
+    filters = SearchDatasetsGetSerializer(required=False)
+
+    class Meta:
+        fields = ["query", "filters"]
+
+    def validate(self, attrs):
+        # Missing filters are the same as empty ones
+        if "filters" not in attrs:
+            filters = SearchDatasetsGetSerializer(data={})
+            filters.is_valid(raise_exception=True)
+            attrs["filters"] = filters.validated_data
+        return attrs
+
+
+class SearchBatchRequestSerializer(serializers.Serializer):
+    # Maximum number of searches in a batch
+    max_items = 500
+
+    items = serializers.ListField(
+        child=SearchBatchItemSerializer(), min_length=1, max_length=max_items
+    )
+    # Maximum number of datasets returned per item
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
+
+    class Meta:
+        fields = ["items", "limit"]
+
+
+class SearchBatchResponseSerializer(serializers.Serializer):
+    results = SearchResponseSerializer(many=True)
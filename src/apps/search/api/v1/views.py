@@ -1,10 +1,18 @@
+import json
+import time
+
 from rest_framework import generics, mixins, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
 
+from apps.datasets.api.v1.views import DatasetFieldsMixin
+from apps.search import analytics
 from apps.search.services import SearchService
+from common import profiling
 
-from .serializers import (SearchDatasetsGetSerializer,
+from .serializers import (SearchBatchRequestSerializer,
+                          SearchBatchResponseSerializer,
+                          SearchDatasetsGetSerializer,
                           SearchDatasetsPostSerializer,
                           SearchDatasetsRequestSerializer,
                           SearchResponseSerializer)
@@ -29,14 +37,20 @@ class BaseSearchViewSet(
         return self.search(request=request)
 
 
-class SearchDatasetsViewSet(BaseSearchViewSet):
+class SearchDatasetsViewSet(DatasetFieldsMixin, BaseSearchViewSet):
     """
     Search API endpoint that allows datasets to be searched with query.
     """
 
     @property
     def _search_service(self):
-        return SearchService()
+        # Requests that waited for admission are served with less work
+        return SearchService(degraded=getattr(self.request, "degraded", False))
+
+    def _mark_degraded(self, response, search_service):
+        if search_service.degraded:
+            response["X-Search-Degraded"] = "lexical"
+        return response
 
     def get_serializer_class(self):
         return SearchDatasetsPostSerializer
@@ -57,16 +71,71 @@ class SearchDatasetsViewSet(BaseSearchViewSet):
             return Response(req_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
         # Search for datasets using the given query
-        result_set = self._search_service.search_datasets(
-            query=req_serializer.data["post"]["query"],
-            filter_params=req_serializer.data["get"],
+        search_service = self._search_service
+        query = req_serializer.data["post"]["query"]
+        filter_params = req_serializer.data["get"]
+        started = time.monotonic()
+        result = search_service.search_datasets(
+            query=query, filter_params=filter_params, fields=self.dataset_fields
+        )
+        analytics.log_search(
+            query=query,
+            filters=search_service.normalize_filters(filter_params),
+            result_count=result["count"],
+            latency=time.monotonic() - started,
+            degraded=search_service.degraded,
         )
 
         # Serialize the response
         res_serializer = SearchResponseSerializer(
-            {"count": result_set.count(), "results": result_set}
+            result, context=self.get_serializer_context()
+        )
+        with profiling.span("serialize"):
+            data = res_serializer.data
+        return self._mark_degraded(Response(data), search_service)
+
+    @action(detail=False, methods=["post"])
+    def batch(self, request):
+        """Execute many searches in a single request"""
+        req_serializer = SearchBatchRequestSerializer(data=request.data)
+        if not req_serializer.is_valid():
+            return Response(req_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        search_service = self._search_service
+        items = [
+            (item["query"], item["filters"])
+            for item in req_serializer.validated_data["items"]
+        ]
+        started = time.monotonic()
+        results = search_service.search_datasets_batch(
+            items=items,
+            limit=req_serializer.validated_data["limit"],
+            fields=self.dataset_fields,
+        )
+        # Searches of a batch are served together, every distinct one
+        # is logged once with the latency of the whole batch
+        latency = time.monotonic() - started
+        logged = set()
+        for (query, filter_params), result in zip(items, results):
+            filters = search_service.normalize_filters(filter_params)
+            key = json.dumps([query, filters], sort_keys=True, default=str)
+            if key in logged:
+                continue
+            logged.add(key)
+            analytics.log_search(
+                query=query,
+                filters=filters,
+                result_count=result["count"],
+                latency=latency,
+                degraded=search_service.degraded,
+            )
+
+        res_serializer = SearchBatchResponseSerializer(
+            {"results": results}, context=self.get_serializer_context()
         )
-        return Response(res_serializer.data)
+        with profiling.span("serialize"):
+            data = res_serializer.data
+        return self._mark_degraded(Response(data), search_service)
 
     @action(detail=False, methods=["get"])
     def filters(self, request):
@@ -0,0 +1,228 @@
+import re
+from itertools import product
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import (DEFAULT_DB_ALIAS, connections, migrations, models,
+                       transaction)
+from django.db.migrations.autodetector import MigrationAutodetector
+from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.writer import MigrationWriter
+from django.db.models import Avg
+
+from apps.datasets.models import AnatomicalArea, Dataset, MLTask, Modality, Tag
+from apps.search.api.v1.serializers import SearchDatasetsGetSerializer
+from apps.search.services import SearchService
+
+# Full scans of a table in the output of EXPLAIN
+_SCAN_PATTERNS = {
+    "postgresql": re.compile(r"Seq Scan on (\w+)"),
+    "sqlite": re.compile(r"\bSCAN (\w+)\b(?! USING)"),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Explain the queries of representative searches, flag full table scans "
+        "and recommend (or generate) missing indexes. Run it against a database "
+        "of production size, small tables are always scanned."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--database",
+            default=DEFAULT_DB_ALIAS,
+            help="Database to explain the queries on",
+        )
+        parser.add_argument(
+            "--query",
+            default="",
+            help="Search term of the explained searches",
+        )
+        parser.add_argument(
+            "--disable-seqscan",
+            action="store_true",
+            help="Discourage sequential scans (PostgreSQL only) to find filters "
+            "no index can serve, regardless of the table size",
+        )
+        parser.add_argument(
+            "--generate",
+            action="store_true",
+            help="Write migrations that add the recommended indexes",
+        )
+
+    def handle(self, *args, **options):
+        self.database = options["database"]
+        self.service = SearchService(degraded=True)
+        self.tables = {model._meta.db_table: model for model in apps.get_models()}
+
+        recommendations = {}
+        for params in self._combinations():
+            plan = self.service.compile_filters(params)
+            scans = self._explain(options["query"], plan, options)
+            if not scans:
+                continue
+
+            used = {name: value for name, value in params.items() if value}
+            self.stdout.write(self.style.WARNING(f"Full scans for {used}:"))
+            for table in scans:
+                missing = [
+                    column
+                    for column in self._columns(table, plan)
+                    if not self._indexed(self.tables[table], column)
+                ]
+                note = f"no index on {', '.join(missing)}" if missing else "indexed"
+                self.stdout.write(f"  {table} ({note})")
+                for column in missing:
+                    recommendations.setdefault(self.tables[table], set()).add(column)
+
+        if not recommendations:
+            self.stdout.write(self.style.SUCCESS("No missing indexes found"))
+            return
+
+        self.stdout.write(self.style.MIGRATE_HEADING("Recommended indexes:"))
+        for model, columns in recommendations.items():
+            for column in sorted(columns):
+                self.stdout.write(
+                    f"  {model.__name__}.Meta.indexes: "
+                    f'models.Index(fields=["{column}"])'
+                )
+
+        if options["generate"]:
+            self._generate(recommendations)
+
+    def _samples(self):
+        """Filter params with values taken from the catalog"""
+        averages = Dataset.objects.using(self.database).aggregate(
+            record_count=Avg("record_count"), size=Avg("size")
+        )
+        samples = {}
+        for column, average in averages.items():
+            samples[f"{column}_min"] = int(average or 0)
+            samples[f"{column}_max"] = int(average or 0)
+
+        for param, vocabulary in (
+            ("anatomical_area_name", AnatomicalArea),
+            ("modalities_list", Modality),
+            ("ml_tasks_list", MLTask),
+            ("tags_list", Tag),
+        ):
+            queryset = vocabulary.objects.using(self.database)
+            names = list(queryset.values_list("name", flat=True)[:2])
+            if param.endswith("_name"):
+                samples[param] = names[0] if names else "example"
+            else:
+                samples[param] = ",".join(names) or "example"
+        return samples
+
+    def _combinations(self):
+        """
+        Representative filter params: every filter alone, range filters
+        combined with relation filters and every ordering.
+        """
+        samples = self._samples()
+        ranges = [name for name in samples if name.endswith(("_min", "_max"))]
+        relations = [name for name in samples if name.endswith(("_name", "_list"))]
+
+        combinations = [{}]
+        combinations += [{name: value} for name, value in samples.items()]
+        combinations += [
+            {range_name: samples[range_name], relation: samples[relation]}
+            for range_name, relation in product(ranges, relations)
+        ]
+        combinations += [
+            {"ordering": [column, direction]}
+            for column, direction in product(
+                SearchDatasetsGetSerializer.ordering_columns, ("asc", "desc")
+            )
+        ]
+
+        # Filter params exactly as the search view receives them
+        for params in combinations:
+            serializer = SearchDatasetsGetSerializer(data=params)
+            serializer.is_valid(raise_exception=True)
+            yield serializer.data
+
+    def _explain(self, query, plan, options):
+        """Tables that are fully scanned by the queries of the search"""
+        vocabularies = self.service.lookup_vocabularies([plan])
+        queryset = self.service.search_queryset(query, plan, vocabularies).using(
+            self.database
+        )
+
+        connection = connections[self.database]
+        with transaction.atomic(using=self.database):
+            if options["disable_seqscan"] and connection.vendor == "postgresql":
+                with connection.cursor() as cursor:
+                    cursor.execute("SET LOCAL enable_seqscan = off")
+            explained = queryset.explain()
+
+        if options["verbosity"] >= 2:
+            self.stdout.write(explained)
+        pattern = _SCAN_PATTERNS.get(connection.vendor)
+        if pattern is None:
+            return []
+        return sorted(
+            {table for table in pattern.findall(explained) if table in self.tables}
+        )
+
+    def _columns(self, table, plan):
+        """Columns of the table the search filters or orders by"""
+        model = self.tables[table]
+        if model is Dataset:
+            columns = [lookup.split("__")[0] for lookup in plan["filters"]]
+            if plan["order"]:
+                columns.append(plan["order"].lstrip("-"))
+            if "anatomical_area" in {*plan["names"], *plan["ids"]}:
+                columns.append("anatomical_area")
+            return columns
+
+        columns = []
+        for relation in {*plan["names"], *plan["ids"]}:
+            _, through, column = self.service._vocabularies[relation]
+            if through is model:
+                columns.append(column.removesuffix("_id"))
+        return columns
+
+    def _indexed(self, model, column):
+        """Whether an index of the model starts with the column"""
+        field = model._meta.get_field(column)
+        if field.primary_key or field.unique or field.db_index:
+            return True
+        leading = [index.fields[0].lstrip("-") for index in model._meta.indexes]
+        leading += [fields[0] for fields in model._meta.unique_together]
+        return column in leading
+
+    def _generate(self, recommendations):
+        """Write a migration with the recommended indexes per app"""
+        loader = MigrationLoader(None, ignore_no_migrations=True)
+        operations = {}
+        for model, columns in recommendations.items():
+            for column in sorted(columns):
+                index = models.Index(fields=[column])
+                index.set_name_with_model(model)
+                operations.setdefault(model._meta.app_label, []).append(
+                    migrations.AddIndex(model_name=model._meta.model_name, index=index)
+                )
+
+        for app_label, app_operations in operations.items():
+            leaves = loader.graph.leaf_nodes(app_label)
+            number = max(
+                (MigrationAutodetector.parse_number(name) or 0 for _, name in leaves),
+                default=0,
+            )
+            migration = migrations.Migration(
+                f"{number + 1:04d}_advisor_indexes", app_label
+            )
+            migration.dependencies = leaves
+            migration.operations = app_operations
+
+            writer = MigrationWriter(migration)
+            with open(writer.path, "w") as fp:
+                fp.write(writer.as_string())
+            self.stdout.write(self.style.SUCCESS(f"Created {writer.path}"))
+
+        self.stdout.write(
+            "Add the indexes to Meta.indexes of the models as well, "
+            "so makemigrations doesn't remove them."
+        )
@@ -0,0 +1,41 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.search.services import SearchLogService, SearchService
+
+
+class Command(BaseCommand):
+    help = "Replay the most frequent searches into the search result cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=7,
+            help="Number of last days of the search log to take searches from",
+        )
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=500,
+            help="Number of searches to replay",
+        )
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(days=options["days"])
+        searches = SearchLogService().top_searches(since, options["limit"])
+
+        # The semantic engine doesn't take part in cached results
+        service = SearchService(degraded=True)
+        size = service.batch_union_size
+        for start in range(0, len(searches), size):
+            service.select(
+                [
+                    (query, service.compile_filters(filter_params))
+                    for query, filter_params in searches[start : start + size]
+                ]
+            )
+
+        self.stdout.write(self.style.SUCCESS(f"Prewarmed {len(searches)} searches"))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from common import profiling
+
+
+class Command(BaseCommand):
+    help = (
+        "Create a token that enables profiling of requests "
+        "sent with it in the X-Profile header."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--max-age",
+            type=int,
+            default=3600,
+            help="Number of seconds the token is valid for",
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(profiling.create_token(options["max_age"]))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from apps.search.services import SearchService
+
+
+class Command(BaseCommand):
+    help = (
+        "Analyze title and description of every dataset again. "
+        "Run it after the text analyzer (common.analysis) has changed."
+    )
+
+    def handle(self, *args, **options):
+        changed = SearchService().reindex()
+        self.stdout.write(self.style.SUCCESS(f"Reindexed {changed} datasets"))
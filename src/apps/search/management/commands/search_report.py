@@ -0,0 +1,43 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.search.services import SearchLogService
+
+
+class Command(BaseCommand):
+    help = "Report popular and zero-result search queries."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=7,
+            help="Number of last days to report on",
+        )
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=20,
+            help="Number of queries in every section",
+        )
+
+    def handle(self, *args, **options):
+        service = SearchLogService()
+        since = timezone.now() - timedelta(days=options["days"])
+
+        self.stdout.write(self.style.MIGRATE_HEADING("Popular queries:"))
+        for row in service.popular_queries(since, options["limit"]):
+            self.stdout.write(
+                f"  {row['searches']:>6}  {row['query']!r}"
+                f"  (results: {row['avg_results']:.1f},"
+                f" latency: {row['avg_latency_ms']:.1f} ms)"
+            )
+
+        self.stdout.write(self.style.MIGRATE_HEADING("Zero-result queries:"))
+        for row in service.zero_result_queries(since, options["limit"]):
+            self.stdout.write(
+                f"  {row['searches']:>6}  {row['query']!r}"
+                f"  (last: {row['last_searched_at']:%Y-%m-%d %H:%M})"
+            )
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.7 on 2026-10-19 04:18
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="SearchQueryLog",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("query", models.CharField(max_length=500)),
+                ("filters", models.JSONField(default=dict)),
+                ("result_count", models.IntegerField()),
+                ("latency_ms", models.FloatField()),
+                ("degraded", models.BooleanField(default=False)),
+                ("created_at", models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["created_at"], name="search_sear_created_c9a29f_idx"
+                    )
+                ],
+            },
+        ),
+    ]
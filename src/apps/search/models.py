@@ -0,0 +1,23 @@
+from django.db import models
+from django.utils import timezone
+
+
+class SearchQueryLog(models.Model):
+    """
+    A search made by a user (see `apps.search.analytics`).
+    """
+
+    query = models.CharField(max_length=500)
+    # Filter params normalized by `SearchService.normalize_filters()`
+    filters = models.JSONField(default=dict)
+    result_count = models.IntegerField()
+    latency_ms = models.FloatField()
+    # Whether the search was served without the semantic engine
+    degraded = models.BooleanField(default=False)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields=["created_at"])]
+
+    def __str__(self):
+        return self.query
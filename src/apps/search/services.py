@@ -1,14 +1,55 @@
-from django.db.models import Q
+import hashlib
+import json
+import logging
 
-from apps.datasets.models import Dataset
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Avg, Count, IntegerField, Max, Q, Value, Window
+from django.db.models.functions import RowNumber
+
+from apps.datasets.models import (AnatomicalArea, Dataset, DatasetMLTask,
+                                  DatasetModality, DatasetTag, MLTask,
+                                  Modality, Tag)
+from apps.datasets.services import CatalogSnapshotService, DatasetService
+from common import admission, analysis, profiling
 from libs.medsearch import search as ms
 
+from .models import SearchQueryLog
+
+logger = logging.getLogger(__name__)
+
 
 class SearchService:
     """
     Search service with business logic.
     """
 
+    # Maximum number of queries combined into a single SQL statement
+    batch_union_size = 100
+    # Prefix of cached search results
+    cache_prefix = "search"
+    # Format of cached search results: (number of datasets, ids)
+    cache_version = 2
+    # Larger results aren't cached
+    cache_max_results = 10000
+    # Maximum number of datasets loaded per search under heavy load
+    degraded_limit = 100
+
+    # Relations filtered by names:
+    # {name: (vocabulary model, through model, through column)}
+    _vocabularies = {
+        "anatomical_area": (AnatomicalArea, None, None),
+        "modalities": (Modality, DatasetModality, "modality_id"),
+        "ml_tasks": (MLTask, DatasetMLTask, "ml_task_id"),
+        "tags": (Tag, DatasetTag, "tag_id"),
+    }
+
+    def __init__(self, degraded=False):
+        # Whether searches are served under heavy load: the semantic engine
+        # is skipped and only the first `degraded_limit` datasets are loaded.
+        # Also set when the engine turns out to be saturated.
+        self.degraded = degraded
+
     def default_datasets(self):
         """Retrieve the last 5 created datasets, just in case"""
         return Dataset.objects.order_by("created_at")[:5]
@@ -31,31 +72,38 @@ class SearchService:
         Lists are handled separately due to the specifics of
         working with them.
         """
-        return {"_list": "__name__in", "_id_list": "__id__in"}
+        return {"_id_list": "__id__in", "_list": "__name__in"}
 
-    def search_datasets(self, query, filter_params):
+    def normalize_filters(self, filter_params):
         """
-        Get all detailed datasets that match the given query
-        and filter them based on the given params.
+        Canonical form of the filter params: without empty and excluded
+        params, with sorted and deduplicated lists.
+
+        Searches with the same normalized filters find the same datasets.
+        """
+        normalized = {}
+        for name, value in sorted(filter_params.items()):
+            if not value or name.endswith(self._filter_exclude_suffixes):
+                continue
+            if name.endswith(tuple(self._filter_list_suffixes)):
+                value = ",".join(sorted({item for item in value.split(",") if item}))
+            normalized[name] = value
+        return normalized
+
+    def compile_filters(self, filter_params):
+        """
+        Build a search plan from the given filter params.
         ---
         Parameters:
-        - query: Search term (title, description)
         - filter_params: Parameters to filter the result set
-        """
 
-        # TODO: Not yet implemented
-        search_result = ms.search(query, k=5)
-        print(f"Search result from medagg-search lib: {search_result}")
-
-        # Search by title and description
-        result_set = Dataset.objects.filter(
-            Q(title__icontains=query) | Q(description__icontains=query)
-        )
-
-        # Build proper filters
-        filters = {}
-        order = ""  # Store the correct argument for quering
-        distinct = False
+        Returns dict:
+        - filters: Lookups on the dataset columns
+        - names: Names of related objects to filter by ({relation: [names]})
+        - ids: Primary keys of related objects to filter by ({relation: [ids]})
+        - order: Ordering of the result set (e.g. "-created_at")
+        """
+        plan = {"filters": {}, "names": {}, "ids": {}, "order": ""}
         for name, value in filter_params.items():
             # Ignore empty params
             if not value:
@@ -67,33 +115,447 @@ class SearchService:
 
             # There should be always some ordering
             if name.startswith("order"):
-                order = "-" + value[0] if value[1] == "desc" else value[0]
+                plan["order"] = "-" + value[0] if value[1] == "desc" else value[0]
                 continue
 
             # Extract filters with multiple values
             for k, v in self._filter_list_suffixes.items():
                 if name.endswith(k):
-                    filters[name.replace(k, v)] = value.split(",")
-                    distinct = True
+                    relation = name[: -len(k)]
+                    values = [item for item in value.split(",") if item]
+                    if v == "__id__in":
+                        plan["ids"][relation] = values
+                    else:
+                        plan["names"][relation] = values
                     break
-            if distinct:
-                continue
+            else:
+                # Extract filters with special aggregation
+                for k, v in self._filter_single_suffixes.items():
+                    if name.endswith(k):
+                        relation = name[: -len(k)]
+                        if v == "__name" and relation in self._vocabularies:
+                            plan["names"][relation] = [value]
+                        else:
+                            plan["filters"][relation + v] = value
+                        break
+                else:
+                    # Extract every other filter
+                    plan["filters"][name] = value
 
-            # Extract filters with special aggregation
-            for k, v in self._filter_single_suffixes.items():
-                if name.endswith(k):
-                    filters[name.replace(k, v)] = value
-                    break
+        return plan
+
+    def lookup_vocabularies(self, plans):
+        """
+        Resolve names of related objects used by the plans into primary keys.
+
+        Makes a single query per vocabulary, no matter how many plans are given.
+
+        Returns dict: {relation: {name: id}}
+        """
+        names = {}
+        for plan in plans:
+            for relation, values in plan["names"].items():
+                names.setdefault(relation, set()).update(values)
+
+        return {
+            relation: dict(
+                self._vocabularies[relation][0]
+                .objects.filter(name__in=values)
+                .values_list("name", "id")
+            )
+            for relation, values in names.items()
+        }
+
+    def _terms(self, query):
+        """
+        Terms of the query, or `None` if the query matches nothing: it isn't
+        blank, but has no terms (e.g. only stop words or punctuation).
+        """
+        terms = analysis.analyze_query(query)
+        if not terms and query.strip():
+            return None
+        return terms
+
+    def _match(self, query):
+        """
+        Datasets that match the query by title and description: every term
+        of the analyzed query starts some term of the dataset.
+
+        A blank query matches every dataset.
+        """
+        terms = self._terms(query)
+        if terms is None:
+            return Dataset.objects.none()
+        conditions = Q()
+        for term in terms:
+            conditions &= Q(search_text__contains=f" {term}")
+        return Dataset.objects.filter(conditions)
+
+    def _conditions(self, plan, vocabularies):
+        """Filter conditions of the plan as a single `Q` object"""
+        conditions = Q(**plan["filters"])
+
+        related = dict(plan["ids"])
+        for relation, values in plan["names"].items():
+            ids = vocabularies.get(relation, {})
+            related[relation] = [ids[name] for name in values if name in ids]
+
+        # Many-to-many relations are filtered with subqueries
+        # on the through tables, so no duplicates are produced.
+        for relation, ids in related.items():
+            _, through, column = self._vocabularies[relation]
+            if through is None:
+                conditions &= Q(**{f"{relation}_id__in": ids})
             else:
-                # Extract every other filter
-                filters[name] = value
-
-        # Now, apply aggragation if any is present
-        if filters:
-            result_set = result_set.filter(**filters)
-        if order:
-            result_set.order_by(order)
-        if distinct:
-            result_set.distinct()
-
-        return result_set
+                conditions &= Q(
+                    id__in=through.objects.filter(**{f"{column}__in": ids}).values(
+                        "dataset_id"
+                    )
+                )
+        return conditions
+
+    def search_queryset(self, query, plan, vocabularies, position=0):
+        """
+        Query of the search in the database.
+        ---
+        Parameters:
+        - query: Search term (title, description)
+        - plan: Search plan (see `compile_filters()`)
+        - vocabularies: Primary keys of related objects (see `lookup_vocabularies()`)
+        - position: Position of the search in a batch
+
+        Returns queryset of (position, id, rank, total number of matches).
+        """
+        order = [plan["order"], "id"] if plan["order"] else ["id"]
+        return (
+            self._match(query)
+            .filter(self._conditions(plan, vocabularies))
+            .annotate(
+                item=Value(position, output_field=IntegerField()),
+                rank=Window(expression=RowNumber(), order_by=order),
+                total=Window(expression=Count("id")),
+            )
+            .values_list("item", "id", "rank", "total")
+        )
+
+    def _semantic_search(self, query):
+        if self.degraded:
+            return None
+
+        # Fall back to lexical search only, instead of waiting for the engine
+        limiter = admission.engine_limiter("semantic")
+        if limiter is not None and not limiter.try_acquire():
+            self.degraded = True
+            return None
+
+        try:
+            # TODO: Not yet implemented
+            with profiling.span("semantic"):
+                search_result = ms.search(query, k=5)
+            logger.debug("Search result from medagg-search lib: %s", search_result)
+            return search_result
+        finally:
+            if limiter is not None:
+                limiter.release()
+
+    def _select_from_snapshot(self, searches):
+        """
+        Filter and order datasets on the memory-mapped catalog snapshot.
+
+        Only the text match is left to the database, it's made with a single
+        query (per `batch_union_size` distinct queries) for all searches.
+        ---
+        Parameters:
+        - searches: List of (query, plan)
+
+        Returns list of ordered ids in the order of searches, or `None` if
+        there is no snapshot, it can't evaluate some of the plans or it
+        doesn't have some of the matching datasets yet.
+        """
+        catalog = CatalogSnapshotService().current()
+        if catalog is None or not all(catalog.supports(plan) for _, plan in searches):
+            return None
+
+        # Queries with the same terms match the same datasets: {terms: query}
+        queries = {self._terms(query): query for query, _ in searches}
+        terms = list(queries)
+        matched = {query_terms: [] for query_terms in terms}
+        for start in range(0, len(terms), self.batch_union_size):
+            first, *rest = [
+                self._match(queries[query_terms])
+                .annotate(item=Value(position, output_field=IntegerField()))
+                .values_list("item", "id")
+                for position, query_terms in enumerate(
+                    terms[start : start + self.batch_union_size], start
+                )
+            ]
+            for position, id in first.union(*rest, all=True):
+                matched[terms[position]].append(id)
+
+        results = []
+        for query, plan in searches:
+            ids = catalog.select(plan, matched[self._terms(query)])
+            if ids is None:
+                return None
+            results.append(ids.tolist())
+        return results
+
+    def reindex(self):
+        """
+        Analyze title and description of every dataset again,
+        e.g. after the analyzer has changed.
+
+        Returns number of datasets whose search text has changed.
+        """
+        changed = []
+        datasets = Dataset.objects.only("id", "title", "description", "search_text")
+        for dataset in datasets.iterator(chunk_size=self.batch_union_size * 10):
+            search_text = analysis.index_text(dataset.title, dataset.description)
+            if search_text != dataset.search_text:
+                dataset.search_text = search_text
+                changed.append(dataset)
+        Dataset.objects.bulk_update(
+            changed, ["search_text"], batch_size=self.batch_union_size * 10
+        )
+        if changed:
+            self.invalidate_cache()
+        return len(changed)
+
+    def _cache_key(self, generation, query, plan):
+        # Limited and full results of a search share the key,
+        # the cached value tells which one it is (see `select()`)
+        digest = hashlib.blake2b(
+            json.dumps(
+                [self._terms(query), plan], sort_keys=True, default=str
+            ).encode(),
+            digest_size=16,
+        ).hexdigest()
+        return f"{self.cache_prefix}:{generation}:{digest}"
+
+    def invalidate_cache(self):
+        """
+        Forget all cached search results (e.g. after the search text has changed).
+
+        Results are cached per generation of the catalog, so changes of the
+        catalog invalidate them on their own (see `apps.datasets.signals`).
+        """
+        CatalogSnapshotService().catalog_changed()
+
+    def select(self, searches, limit=None):
+        """
+        Ids of datasets found by every search, in the requested order.
+
+        Results are taken from the cache, the rest are filtered together
+        on the catalog snapshot or in the database and cached.
+        ---
+        Parameters:
+        - searches: List of (query, plan)
+        - limit: Maximum number of ids per search (all by default)
+
+        Returns list of (number of found datasets, ordered ids)
+        in the order of searches.
+        """
+        timeout = settings.SEARCH_CACHE_TIMEOUT
+        if not timeout:
+            return self._select_uncached(searches, limit)
+
+        with profiling.span("cache"):
+            generation = CatalogSnapshotService().generation()
+            keys = [
+                self._cache_key(generation, query, plan) for query, plan in searches
+            ]
+            cached = cache.get_many(keys, version=self.cache_version)
+
+        # Results cached with a smaller limit don't count
+        cached = {
+            key: (count, ids)
+            for key, (count, ids) in cached.items()
+            if len(ids) == count or (limit is not None and len(ids) >= limit)
+        }
+        missing = [i for i, key in enumerate(keys) if key not in cached]
+        if missing:
+            selected = self._select_uncached([searches[i] for i in missing], limit)
+            cached.update((keys[i], found) for i, found in zip(missing, selected))
+            with profiling.span("cache"):
+                cache.set_many(
+                    {
+                        keys[i]: found
+                        for i, found in zip(missing, selected)
+                        if len(found[1]) <= self.cache_max_results
+                    },
+                    timeout=timeout,
+                    version=self.cache_version,
+                )
+        return [
+            (count, ids if limit is None else ids[:limit])
+            for count, ids in (cached[key] for key in keys)
+        ]
+
+    def _select_uncached(self, searches, limit=None):
+        with profiling.span("snapshot"):
+            selected = self._select_from_snapshot(searches)
+        if selected is not None:
+            return [(len(ids), ids[:limit]) for ids in selected]
+        with profiling.span("database"):
+            return self._select_from_database(searches, limit)
+
+    def search_datasets(self, query, filter_params, fields=None):
+        """
+        Get all detailed datasets that match the given query
+        and filter them based on the given params.
+        ---
+        Parameters:
+        - query: Search term (title, description)
+        - filter_params: Parameters to filter the result set
+        - fields: Fields of detailed datasets to load (all by default)
+
+        Returns dict with `count` and `results` (only the first
+        `degraded_limit` datasets if the search is degraded).
+        """
+        self._semantic_search(query)
+
+        with profiling.span("filters"):
+            plan = self.compile_filters(self.normalize_filters(filter_params))
+        limit = self.degraded_limit if self.degraded else None
+        count, ids = self.select([(query, plan)], limit)[0]
+        with profiling.span("load"):
+            datasets = DatasetService().get_many_detailed(ids, fields=fields)
+        results = [datasets[id] for id in ids if id in datasets]
+        # Datasets deleted since the ids were selected aren't counted
+        return {"count": count - len(ids) + len(results), "results": results}
+
+    def _select_from_database(self, searches, limit=None):
+        """
+        Filter and order datasets of many searches in the database.
+
+        Matching ids of every search are fetched with a single query
+        (per `batch_union_size` searches), only the first `limit` of them
+        leave the database.
+        ---
+        Parameters:
+        - searches: List of (query, plan)
+        - limit: Maximum number of ids per search (all by default)
+
+        Returns list of (number of found datasets, ordered ids)
+        in the order of searches.
+        """
+        vocabularies = self.lookup_vocabularies(plan for _, plan in searches)
+
+        subqueries = []
+        for position, (query, plan) in enumerate(searches):
+            queryset = self.search_queryset(query, plan, vocabularies, position)
+            if limit is not None:
+                queryset = queryset.filter(rank__lte=limit)
+            subqueries.append(queryset)
+
+        # Matching ids of every search: [(rank, id)]
+        matches = [[] for _ in subqueries]
+        counts = [0] * len(subqueries)
+        for start in range(0, len(subqueries), self.batch_union_size):
+            first, *rest = subqueries[start : start + self.batch_union_size]
+            for position, id, rank, total in first.union(*rest, all=True):
+                matches[position].append((rank, id))
+                counts[position] = total
+
+        return [
+            (count, [id for _, id in sorted(found)])
+            for count, found in zip(counts, matches)
+        ]
+
+    def search_datasets_batch(self, items, limit, fields=None):
+        """
+        Execute many searches at once.
+
+        Identical items are executed only once, filters of all items share
+        vocabulary lookups, matching ids of all items are taken from the cache
+        or fetched together (on the catalog snapshot when possible) and
+        the union of resulting datasets is loaded once.
+        ---
+        Parameters:
+        - items: List of (query, filter_params)
+        - limit: Maximum number of datasets returned per item
+        - fields: Fields of detailed datasets to load (all by default)
+
+        Returns list of dicts with `count` and `results` in the order of items.
+        """
+        keys = [
+            json.dumps([query, filter_params], sort_keys=True, default=str)
+            for query, filter_params in items
+        ]
+        unique = dict(zip(keys, items))
+
+        searches = []
+        for query, filter_params in unique.values():
+            self._semantic_search(query)
+            searches.append(
+                (query, self.compile_filters(self.normalize_filters(filter_params)))
+            )
+
+        if self.degraded:
+            limit = min(limit, self.degraded_limit)
+        results = dict(zip(unique, self.select(searches, limit)))
+
+        with profiling.span("load"):
+            datasets = DatasetService().get_many_detailed(
+                {id for _, ids in results.values() for id in ids}, fields=fields
+            )
+        response = {}
+        for key, (count, ids) in results.items():
+            found = [datasets[id] for id in ids if id in datasets]
+            # Datasets deleted since the ids were selected aren't counted
+            response[key] = {"count": count - len(ids) + len(found), "results": found}
+        return [response[key] for key in keys]
+
+
+class SearchLogService:
+    """
+    Reports on the search log (see `apps.search.analytics`).
+    """
+
+    def _since(self, since):
+        return SearchQueryLog.objects.filter(created_at__gte=since)
+
+    def popular_queries(self, since, limit):
+        """
+        Most frequent queries.
+
+        Returns list of dicts: query, searches, avg_results, avg_latency_ms.
+        """
+        return list(
+            self._since(since)
+            .values("query")
+            .annotate(
+                searches=Count("id"),
+                avg_results=Avg("result_count"),
+                avg_latency_ms=Avg("latency_ms"),
+            )
+            .order_by("-searches", "query")[:limit]
+        )
+
+    def zero_result_queries(self, since, limit):
+        """
+        Most frequent queries that found nothing.
+
+        Returns list of dicts: query, searches, last_searched_at.
+        """
+        return list(
+            self._since(since)
+            .filter(result_count=0)
+            .values("query")
+            .annotate(searches=Count("id"), last_searched_at=Max("created_at"))
+            .order_by("-searches", "query")[:limit]
+        )
+
+    def top_searches(self, since, limit):
+        """
+        Most frequent searches (queries with their normalized filters).
+
+        Returns list of (query, filter_params).
+        """
+        return list(
+            self._since(since)
+            .values_list("query", "filters")
+            .annotate(searches=Count("id"))
+            .order_by("-searches")
+            .values_list("query", "filters")[:limit]
+        )
@@ -0,0 +1,51 @@
+import tempfile
+
+from django.test import TestCase, override_settings
+
+from apps.datasets.models import Dataset
+from apps.search.services import SearchService
+
+
+class SearchServiceTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.lungs = Dataset.objects.create(
+            title="Сегментация лёгких", description="Chest CT images"
+        ).id
+        cls.brain = Dataset.objects.create(
+            title="Brain MRI", description="Segmentation of gliomas"
+        ).id
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(CATALOG_SNAPSHOT_DIR=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        # The semantic engine is skipped
+        self.service = SearchService(degraded=True)
+
+    def _match(self, query):
+        return sorted(self.service._match(query).values_list("id", flat=True))
+
+    def test_match(self):
+        for query, expected in (
+            ("сегментации", [self.lungs]),
+            ("легкие", [self.lungs]),
+            # Terms are prefixes of the indexed ones
+            ("сегм", [self.lungs]),
+            ("image", [self.lungs]),
+            ("segment", [self.brain]),
+            ("Brain glioma", [self.brain]),
+            ("brain lungs", []),
+            ("", [self.lungs, self.brain]),
+        ):
+            with self.subTest(query=query):
+                self.assertEqual(self._match(query), sorted(expected))
+
+    def test_stop_words_match_nothing(self):
+        # Unlike a blank query, a query without terms isn't "everything"
+        for query in ("the", "и", "the и", "?!"):
+            with self.subTest(query=query):
+                result = self.service.search_datasets(query, {})
+                self.assertEqual(result, {"count": 0, "results": []})
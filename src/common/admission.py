@@ -0,0 +1,321 @@
+"""
+Admission control and load shedding.
+
+Instead of letting every request wait for the database until it times out,
+requests to the configured routes (`settings.ADMISSION_CONTROL["ROUTES"]`)
+go through:
+1. Per-client token bucket rate limit, shared by all worker processes
+   through a memory-mapped file (429 when exceeded). Every route has its
+   own buckets, requests to a route with `COST_FIELD` take a token per
+   item of that JSON list field (e.g. per search of a batch).
+2. Per-route concurrency limit with a bounded wait queue. Requests that
+   can't be served before their deadline are rejected right away
+   (503 with `Retry-After`).
+
+Rate limits are shared by all worker processes, while concurrency limits
+and queues are kept by every process on its own (they protect the process'
+threads and its database connections).
+
+Clients are identified by the user or by the address, which is taken from
+`X-Forwarded-For` when the request comes through one of
+`settings.ADMISSION_CONTROL["TRUSTED_PROXIES"]`.
+
+Requests that had to wait in the queue are marked as degraded
+(`request.degraded`), so views can do less work (e.g. searches skip the
+semantic engine and return fewer datasets).
+Expensive engines can be guarded with `engine_limiter()` as well.
+"""
+
+import fcntl
+import hashlib
+import ipaddress
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+from django.conf import settings
+from django.http import JsonResponse
+
+
+class ConcurrencyLimiter:
+    """
+    Limit of simultaneously processed requests with a bounded wait queue.
+
+    Keeps a moving average of the processing time to estimate how long
+    a new request would wait for its turn.
+    """
+
+    # Weight of the last processing time in the moving average
+    smoothing = 0.2
+
+    def __init__(self, concurrency, queue_size=0, timeout=0):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        self.service_time = 0.1
+        self._cond = threading.Condition()
+
+    def _estimated_wait(self):
+        if self.active < self.concurrency:
+            return 0
+        return (self.waiting + 1) * self.service_time / self.concurrency
+
+    def acquire(self):
+        """
+        Wait for a free slot, but not longer than `timeout`.
+        ---
+        Returns tuple: (admitted, waited, retry_after), where `retry_after`
+        is the estimated wait in seconds for rejected requests.
+        """
+        with self._cond:
+            if self.active < self.concurrency and not self.waiting:
+                self.active += 1
+                return True, False, 0
+
+            # Don't even wait if the deadline can't be met
+            wait = self._estimated_wait()
+            if self.waiting >= self.queue_size or wait > self.timeout:
+                return False, False, wait
+
+            self.waiting += 1
+            deadline = time.monotonic() + self.timeout
+            try:
+                while self.active >= self.concurrency:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False, True, self._estimated_wait()
+                    self._cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+
+            self.active += 1
+            return True, True, 0
+
+    def try_acquire(self):
+        """Take a free slot without waiting. Returns whether it was taken."""
+        with self._cond:
+            if self.active >= self.concurrency:
+                return False
+            self.active += 1
+            return True
+
+    def release(self, elapsed=None):
+        """
+        Free the slot.
+        ---
+        Parameters:
+        - elapsed: Processing time in seconds, to update the moving average
+        """
+        with self._cond:
+            self.active -= 1
+            if elapsed is not None:
+                self.service_time += self.smoothing * (elapsed - self.service_time)
+            self._cond.notify()
+
+
+class SharedTokenBuckets:
+    """
+    Token buckets stored in a memory-mapped file shared by worker processes.
+
+    Every client is hashed into one of `slots` fixed-size slots, each slot
+    is guarded by a lock on its byte range of the file. Clients colliding
+    in a slot share the bucket, so their limit only gets stricter.
+    """
+
+    _slot = struct.Struct("<Qdd")  # (key hash of the last client, tokens, updated at)
+
+    def __init__(self, path, slots=65536):
+        self.path = path
+        self.slots = slots
+        self._fd = None
+        self._mm = None
+        # Record locks don't exclude threads of the same process
+        self._lock = threading.Lock()
+
+    def _map(self):
+        if self._mm is None:
+            size = self.slots * self._slot.size
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self._fd, self._mm = fd, mmap.mmap(fd, size)
+        return self._mm
+
+    def take(self, key, rate, burst, tokens=1):
+        """
+        Take tokens from the client's bucket.
+        ---
+        Parameters:
+        - key: Client identifier
+        - rate: Tokens added per second
+        - burst: Capacity of the bucket
+        - tokens: Number of tokens to take (capped by `burst`)
+
+        Returns 0 if the tokens were taken, otherwise seconds until there are enough.
+        """
+        cost = min(tokens, burst)
+        key_hash = int.from_bytes(
+            hashlib.blake2b(key.encode(), digest_size=8).digest(), "little"
+        )
+        size = self._slot.size
+        offset = key_hash % self.slots * size
+
+        with self._lock:
+            mm = self._map()
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, size, offset)
+            try:
+                now = time.time()
+                # An empty slot (zeros) refills to a full bucket
+                _, available, updated = self._slot.unpack_from(mm, offset)
+                available = min(burst, available + max(now - updated, 0) * rate)
+                if available >= cost:
+                    available -= cost
+                    wait = 0
+                else:
+                    wait = (cost - available) / rate
+                self._slot.pack_into(mm, offset, key_hash, available, now)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, size, offset)
+        return wait
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+_buckets = None
+
+
+def _get_limiter(name, options):
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = ConcurrencyLimiter(
+                concurrency=options["CONCURRENCY"],
+                queue_size=options.get("QUEUE", 0),
+                timeout=options.get("TIMEOUT", 0),
+            )
+        return _limiters[name]
+
+
+def engine_limiter(name):
+    """
+    Concurrency limiter of an expensive engine (`settings.ADMISSION_CONTROL["ENGINES"]`).
+
+    Returns `None` if the engine isn't limited.
+    """
+    options = settings.ADMISSION_CONTROL["ENGINES"].get(name)
+    if options is None:
+        return None
+    return _get_limiter(f"engine:{name}", options)
+
+
+def _get_buckets():
+    global _buckets
+    if _buckets is None:
+        _buckets = SharedTokenBuckets(settings.ADMISSION_CONTROL["SHARED_MEMORY"])
+    return _buckets
+
+
+def _is_trusted(addr, networks):
+    try:
+        addr = ipaddress.ip_address(addr)
+    except ValueError:
+        return False
+    return any(addr in network for network in networks)
+
+
+def client_address(request):
+    """
+    Address of the client that made the request.
+
+    Behind trusted proxies it's the last address in `X-Forwarded-For`
+    that wasn't added by a trusted proxy, otherwise `REMOTE_ADDR`.
+    """
+    addr = request.META.get("REMOTE_ADDR", "")
+    networks = [
+        ipaddress.ip_network(proxy, strict=False)
+        for proxy in settings.ADMISSION_CONTROL["TRUSTED_PROXIES"]
+    ]
+    if not _is_trusted(addr, networks):
+        return addr
+    forwarded = request.META.get("HTTP_X_FORWARDED_FOR", "")
+    for hop in reversed([hop.strip() for hop in forwarded.split(",")]):
+        if not hop:
+            continue
+        addr = hop
+        if not _is_trusted(hop, networks):
+            break
+    return addr
+
+
+def _reject(status, detail, retry_after):
+    response = JsonResponse({"detail": detail}, status=status)
+    response["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+class AdmissionControlMiddleware:
+    """
+    Apply rate limits and concurrency limits to the configured routes.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def _route(self, request):
+        for prefix, options in settings.ADMISSION_CONTROL["ROUTES"].items():
+            if request.path_info.startswith(prefix):
+                methods = options.get("METHODS")
+                if methods is None or request.method in methods:
+                    return prefix, options
+        return None, None
+
+    def _client(self, request):
+        user = getattr(request, "user", None)
+        if user is not None and user.is_authenticated:
+            return f"user:{user.pk}"
+        return f"addr:{client_address(request)}"
+
+    def _cost(self, request, options):
+        field = options.get("COST_FIELD")
+        if field is None:
+            return 1
+        try:
+            items = json.loads(request.body).get(field)
+        except (ValueError, AttributeError):
+            # Invalid requests are rejected by the view
+            return 1
+        return max(len(items), 1) if isinstance(items, list) else 1
+
+    def __call__(self, request):
+        prefix, options = self._route(request)
+        if prefix is None:
+            return self.get_response(request)
+
+        config = settings.ADMISSION_CONTROL
+        rate = options.get("RATE", config["RATE"])
+        if rate:
+            wait = _get_buckets().take(
+                f"{prefix}:{self._client(request)}",
+                rate,
+                options.get("BURST", config["BURST"]),
+                tokens=self._cost(request, options),
+            )
+            if wait:
+                return _reject(429, "Request rate limit exceeded.", wait)
+
+        limiter = _get_limiter(f"route:{prefix}", options)
+        admitted, waited, retry_after = limiter.acquire()
+        if not admitted:
+            return _reject(503, "Server is overloaded, try again later.", retry_after)
+
+        request.degraded = waited
+        started = time.monotonic()
+        try:
+            return self.get_response(request)
+        finally:
+            limiter.release(time.monotonic() - started)
@@ -0,0 +1,120 @@
+"""
+Text analysis for full-text search of Russian and English content.
+
+Text is split into terms the same way at index time (`index_text()`)
+and at query time (`analyze_query()`):
+1. Unicode normalization (NFKC), so full-width, ligature and other
+   compatibility forms become their plain equivalents.
+2. Case folding and ё/е folding.
+3. Tokenization into words and numbers.
+4. Removal of stop words.
+5. Light stemming: inflectional endings of Russian (Cyrillic words) and
+   English (Latin words) are removed, numbers and mixed words are kept.
+
+Stems are matched as prefixes of the indexed stems, so partially typed
+words still find datasets.
+"""
+
+import functools
+import re
+import unicodedata
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+_CYRILLIC_PATTERN = re.compile(r"^[а-я]+$")
+_LATIN_PATTERN = re.compile(r"^[a-z]+$")
+
+STOP_WORDS = frozenset("""
+    a an and are as at be by for from has have in into is it its of on or
+    that the their this to was were with within without
+
+    а без более бы был была были было быть в во вот все всех где да для до
+    его ее если есть еще же за и из или им их к как ко когда ли либо между
+    мы на над не нет ни но о об однако от по под при про с со так также то
+    только у уже чем что чтобы эта эти это этот
+    """.split())
+
+# Endings removed from the words, the longest matching one is removed
+_RUSSIAN_ENDINGS = sorted(
+    """
+    ость ости остью остей остям остями остях
+    иями ями ами иях ях ах иям ям ам ией ием ей ем ом ой ий ый ия ии ию ью
+    ого его ому ему ыми ими ых их ая яя ое ее ые ие ую юю
+    ться тся ешь ете ите ают яют ует ют ут ат ят ить ать ять еть ла ли ло ть
+    ов ев а я о е у ю ы и ь й
+    """.split(),
+    key=len,
+    reverse=True,
+)
+_ENGLISH_ENDINGS = sorted(
+    """
+    ifications ification ified ifies ify
+    izations ization izing ized izes ize
+    ations ation nesses ness
+    ings ing edly ed ies ly es s e y
+    """.split(),
+    key=len,
+    reverse=True,
+)
+# Shortest stem left after removing an ending
+_MIN_STEM = 3
+
+
+def _strip_ending(word, endings):
+    for ending in endings:
+        if word.endswith(ending) and len(word) - len(ending) >= _MIN_STEM:
+            return word[: -len(ending)]
+    return word
+
+
+@functools.lru_cache(maxsize=65536)
+def stem(word):
+    """Stem of the normalized word."""
+    if _CYRILLIC_PATTERN.match(word):
+        word = _strip_ending(word, _RUSSIAN_ENDINGS)
+        # Derivational "и" (e.g. "сегментаци-я")
+        if word.endswith(("и", "ь")) and len(word) > _MIN_STEM:
+            word = word[:-1]
+        return word
+    if _LATIN_PATTERN.match(word) and not word.endswith("ss"):
+        return _strip_ending(word, _ENGLISH_ENDINGS)
+    return word
+
+
+def normalize(text):
+    """Text in the canonical form: NFKC, case folded, with е instead of ё."""
+    return unicodedata.normalize("NFKC", text).casefold().replace("ё", "е")
+
+
+def analyze(text):
+    """
+    Terms of the text in the order they appear.
+    ---
+    Parameters:
+    - text: Text in any form
+
+    Returns list of terms.
+    """
+    return [
+        stem(token)
+        for token in _TOKEN_PATTERN.findall(normalize(text))
+        if token not in STOP_WORDS
+    ]
+
+
+@functools.lru_cache(maxsize=4096)
+def analyze_query(query):
+    """
+    Distinct terms of the search query (cached, queries repeat a lot).
+
+    Returns tuple of terms, empty if the query has no terms.
+    """
+    return tuple(dict.fromkeys(analyze(query)))
+
+
+def index_text(*texts):
+    """
+    Stored form of the texts: distinct terms separated and surrounded by
+    spaces, so a term prefix is matched with `contains=" " + term`.
+    """
+    terms = dict.fromkeys(term for text in texts if text for term in analyze(text))
+    return f" {' '.join(terms)} " if terms else ""
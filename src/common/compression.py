@@ -0,0 +1,232 @@
+"""
+Negotiated compression of responses.
+
+The encoding is chosen from `Accept-Encoding` among the available ones,
+in the order of preference: zstd (`zstandard` package), br (`brotli`
+package) and gzip. Only responses of `settings.COMPRESSION["TYPES"]`
+are compressed, so already compressed files (archives, images, etc.)
+and HTML pages (BREACH) are left as is, as well as:
+- bodies smaller than `settings.COMPRESSION["MIN_SIZE"]`;
+- partial responses and requests with `Range`;
+- downloads (`Content-Disposition: attachment`), so they're resumable
+  and files can be sent with `sendfile()`;
+- responses that are already encoded.
+
+Streaming responses, as well as bodies larger than
+`settings.COMPRESSION["STREAM_SIZE"]`, are compressed chunk by chunk
+while they're being sent.
+"""
+
+import zlib
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class GzipEncoder:
+    name = "gzip"
+
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class BrotliEncoder:
+    name = "br"
+
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class ZstdEncoder:
+    name = "zstd"
+
+    def __init__(self, level):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+# Available encoders in the order of preference
+ENCODERS = {
+    encoder.name: encoder
+    for encoder, module in (
+        (ZstdEncoder, zstandard),
+        (BrotliEncoder, brotli),
+        (GzipEncoder, zlib),
+    )
+    if module is not None
+}
+
+
+def negotiate(accept_encoding):
+    """
+    Choose the best available encoding accepted by the client.
+
+    Returns name of the encoding, or `None` if none is acceptable.
+    """
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, *params = part.strip().lower().split(";")
+        weight = 1.0
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if name:
+            weights[name] = weight
+
+    wildcard = weights.get("*", 0.0)
+    best, best_weight = None, 0.0
+    for name in ENCODERS:
+        weight = weights.get(name, wildcard)
+        if weight > best_weight:
+            best, best_weight = name, weight
+    return best
+
+
+def compress(data, encoding):
+    """Compress the whole body with the given encoding."""
+    encoder = ENCODERS[encoding](settings.COMPRESSION["LEVELS"][encoding])
+    return encoder.compress(data) + encoder.finish()
+
+
+def _compress_chunks(chunks, encoder):
+    for chunk in chunks:
+        data = encoder.compress(chunk) + encoder.flush()
+        if data:
+            yield data
+    yield encoder.finish()
+
+
+async def _compress_chunks_async(chunks, encoder):
+    async for chunk in chunks:
+        data = encoder.compress(chunk) + encoder.flush()
+        if data:
+            yield data
+    yield encoder.finish()
+
+
+class CompressionMiddleware:
+    """
+    Compress responses with the best encoding accepted by the client.
+    """
+
+    # Size of the chunks large bodies are compressed in
+    chunk_size = 64 * 1024
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        return self.process_response(request, response)
+
+    def _compressible(self, request, response):
+        if response.has_header("Content-Encoding"):
+            return False
+        if response.status_code == 206 or "HTTP_RANGE" in request.META:
+            return False
+        if response.get("Content-Disposition", "").startswith("attachment"):
+            return False
+        content_type = response.get("Content-Type", "").split(";")[0].strip()
+        if content_type not in settings.COMPRESSION["TYPES"]:
+            return False
+        return response.streaming or (
+            len(response.content) >= settings.COMPRESSION["MIN_SIZE"]
+        )
+
+    def process_response(self, request, response):
+        if not self._compressible(request, response):
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        encoding = negotiate(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        if encoding is None:
+            return response
+
+        encoder = ENCODERS[encoding](settings.COMPRESSION["LEVELS"][encoding])
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = _compress_chunks_async(
+                    response.streaming_content, encoder
+                )
+            else:
+                response.streaming_content = _compress_chunks(
+                    response.streaming_content, encoder
+                )
+            # The length of the compressed content is unknown
+            del response["Content-Length"]
+        elif len(response.content) >= settings.COMPRESSION["STREAM_SIZE"]:
+            response = self._streaming(response, encoder)
+        else:
+            compressed = encoder.compress(response.content) + encoder.finish()
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response["Content-Length"] = str(len(compressed))
+
+        # The compressed representation differs byte by byte
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response["ETag"] = "W/" + etag
+        response["Content-Encoding"] = encoding
+        return response
+
+    def _streaming(self, response, encoder):
+        """Streaming copy of the response that compresses the body while it's sent"""
+        content = response.content
+        streaming = StreamingHttpResponse(
+            _compress_chunks(
+                (
+                    content[start : start + self.chunk_size]
+                    for start in range(0, len(content), self.chunk_size)
+                ),
+                encoder,
+            ),
+            status=response.status_code,
+            reason=response.reason_phrase,
+        )
+        for header, value in response.items():
+            if header.lower() != "content-length":
+                streaming[header] = value
+        streaming.cookies = response.cookies
+        return streaming
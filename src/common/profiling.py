@@ -0,0 +1,287 @@
+"""
+On-demand profiling of requests and slow query log.
+
+A request is profiled when it carries a valid signed token in the
+`X-Profile` header (`python manage.py profile_token`), or when it's picked
+by `settings.PROFILING["SAMPLE_RATE"]`. Profiled requests run under
+`cProfile` (unless another request is being profiled) with every SQL
+query captured, and leave two files in
+`settings.PROFILING["DIR"]`:
+- `<id>.prof` - `pstats` data (e.g. for `snakeviz` or `python -m pstats`);
+- `<id>.json` - summary: time and queries per stage (see `span()`),
+  the slowest queries and functions.
+The response gets `Server-Timing` with the stages and `X-Profile-Id`.
+Files are written after the response has been sent and only the latest
+`settings.PROFILING["MAX_FILES"]` profiles are kept.
+
+Stages of the work are marked with `span()`, which costs a single context
+variable lookup when the request isn't profiled.
+
+Queries slower than `settings.PROFILING["SLOW_QUERY_MS"]` are logged
+with the `common.profiling.slow_queries` logger in every request.
+"""
+
+import contextlib
+import contextvars
+import cProfile
+import functools
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core import signing
+from django.core.signals import request_finished
+from django.db import connections
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger(f"{__name__}.slow_queries")
+
+# Salt of the profiling tokens
+TOKEN_SALT = "common.profiling"
+# Stage of the work that isn't in any span
+ROOT_STAGE = "other"
+
+_current = contextvars.ContextVar("profile", default=None)
+_noop = contextlib.nullcontext()
+# Profiles of the thread's request written when it's finished
+_pending = threading.local()
+
+
+class Profile:
+    """
+    Time and queries of a profiled request per stage.
+    """
+
+    def __init__(self):
+        # {stage: [seconds, calls]}
+        self.stages = {}
+        # List of (stage, sql, seconds)
+        self.queries = []
+        # Seconds spent in the outermost spans
+        self.spanned = 0.0
+        self._stack = [ROOT_STAGE]
+
+    @contextlib.contextmanager
+    def span(self, name):
+        self._stack.append(name)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self._stack.pop()
+            if len(self._stack) == 1:
+                self.spanned += elapsed
+            stage = self.stages.setdefault(name, [0.0, 0])
+            stage[0] += elapsed
+            stage[1] += 1
+
+    def capture_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((self._stack[-1], sql, time.perf_counter() - started))
+
+
+def span(name):
+    """
+    Context manager that measures a named stage of the profiled request.
+
+    Does nothing when the current request isn't profiled.
+    """
+    profile = _current.get()
+    if profile is None:
+        return _noop
+    return profile.span(name)
+
+
+def create_token(max_age):
+    """Signed token that enables profiling for the given number of seconds."""
+    return signing.dumps(int(time.time() + max_age), salt=TOKEN_SALT)
+
+
+def _valid_token(token):
+    try:
+        expires = signing.loads(token, salt=TOKEN_SALT)
+    except signing.BadSignature:
+        return False
+    return isinstance(expires, int) and expires >= time.time()
+
+
+def _log_slow_query(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = (time.perf_counter() - started) * 1000
+        if elapsed >= settings.PROFILING["SLOW_QUERY_MS"]:
+            slow_query_logger.warning(
+                "Slow query (%.1f ms) on %s: %s",
+                elapsed,
+                context["connection"].alias,
+                sql,
+            )
+
+
+class ProfilingMiddleware:
+    """
+    Profile requests on demand and log slow queries.
+    """
+
+    header = "X-Profile"
+    # Number of the slowest queries and functions in the summary
+    top = 20
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        options = settings.PROFILING
+        token = request.headers.get(self.header)
+        profiled = (token is not None and _valid_token(token)) or (
+            options["SAMPLE_RATE"] > 0 and random.random() < options["SAMPLE_RATE"]
+        )
+        if not profiled and not options["SLOW_QUERY_MS"]:
+            return self.get_response(request)
+
+        with contextlib.ExitStack() as stack:
+            if options["SLOW_QUERY_MS"]:
+                for alias in connections:
+                    stack.enter_context(
+                        connections[alias].execute_wrapper(_log_slow_query)
+                    )
+            if not profiled:
+                return self.get_response(request)
+            return self._profile(request, stack)
+
+    def _profile(self, request, stack):
+        profile = Profile()
+        for alias in connections:
+            stack.enter_context(
+                connections[alias].execute_wrapper(profile.capture_query)
+            )
+        token = _current.set(profile)
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another request of the process is being profiled,
+            # only a single profiler can be active at a time
+            profiler = None
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            _current.reset(token)
+        total = time.perf_counter() - started
+
+        # Nanoseconds keep ids of profiles taken within a second in order
+        now = time.time_ns()
+        profile_id = "{}.{:09d}-{}".format(
+            time.strftime("%Y%m%dT%H%M%S", time.gmtime(now // 10**9)),
+            now % 10**9,
+            uuid.uuid4().hex[:8],
+        )
+        # Formatting the stats takes a while, the client doesn't wait for it
+        if not hasattr(_pending, "writes"):
+            _pending.writes = []
+        _pending.writes.append(
+            functools.partial(
+                self._write, profile_id, request, response, profile, profiler, total
+            )
+        )
+
+        timings = [
+            f"{name};dur={seconds * 1000:.1f}"
+            for name, (seconds, _) in profile.stages.items()
+        ]
+        sql = sum(seconds for _, _, seconds in profile.queries)
+        timings.append(f"sql;dur={sql * 1000:.1f}")
+        timings.append(f"total;dur={total * 1000:.1f}")
+        response["Server-Timing"] = ", ".join(timings)
+        response["X-Profile-Id"] = profile_id
+        return response
+
+    def _write(self, profile_id, request, response, profile, profiler, total):
+        directory = settings.PROFILING["DIR"]
+        os.makedirs(directory, exist_ok=True)
+
+        stages = {
+            name: {"ms": seconds * 1000, "calls": calls, "queries": 0, "sql_ms": 0.0}
+            for name, (seconds, calls) in profile.stages.items()
+        }
+        stages[ROOT_STAGE] = {
+            "ms": (total - profile.spanned) * 1000,
+            "calls": 1,
+            "queries": 0,
+            "sql_ms": 0.0,
+        }
+        for stage, _, seconds in profile.queries:
+            stages[stage]["queries"] += 1
+            stages[stage]["sql_ms"] += seconds * 1000
+
+        functions = ""
+        if profiler is not None:
+            profiler.dump_stats(os.path.join(directory, f"{profile_id}.prof"))
+            stream = io.StringIO()
+            stats = pstats.Stats(profiler, stream=stream)
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top)
+            functions = stream.getvalue()
+
+        summary = {
+            "id": profile_id,
+            "method": request.method,
+            "path": request.get_full_path(),
+            "status": response.status_code,
+            "total_ms": total * 1000,
+            "stages": stages,
+            "queries": len(profile.queries),
+            "sql_ms": sum(seconds for _, _, seconds in profile.queries) * 1000,
+            "slowest_queries": [
+                {"stage": stage, "sql": sql, "ms": seconds * 1000}
+                for stage, sql, seconds in sorted(
+                    profile.queries, key=lambda query: query[2], reverse=True
+                )[: self.top]
+            ],
+            "functions": functions,
+        }
+        with open(os.path.join(directory, f"{profile_id}.json"), "w") as fp:
+            json.dump(summary, fp, indent=2)
+        self._prune(directory)
+
+    def _prune(self, directory):
+        """Remove the oldest profiles above `settings.PROFILING["MAX_FILES"]`"""
+        max_files = settings.PROFILING["MAX_FILES"]
+        if not max_files:
+            return
+        # Profile ids start with the time, so they sort from the oldest
+        summaries = sorted(
+            name for name in os.listdir(directory) if name.endswith(".json")
+        )
+        for name in summaries[:-max_files]:
+            profile_id = name[: -len(".json")]
+            for suffix in (".prof", ".json"):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(os.path.join(directory, profile_id + suffix))
+
+
+@receiver(request_finished)
+def _write_profiles(sender, **kwargs):
+    writes = getattr(_pending, "writes", None)
+    while writes:
+        write = writes.pop(0)
+        try:
+            write()
+        except OSError:
+            logger.warning("Profile of the request isn't written", exc_info=True)
@@ -0,0 +1,178 @@
+"""
+Faster renderers for API responses.
+
+`FastJSONRenderer` produces the same JSON as DRF's `JSONRenderer`, but
+encodes with `orjson` when it's installed. `MessagePackRenderer` is chosen
+with `Accept: application/msgpack` and encodes with `msgpack` when it's
+installed, falling back to a pure-Python encoder otherwise.
+
+Values that aren't JSON types (dates, decimals, lazy strings, etc.) are
+converted by DRF's JSON encoder in both renderers.
+"""
+
+import struct
+
+from rest_framework import renderers
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class FastJSONRenderer(renderers.JSONRenderer):
+    """
+    JSON renderer that encodes compact JSON with `orjson`.
+
+    Indented output (`Accept: application/json; indent=4`, the browsable
+    API) and values `orjson` can't encode go through `JSONRenderer`.
+    """
+
+    _orjson_options = (
+        orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME if orjson else 0
+    )
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None
+            or data is None
+            or not self.compact
+            or self.ensure_ascii
+            or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(
+                data, default=self.encoder_class().default, option=self._orjson_options
+            )
+        except orjson.JSONEncodeError:
+            # E.g. integers larger than 64 bits
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # Keep the output a strict JavaScript subset, as `JSONRenderer` does
+        if b"\xe2\x80\xa8" in ret or b"\xe2\x80\xa9" in ret:
+            ret = ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(
+                b"\xe2\x80\xa9", b"\\u2029"
+            )
+        return ret
+
+
+# Integer types: (minimum, maximum, struct format, type code)
+_INT_FORMATS = (
+    (0, 0xFF, ">BB", 0xCC),
+    (0, 0xFFFF, ">BH", 0xCD),
+    (0, 0xFFFFFFFF, ">BI", 0xCE),
+    (0, 0xFFFFFFFFFFFFFFFF, ">BQ", 0xCF),
+    (-0x80, 0x7F, ">Bb", 0xD0),
+    (-0x8000, 0x7FFF, ">Bh", 0xD1),
+    (-0x80000000, 0x7FFFFFFF, ">Bi", 0xD2),
+    (-0x8000000000000000, 0x7FFFFFFFFFFFFFFF, ">Bq", 0xD3),
+)
+
+
+def _pack(obj, out, default):
+    """Append MessagePack representation of the object to the bytearray."""
+    if obj is None:
+        out.append(0xC0)
+    elif obj is True:
+        out.append(0xC3)
+    elif obj is False:
+        out.append(0xC2)
+    elif isinstance(obj, int):
+        if -0x20 <= obj < 0x80:
+            # Positive and negative fixint
+            out.append(obj & 0xFF)
+        else:
+            for low, high, fmt, code in _INT_FORMATS:
+                if low <= obj <= high:
+                    out += struct.pack(fmt, code, obj)
+                    break
+            else:
+                raise OverflowError("Integer is out of the MessagePack range")
+    elif isinstance(obj, float):
+        out += struct.pack(">Bd", 0xCB, obj)
+    elif isinstance(obj, str):
+        data = obj.encode()
+        size = len(data)
+        if size < 0x20:
+            out.append(0xA0 | size)
+        elif size <= 0xFF:
+            out += struct.pack(">BB", 0xD9, size)
+        elif size <= 0xFFFF:
+            out += struct.pack(">BH", 0xDA, size)
+        else:
+            out += struct.pack(">BI", 0xDB, size)
+        out += data
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        data = bytes(obj)
+        size = len(data)
+        if size <= 0xFF:
+            out += struct.pack(">BB", 0xC4, size)
+        elif size <= 0xFFFF:
+            out += struct.pack(">BH", 0xC5, size)
+        else:
+            out += struct.pack(">BI", 0xC6, size)
+        out += data
+    elif isinstance(obj, (list, tuple)):
+        size = len(obj)
+        if size < 0x10:
+            out.append(0x90 | size)
+        elif size <= 0xFFFF:
+            out += struct.pack(">BH", 0xDC, size)
+        else:
+            out += struct.pack(">BI", 0xDD, size)
+        for item in obj:
+            _pack(item, out, default)
+    elif isinstance(obj, dict):
+        size = len(obj)
+        if size < 0x10:
+            out.append(0x80 | size)
+        elif size <= 0xFFFF:
+            out += struct.pack(">BH", 0xDE, size)
+        else:
+            out += struct.pack(">BI", 0xDF, size)
+        for key, value in obj.items():
+            _pack(key, out, default)
+            _pack(value, out, default)
+    else:
+        _pack(default(obj), out, default)
+
+
+def packb(obj, default):
+    """
+    Pure-Python MessagePack encoder of JSON-like data.
+    ---
+    Parameters:
+    - obj: Data to encode
+    - default: Function that converts unsupported values into supported ones
+    """
+    out = bytearray()
+    _pack(obj, out, default)
+    return bytes(out)
+
+
+class MessagePackRenderer(renderers.BaseRenderer):
+    """
+    Renderer which serializes to MessagePack.
+    """
+
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+    encoder_class = encoders.JSONEncoder
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        default = self.encoder_class().default
+        if msgpack is not None:
+            return msgpack.packb(data, default=default, use_bin_type=True)
+        return packb(data, default)
@@ -0,0 +1,241 @@
+"""
+Routing of catalog reads to read replicas.
+
+Reads of models from `settings.REPLICA_APPS` go to one of the healthy
+replicas (`replica_<N>` aliases, see `config/settings.py`), everything
+else goes to the primary (`default`) database.
+
+Reads go to the primary as well:
+- inside a transaction;
+- after a catalog write in the same request;
+- for `settings.REPLICA_STICKY_SECONDS` after a catalog write in the same
+  client session, which is tracked with a signed cookie (read-your-writes);
+- within `use_primary()` (e.g. in management commands reading their writes);
+- when no replica is reachable or every replica lags too far behind.
+
+A safe request (GET, HEAD, OPTIONS) that fails with `OperationalError`
+after reading from a replica is retried once on the primary, and the
+replica is not used until its next health check.
+"""
+
+import contextlib
+import contextvars
+import itertools
+import logging
+import time
+
+from django.conf import settings
+from django.db import (DEFAULT_DB_ALIAS, DatabaseError, OperationalError,
+                       connections)
+
+logger = logging.getLogger(__name__)
+
+# State of the current request:
+# {"pinned": bool, "wrote": bool, "replicas": set of aliases read from,
+#  "failed": bool}
+_state = contextvars.ContextVar("replica_state", default=None)
+
+# Last health check of every replica: {alias: (checked_at, healthy)}
+_health = {}
+_round_robin = itertools.count()
+
+# Replication lag in seconds, zero if the replica has replayed everything
+_POSTGRESQL_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery()
+            OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(
+            EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0
+        )
+    END
+"""
+
+
+def replica_aliases():
+    """Database aliases of all configured replicas."""
+    return [alias for alias in settings.DATABASES if alias.startswith("replica_")]
+
+
+def _lag(alias):
+    connection = connections[alias]
+    connection.ensure_connection()
+    if connection.vendor != "postgresql":
+        # No replication to measure (e.g. local SQLite stand-in)
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(_POSTGRESQL_LAG_SQL)
+        return float(cursor.fetchone()[0])
+
+
+def is_healthy(alias):
+    """
+    Check that the replica is reachable and doesn't lag too far behind.
+
+    Result is cached for `settings.REPLICA_CHECK_INTERVAL` seconds.
+    """
+    now = time.monotonic()
+    checked_at, healthy = _health.get(alias, (None, False))
+    if checked_at is not None and now - checked_at < settings.REPLICA_CHECK_INTERVAL:
+        return healthy
+
+    try:
+        lag = _lag(alias)
+        healthy = lag <= settings.REPLICA_MAX_LAG_SECONDS
+        if not healthy:
+            logger.warning("Replica %s lags by %.1f seconds", alias, lag)
+    except DatabaseError:
+        logger.warning("Replica %s is unavailable", alias, exc_info=True)
+        connections[alias].close()
+        healthy = False
+
+    _health[alias] = (now, healthy)
+    return healthy
+
+
+def mark_unavailable(alias):
+    """Stop using the replica until its next health check."""
+    logger.warning("Replica %s failed, using the primary database", alias)
+    connections[alias].close()
+    _health[alias] = (time.monotonic(), False)
+
+
+def _new_state(pinned=False):
+    return {"pinned": pinned, "wrote": False, "replicas": set(), "failed": False}
+
+
+@contextlib.contextmanager
+def use_primary():
+    """
+    Read everything from the primary database within the block
+    (e.g. when replicas must not lag behind the data read before).
+    """
+    state = _state.get()
+    if state is None:
+        token = _state.set(_new_state(pinned=True))
+        try:
+            yield
+        finally:
+            _state.reset(token)
+        return
+
+    pinned = state["pinned"]
+    state["pinned"] = True
+    try:
+        yield
+    finally:
+        state["pinned"] = pinned
+
+
+def read_alias():
+    """
+    Database alias that should serve catalog reads right now.
+    """
+    state = _state.get()
+    if state is not None and (state["pinned"] or state["wrote"]):
+        return DEFAULT_DB_ALIAS
+    if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+        return DEFAULT_DB_ALIAS
+
+    aliases = replica_aliases()
+    if not aliases:
+        return DEFAULT_DB_ALIAS
+    start = next(_round_robin)
+    for offset in range(len(aliases)):
+        alias = aliases[(start + offset) % len(aliases)]
+        if is_healthy(alias):
+            if state is not None:
+                state["replicas"].add(alias)
+            return alias
+    return DEFAULT_DB_ALIAS
+
+
+class ReplicaRouter:
+    """
+    Database router that sends catalog reads to replicas.
+    """
+
+    def db_for_read(self, model, **hints):
+        # Related objects are read from the same database as the instance
+        instance = hints.get("instance")
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        if model._meta.app_label not in settings.REPLICA_APPS:
+            return None
+        return read_alias()
+
+    def db_for_write(self, model, **hints):
+        # Other writes (e.g. of the database cache) don't make replicas stale
+        state = _state.get()
+        if state is not None and model._meta.app_label in settings.REPLICA_APPS:
+            state["wrote"] = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Every database holds the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive the schema through replication
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaStickinessMiddleware:
+    """
+    Pin the client to the primary database for a short time after a write.
+    """
+
+    cookie_name = "db_pinned"
+    cookie_salt = "common.replicas"
+    # Requests that are retried on the primary after a replica failed
+    retry_methods = ("GET", "HEAD", "OPTIONS")
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        pinned = bool(
+            request.get_signed_cookie(
+                self.cookie_name,
+                default=None,
+                salt=self.cookie_salt,
+                max_age=settings.REPLICA_STICKY_SECONDS,
+            )
+        )
+        state = _new_state(pinned)
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+            if (
+                state["failed"]
+                and not state["wrote"]
+                and request.method in self.retry_methods
+            ):
+                for alias in state["replicas"]:
+                    mark_unavailable(alias)
+                response.close()
+                state.update(_new_state(pinned=True))
+                response = self.get_response(request)
+        finally:
+            _state.reset(token)
+
+        if state["wrote"]:
+            response.set_signed_cookie(
+                self.cookie_name,
+                "1",
+                salt=self.cookie_salt,
+                max_age=settings.REPLICA_STICKY_SECONDS,
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
+
+    def process_exception(self, request, exception):
+        # Views' exceptions are turned into responses before they get
+        # to `__call__()`, remember the failure to retry the request
+        state = _state.get()
+        if (
+            isinstance(exception, OperationalError)
+            and state is not None
+            and state["replicas"]
+        ):
+            state["failed"] = True
@@ -0,0 +1,372 @@
+import os
+import tempfile
+import time
+from unittest import mock
+
+from django.core.cache.backends.db import DatabaseCache
+from django.core.signals import request_finished
+from django.db import OperationalError
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from apps.datasets.models import Dataset
+from common import admission, analysis, profiling, replicas
+
+
+class AnalysisTests(SimpleTestCase):
+    def test_stem(self):
+        for words, expected in (
+            (["сегментация", "сегментации", "сегментацию"], "сегментац"),
+            (["легкие", "лёгких", "Лёгкие"], "легк"),
+            (["image", "images", "imaging"], "imag"),
+            (["classification", "classifications"], "class"),
+            # Too short to lose the ending, "ss" isn't a plural
+            (["glass"], "glass"),
+            (["МРТ"], "мрт"),
+            # Numbers and mixed words are kept
+            (["T1"], "t1"),
+            (["covid19"], "covid19"),
+        ):
+            for word in words:
+                with self.subTest(word=word):
+                    self.assertEqual(analysis.analyze(word), [expected])
+
+    def test_normalize(self):
+        for text, expected in (
+            ("Ёлка", "елка"),
+            ("ＭＲＩ", "mri"),
+            ("ﬁbrosis", "fibrosis"),
+        ):
+            with self.subTest(text=text):
+                self.assertEqual(analysis.normalize(text), expected)
+
+    def test_stop_words(self):
+        for query, expected in (
+            ("the", ()),
+            ("и", ()),
+            ("The images of lungs", ("imag", "lung")),
+            ("снимки и маски", ("снимк", "маск")),
+        ):
+            with self.subTest(query=query):
+                self.assertEqual(analysis.analyze_query(query), expected)
+
+    def test_index_text(self):
+        self.assertEqual(
+            analysis.index_text("Сегментация лёгких на КТ", None, "лёгкие images"),
+            " сегментац легк кт imag ",
+        )
+        self.assertEqual(analysis.index_text("the", ""), "")
+
+
+class SharedTokenBucketsTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.buckets = admission.SharedTokenBuckets(
+            os.path.join(directory.name, "buckets"), slots=16
+        )
+        self.now = 1000.0
+        patch = mock.patch.object(admission.time, "time", lambda: self.now)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_burst_then_wait(self):
+        for _ in range(3):
+            self.assertEqual(self.buckets.take("client", rate=2, burst=3), 0)
+        # The bucket is empty, the next token comes in 1 / rate seconds
+        self.assertAlmostEqual(self.buckets.take("client", rate=2, burst=3), 0.5)
+
+    def test_refill(self):
+        for _ in range(3):
+            self.buckets.take("client", rate=2, burst=3)
+        self.now += 0.25
+        self.assertAlmostEqual(self.buckets.take("client", rate=2, burst=3), 0.25)
+        self.now += 0.25
+        self.assertEqual(self.buckets.take("client", rate=2, burst=3), 0)
+        self.assertAlmostEqual(self.buckets.take("client", rate=2, burst=3), 0.5)
+
+    def test_refill_is_capped_by_burst(self):
+        self.buckets.take("client", rate=2, burst=3)
+        self.now += 3600
+        for _ in range(3):
+            self.assertEqual(self.buckets.take("client", rate=2, burst=3), 0)
+        self.assertGreater(self.buckets.take("client", rate=2, burst=3), 0)
+
+    def test_clients_are_independent(self):
+        self.buckets.take("client", rate=1, burst=1)
+        self.assertGreater(self.buckets.take("client", rate=1, burst=1), 0)
+        self.assertEqual(self.buckets.take("other", rate=1, burst=1), 0)
+
+    def test_colliding_clients_share_bucket(self):
+        buckets = admission.SharedTokenBuckets(self.buckets.path + "-1", slots=1)
+        self.addCleanup(os.unlink, buckets.path)
+        buckets.take("client", rate=1, burst=1)
+        self.assertGreater(buckets.take("other", rate=1, burst=1), 0)
+
+    def test_many_tokens(self):
+        self.assertEqual(self.buckets.take("client", rate=2, burst=3, tokens=2), 0)
+        self.assertAlmostEqual(
+            self.buckets.take("client", rate=2, burst=3, tokens=2), 0.5
+        )
+        # More tokens than the bucket holds wait for a full bucket
+        self.assertAlmostEqual(
+            self.buckets.take("client", rate=2, burst=3, tokens=10), 1
+        )
+
+    def test_buckets_are_shared_through_the_file(self):
+        self.buckets.take("client", rate=1, burst=1)
+        other_process = admission.SharedTokenBuckets(self.buckets.path, slots=16)
+        self.assertGreater(other_process.take("client", rate=1, burst=1), 0)
+
+
+class ConcurrencyLimiterTests(SimpleTestCase):
+    def test_rejects_when_deadline_cant_be_met(self):
+        limiter = admission.ConcurrencyLimiter(concurrency=1, queue_size=4, timeout=1)
+        limiter.service_time = 2
+        self.assertEqual(limiter.acquire(), (True, False, 0))
+        admitted, waited, retry_after = limiter.acquire()
+        self.assertFalse(admitted)
+        self.assertFalse(waited)
+        self.assertEqual(retry_after, 2)
+
+    def test_release_updates_service_time(self):
+        limiter = admission.ConcurrencyLimiter(concurrency=1)
+        limiter.acquire()
+        limiter.release(elapsed=1.1)
+        self.assertAlmostEqual(limiter.service_time, 0.1 + 0.2 * (1.1 - 0.1))
+        self.assertTrue(limiter.try_acquire())
+
+
+class AdmissionControlMiddlewareTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        buckets = admission.SharedTokenBuckets(
+            os.path.join(directory.name, "buckets"), slots=16
+        )
+        patch = mock.patch.object(admission, "_get_buckets", return_value=buckets)
+        patch.start()
+        self.addCleanup(patch.stop)
+        settings = override_settings(
+            ADMISSION_CONTROL={
+                "RATE": 1,
+                "BURST": 3,
+                "TRUSTED_PROXIES": ["10.0.0.0/8"],
+                "ROUTES": {
+                    "/search/batch/": {
+                        "METHODS": ["POST"],
+                        "COST_FIELD": "items",
+                        "CONCURRENCY": 1,
+                    },
+                    "/search/": {"METHODS": ["POST"], "CONCURRENCY": 1},
+                },
+            }
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.factory = RequestFactory()
+        self.middleware = admission.AdmissionControlMiddleware(
+            lambda request: HttpResponse("ok")
+        )
+
+    def _post(self, path, items=None, **extra):
+        data = {} if items is None else {"items": [{"query": "mri"}] * items}
+        return self.middleware(
+            self.factory.post(path, data, content_type="application/json", **extra)
+        )
+
+    def test_batch_takes_token_per_item(self):
+        self.assertEqual(self._post("/search/batch/", items=2).status_code, 200)
+        self.assertEqual(self._post("/search/batch/", items=2).status_code, 429)
+        self.assertEqual(self._post("/search/batch/", items=1).status_code, 200)
+        # Other routes have their own buckets
+        self.assertEqual(self._post("/search/").status_code, 200)
+
+    def test_client_address(self):
+        for remote, forwarded, expected in (
+            ("192.0.2.1", "", "192.0.2.1"),
+            # Untrusted proxies can't pretend to be someone else
+            ("192.0.2.1", "198.51.100.1", "192.0.2.1"),
+            ("10.0.0.1", "198.51.100.1", "198.51.100.1"),
+            ("10.0.0.1", "203.0.113.1, 198.51.100.1, 10.0.0.2", "198.51.100.1"),
+            ("10.0.0.1", "", "10.0.0.1"),
+        ):
+            with self.subTest(remote=remote, forwarded=forwarded):
+                request = self.factory.get(
+                    "/", REMOTE_ADDR=remote, HTTP_X_FORWARDED_FOR=forwarded
+                )
+                self.assertEqual(admission.client_address(request), expected)
+
+
+class ReplicaStickinessMiddlewareTests(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.aliases = []
+        self.responses = []
+        patches = [
+            mock.patch.object(replicas, "replica_aliases", return_value=["replica_1"]),
+            mock.patch.object(replicas, "is_healthy", return_value=True),
+            mock.patch.object(replicas, "mark_unavailable"),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def _middleware(self, view):
+        def get_response(request):
+            # Exceptions are handled the way Django's handler does
+            try:
+                response = view(request)
+            except Exception as exception:
+                middleware.process_exception(request, exception)
+                response = HttpResponse(status=500)
+            self.responses.append(response)
+            return response
+
+        middleware = replicas.ReplicaStickinessMiddleware(get_response)
+        return middleware
+
+    def _failing_replica_view(self, request):
+        alias = replicas.read_alias()
+        self.aliases.append(alias)
+        if alias != "default":
+            raise OperationalError("server closed the connection unexpectedly")
+        return HttpResponse("ok")
+
+    def test_read_is_retried_on_primary(self):
+        response = self._middleware(self._failing_replica_view)(
+            self.factory.get("/api/datasets/")
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.aliases, ["replica_1", "default"])
+        replicas.mark_unavailable.assert_called_once_with("replica_1")
+        # The failed response is discarded
+        self.assertTrue(self.responses[0].closed)
+
+    def test_unsafe_request_is_not_retried(self):
+        response = self._middleware(self._failing_replica_view)(
+            self.factory.post("/api/datasets/")
+        )
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(self.aliases, ["replica_1"])
+
+    def test_primary_failure_is_not_retried(self):
+        def view(request):
+            self.aliases.append(replicas.DEFAULT_DB_ALIAS)
+            raise OperationalError("database is locked")
+
+        response = self._middleware(view)(self.factory.get("/api/datasets/"))
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(self.aliases, ["default"])
+        replicas.mark_unavailable.assert_not_called()
+
+    def test_catalog_write_pins_client(self):
+        def view(request):
+            replicas.ReplicaRouter().db_for_write(Dataset)
+            self.aliases.append(replicas.read_alias())
+            return HttpResponse("ok")
+
+        response = self._middleware(view)(self.factory.get("/api/datasets/"))
+
+        self.assertEqual(self.aliases, ["default"])
+        self.assertIn(
+            replicas.ReplicaStickinessMiddleware.cookie_name, response.cookies
+        )
+
+    def test_cache_write_doesnt_pin_client(self):
+        cache = DatabaseCache("medagg_cache", {})
+
+        def view(request):
+            replicas.ReplicaRouter().db_for_write(cache.cache_model_class)
+            self.aliases.append(replicas.read_alias())
+            return HttpResponse("ok")
+
+        response = self._middleware(view)(self.factory.get("/api/datasets/"))
+
+        self.assertEqual(self.aliases, ["replica_1"])
+        self.assertNotIn(
+            replicas.ReplicaStickinessMiddleware.cookie_name, response.cookies
+        )
+
+    def test_write_outside_of_request(self):
+        replicas.ReplicaRouter().db_for_write(Dataset)
+
+        self.assertIsNone(replicas._state.get())
+
+    def test_use_primary(self):
+        def view(request):
+            with replicas.use_primary():
+                self.aliases.append(replicas.read_alias())
+            self.aliases.append(replicas.read_alias())
+            return HttpResponse("ok")
+
+        self._middleware(view)(self.factory.get("/api/datasets/changes/"))
+
+        self.assertEqual(self.aliases, ["default", "replica_1"])
+
+
+class ProfilingMiddlewareTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings = override_settings(
+            PROFILING={
+                "SAMPLE_RATE": 0,
+                "DIR": self.directory,
+                "MAX_FILES": 2,
+                "SLOW_QUERY_MS": 0,
+            }
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.factory = RequestFactory()
+        self.middleware = profiling.ProfilingMiddleware(
+            lambda request: HttpResponse("ok")
+        )
+
+    def _get(self, token=None):
+        headers = {} if token is None else {"X-Profile": token}
+        response = self.middleware(self.factory.get("/", headers=headers))
+        request_finished.send(sender=self.__class__)
+        return response
+
+    def test_valid_token(self):
+        response = self._get(profiling.create_token(60))
+
+        profile_id = response["X-Profile-Id"]
+        self.assertIn("total;dur=", response["Server-Timing"])
+        self.assertEqual(
+            sorted(os.listdir(self.directory)),
+            [f"{profile_id}.json", f"{profile_id}.prof"],
+        )
+
+    def test_unsigned_token(self):
+        expires = int(time.time()) + 60
+        for token in ("1", str(expires), profiling.create_token(60) + "x"):
+            with self.subTest(token=token):
+                response = self._get(token)
+                self.assertNotIn("X-Profile-Id", response)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_expired_token(self):
+        response = self._get(profiling.create_token(-1))
+
+        self.assertNotIn("X-Profile-Id", response)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_oldest_profiles_are_removed(self):
+        profile_ids = [
+            self._get(profiling.create_token(60))["X-Profile-Id"] for _ in range(4)
+        ]
+
+        # Ids sort in the order profiles were taken
+        self.assertEqual(sorted(profile_ids), profile_ids)
+        kept = profile_ids[-2:]
+        self.assertEqual(
+            sorted(os.listdir(self.directory)),
+            sorted(f"{id}{suffix}" for id in kept for suffix in (".json", ".prof")),
+        )
@@ -18,6 +18,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent.parent
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
 
 import os
+import tempfile
 
 SECRET_KEY = os.environ.get("DJANGO_SECRET_KEY")
 
@@ -44,6 +45,11 @@ INSTALLED_APPS = [
 ]
 
 REST_FRAMEWORK = {
+    "DEFAULT_RENDERER_CLASSES": [
+        "common.renderers.FastJSONRenderer",
+        "common.renderers.MessagePackRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
     "PAGE_SIZE": 20,
     "DEFAULT_FILTER_BACKENDS": [
@@ -53,15 +59,111 @@ REST_FRAMEWORK = {
 }
 
 MIDDLEWARE = [
+    "common.profiling.ProfilingMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    "common.compression.CompressionMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
+    "common.replicas.ReplicaStickinessMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "common.admission.AdmissionControlMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+# Request profiling and slow query log, see `common/profiling.py`
+PROFILING = {
+    # Share of requests profiled without a token (0 to 1)
+    "SAMPLE_RATE": float(os.environ.get("PROFILING_SAMPLE_RATE", 0)),
+    # Directory with profiles of requests
+    "DIR": os.environ.get(
+        "PROFILING_DIR", os.path.join(tempfile.gettempdir(), "medagg-profiles")
+    ),
+    # Number of the latest profiles kept in the directory (0 keeps all)
+    "MAX_FILES": int(os.environ.get("PROFILING_MAX_FILES", 200)),
+    # Queries slower than this number of milliseconds are logged (0 turns it off)
+    "SLOW_QUERY_MS": float(os.environ.get("PROFILING_SLOW_QUERY_MS", 0)),
+}
+
+# Response compression, see `common/compression.py`
+COMPRESSION = {
+    # Smaller bodies aren't compressed
+    "MIN_SIZE": int(os.environ.get("COMPRESSION_MIN_SIZE", 1024)),
+    # Larger bodies are compressed while they're being sent
+    "STREAM_SIZE": int(os.environ.get("COMPRESSION_STREAM_SIZE", 1024 * 1024)),
+    # Compressed content types
+    "TYPES": [
+        "application/json",
+        "application/msgpack",
+        "application/x-ndjson",
+        "text/csv",
+        "text/plain",
+        "text/tab-separated-values",
+    ],
+    # Levels that favour speed over ratio
+    "LEVELS": {"zstd": 3, "br": 4, "gzip": 5},
+}
+
+# Downloads of local dataset files, see `apps/datasets/downloads.py`
+DOWNLOADS = {
+    # Directory local paths of datasets must be under (any path if empty)
+    "ROOT": os.environ.get("DOWNLOADS_ROOT", ""),
+    # Files are sent by the web server: "x-accel-redirect" (nginx)
+    # or "x-sendfile" (Apache, lighttpd), by the WSGI server if empty
+    "OFFLOAD": os.environ.get("DOWNLOADS_OFFLOAD", "").lower(),
+    # Internal nginx location that serves the downloads root
+    "ACCEL_PREFIX": os.environ.get("DOWNLOADS_ACCEL_PREFIX", "/protected/"),
+    # Bytes of a file read at once into zip archives
+    "CHUNK_SIZE": int(os.environ.get("DOWNLOADS_CHUNK_SIZE", 1024 * 1024)),
+}
+
+# Admission control, see `common/admission.py`
+ADMISSION_CONTROL = {
+    # Per-client rate limit: requests per second and bucket capacity
+    "RATE": float(os.environ.get("ADMISSION_RATE", 10)),
+    "BURST": int(os.environ.get("ADMISSION_BURST", 20)),
+    # File with rate limits shared by worker processes
+    "SHARED_MEMORY": os.environ.get(
+        "ADMISSION_SHARED_MEMORY",
+        os.path.join(tempfile.gettempdir(), "medagg-admission"),
+    ),
+    # Proxies (addresses or networks) whose `X-Forwarded-For` identifies clients
+    "TRUSTED_PROXIES": [
+        p for p in os.environ.get("ADMISSION_TRUSTED_PROXIES", "").split(",") if p
+    ],
+    # Limited routes (path prefixes, the first matching one applies).
+    # Concurrency limits and queues are kept by every worker process (thread)
+    # on its own: the server as a whole processes up to CONCURRENCY x number
+    # of workers requests at once, so set them with the number of gunicorn
+    # workers in mind.
+    "ROUTES": {
+        "/api/v1/search/datasets/batch/": {
+            "METHODS": ["POST"],
+            # Every search of a batch takes a token, a full batch fits the bucket
+            "COST_FIELD": "items",
+            "BURST": int(os.environ.get("ADMISSION_BATCH_BURST", 500)),
+            "CONCURRENCY": int(os.environ.get("ADMISSION_BATCH_CONCURRENCY", 1)),
+            "QUEUE": int(os.environ.get("ADMISSION_BATCH_QUEUE", 4)),
+            "TIMEOUT": float(os.environ.get("ADMISSION_BATCH_TIMEOUT", 5)),
+        },
+        "/api/v1/search/datasets/": {
+            "METHODS": ["POST"],
+            "CONCURRENCY": int(os.environ.get("ADMISSION_SEARCH_CONCURRENCY", 4)),
+            "QUEUE": int(os.environ.get("ADMISSION_SEARCH_QUEUE", 16)),
+            # Maximum time in the queue (seconds)
+            "TIMEOUT": float(os.environ.get("ADMISSION_SEARCH_TIMEOUT", 2)),
+        },
+    },
+    # Expensive engines, searches fall back to cheaper results when saturated
+    # (per worker process as well)
+    "ENGINES": {
+        "semantic": {
+            "CONCURRENCY": int(os.environ.get("ADMISSION_SEMANTIC_CONCURRENCY", 2)),
+        },
+    },
+}
+
 ROOT_URLCONF = "config.urls"
 
 TEMPLATES = [
@@ -98,6 +200,90 @@ DATABASES = {
     }
 }
 
+# Read replicas
+# Catalog reads (models of `REPLICA_APPS`) are routed to replicas,
+# see `common/replicas.py`. Replicas share credentials with `default`,
+# but can override its host, port and name. E.g. locally, a copy of the
+# SQLite database stands in as a replica:
+#   cp db.sqlite3 db-replica.sqlite3
+#   DB_REPLICA_NAMES=db-replica.sqlite3 python manage.py runserver
+
+_replica_hosts = [h for h in os.environ.get("DB_REPLICA_HOSTS", "").split(",") if h]
+_replica_names = [n for n in os.environ.get("DB_REPLICA_NAMES", "").split(",") if n]
+
+for _index in range(max(len(_replica_hosts), len(_replica_names))):
+    _host, _, _port = (
+        _replica_hosts[_index].partition(":")
+        if _index < len(_replica_hosts)
+        else ("", "", "")
+    )
+    DATABASES[f"replica_{_index + 1}"] = {
+        **DATABASES["default"],
+        "HOST": _host or DATABASES["default"]["HOST"],
+        "PORT": _port or DATABASES["default"]["PORT"],
+        "NAME": (
+            _replica_names[_index]
+            if _index < len(_replica_names)
+            else DATABASES["default"]["NAME"]
+        ),
+        "TEST": {"MIRROR": "default"},
+    }
+
+DATABASE_ROUTERS = ["common.replicas.ReplicaRouter"]
+
+REPLICA_APPS = ["datasets"]
+
+# Reads stay on the primary for this long after a client's write
+REPLICA_STICKY_SECONDS = int(os.environ.get("DB_REPLICA_STICKY_SECONDS", 5))
+
+# Replicas lagging behind more than this are not used
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get("DB_REPLICA_MAX_LAG_SECONDS", 10))
+
+# How often the health of a replica is checked
+REPLICA_CHECK_INTERVAL = float(os.environ.get("DB_REPLICA_CHECK_INTERVAL", 5))
+
+# Search results are cached by `SearchService`, use a backend shared by
+# worker processes (e.g. Redis) so `prewarm_search` warms all of them.
+# The generation of the catalog (see `CatalogSnapshotService`) must be seen by
+# every process, it's kept in a database table (`createcachetable`) that
+# is only written when the catalog changes. Search results aren't put there,
+# the database cache counts its rows and writes one on every cached search.
+CACHES = {
+    "default": {
+        "BACKEND": os.environ.get(
+            "CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"
+        ),
+        "LOCATION": os.environ.get("CACHE_LOCATION", ""),
+    },
+    "catalog": {
+        "BACKEND": os.environ.get(
+            "CATALOG_CACHE_BACKEND", "django.core.cache.backends.db.DatabaseCache"
+        ),
+        "LOCATION": os.environ.get("CATALOG_CACHE_LOCATION", "medagg_cache"),
+    },
+}
+
+# Number of seconds search results are cached for (0 disables the cache)
+SEARCH_CACHE_TIMEOUT = int(os.environ.get("SEARCH_CACHE_TIMEOUT", 300))
+
+# Search log, see `apps/search/analytics.py`
+SEARCH_LOG = {
+    "ENABLED": os.environ.get("SEARCH_LOG_ENABLED", "1") == "1",
+    # Number of entries written to the database at once
+    "BATCH_SIZE": int(os.environ.get("SEARCH_LOG_BATCH_SIZE", 200)),
+    # Maximum number of seconds entries are kept in memory
+    "FLUSH_INTERVAL": float(os.environ.get("SEARCH_LOG_FLUSH_INTERVAL", 5)),
+    # Oldest entries are dropped when the buffer is full
+    "MAX_BUFFER": int(os.environ.get("SEARCH_LOG_MAX_BUFFER", 10000)),
+}
+
+
+# Memory-mapped catalog snapshots shared by worker processes,
+# see `apps/datasets/snapshot.py` (built by `build_catalog_snapshot`)
+CATALOG_SNAPSHOT_DIR = os.environ.get(
+    "CATALOG_SNAPSHOT_DIR", os.path.join(tempfile.gettempdir(), "medagg-snapshots")
+)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators